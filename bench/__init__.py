@@ -0,0 +1,276 @@
+
+# 
+# Cpppo -- Communication Protocol Python Parser and Originator
+# 
+# Copyright (c) 2013, Hard Consulting Corporation.
+# 
+# Cpppo is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.  See the LICENSE file at the top of the source tree.
+# 
+# Cpppo is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+# 
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry@hardconsulting.com"
+__copyright__                   = "Copyright (c) 2013 Hard Consulting Corporation"
+__license__                     = "Dual License: GPLv3 (or later) and Commercial (see LICENSE)"
+
+"""
+cpppo.bench -- Repeatable, comparable throughput measurements of named scenarios
+
+Each scenario (see cpppo.bench.suite) exercises one part of Cpppo -- parsing captured
+EtherNet/IP frames, Read Tag round trips to an EtherNet/IP server, UDT decoding, history playback,
+Modbus range merging and polling -- and reports the rate of operations per second.  Results are
+JSON, including a description of the environment, and may be compared against a saved baseline:
+
+    python -m cpppo.bench --list
+    python -m cpppo.bench --output baseline.json
+    ...
+    python -m cpppo.bench --compare baseline.json 'read_tag*'
+
+Any scenario whose rate falls more than --tolerance (default: 10%) below the baseline's is
+reported as a regression, and the command fails.
+
+"""
+__all__				= [ 'scenario', 'scenarios', 'select', 'environment', 'run', 'compare', 'main' ]
+
+import argparse
+import contextlib
+import fnmatch
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import traceback
+
+from .. import misc
+from ..automata import log_cfg
+from ..version import __version__
+
+log				= logging.getLogger( "bench" )
+
+REPEAT				= 3		# Timed repetitions of each scenario; the best is reported
+TOLERANCE			= 0.10		# Fractional loss of rate vs. baseline deemed a regression
+
+scenarios			= {}		# { <name>: (<function>,<params>), ... }
+
+
+def scenario( name, **params ):
+    """Register the decorated generator function as the named benchmark scenario, invoked with the
+    keyword 'params'.  It performs any setup, yields a trial function (which performs one timed
+    repetition and returns the number of operations performed), and then performs any teardown.
+    An ImportError raised during setup (ie. a missing optional dependency) skips the scenario.  The
+    same function may be registered under several names, with differing params.
+
+    """
+    def decorator( function ):
+        assert name not in scenarios, "Duplicate benchmark scenario %r" % name
+        scenarios[name]		= ( function, params )
+        return function
+    return decorator
+
+
+def select( patterns=None ):
+    """Return the (sorted) names of the scenarios matching any of the glob 'patterns' (default: all).
+    Raises a KeyError if any pattern matches no scenario."""
+    names			= sorted( scenarios )
+    if not patterns:
+        return names
+    chosen			= set()
+    for pattern in patterns:
+        matched			= fnmatch.filter( names, pattern )
+        if not matched:
+            raise KeyError( "No benchmark scenario matches %r; choose from: %s" % (
+                pattern, ', '.join( names )))
+        chosen.update( matched )
+    return sorted( chosen )
+
+
+def environment():
+    """Describe the environment the benchmarks were run in; rates are only comparable between
+    similar environments."""
+    return dict(
+        cpppo		= __version__,
+        python		= platform.python_version(),
+        implementation	= platform.python_implementation(),
+        platform	= platform.platform(),
+        machine		= platform.machine(),
+        processor	= platform.processor(),
+        cpus		= os.cpu_count(),
+        node		= platform.node(),
+        time		= time.strftime( "%Y-%m-%dT%H:%M:%SZ", time.gmtime() ),
+    )
+
+
+def run( names=None, repeat=REPEAT, scale=None ):
+    """Run the named scenarios (default: all), each 'repeat' times, returning the JSON-compatible
+    results.  If a 'scale' is supplied, each scenario's 'count' of operations is scaled by it.
+    Each scenario's 'rate' is that of its best repetition, and 'median' that of its median:
+
+        {
+            "environment":	{ "cpppo": "5.2.5", "python": "3.11.2", ... },
+            "repeat":		3,
+            "scenarios": {
+                "enip_parse": {
+                    "params":		{ "count": 1000 },
+                    "operations":	1000,
+                    "seconds":		[ 1.52, 1.49, 1.50 ],
+                    "rate":		671.1,
+                    "median":		666.7
+                },
+                "modbus_poll": {
+                    "params":		{ ... },
+                    "skipped":		"No module named 'pymodbus'"
+                },
+                ...
+            }
+        }
+
+    A scenario that fails is reported with its "failed" traceback, instead of its rates.
+
+    """
+    results			= dict( environment=environment(), repeat=repeat, scenarios={} )
+    for name in ( select() if names is None else names ):
+        function,params		= scenarios[name]
+        params			= dict( params )
+        if scale and 'count' in params:
+            params['count']	= max( 1, int( params['count'] * scale ))
+        result			= results['scenarios'][name] = dict( params=params )
+        seconds			= []
+        try:
+            with contextlib.contextmanager( function )( **params ) as trial:
+                for _ in range( repeat ):
+                    begun	= misc.timer()
+                    operations	= trial()
+                    seconds.append( misc.timer() - begun )
+        except ImportError as exc:
+            log.normal( "Benchmark %-24s skipped: %s", name, exc )
+            result['skipped']	= str( exc )
+            continue
+        except Exception as exc:
+            log.warning( "Benchmark %-24s failed: %s", name, exc )
+            result['failed']	= traceback.format_exc()
+            continue
+        median			= sorted( seconds )[len( seconds ) // 2]
+        result.update(
+            operations	= operations,
+            seconds	= seconds,
+            rate	= operations / max( min( seconds ), 1e-9 ),
+            median	= operations / max( median, 1e-9 ),
+        )
+        log.normal( "Benchmark %-24s %12.1f/s", name, result['rate'] )
+    return results
+
+
+def compare( results, baseline, tolerance=TOLERANCE ):
+    """Compare the rates of each scenario in 'results' against the same scenario in 'baseline',
+    returning a list of (<name>,<baseline>,<rate>,<regressed>).  A scenario has regressed if its
+    rate is more than 'tolerance' (a fraction) below the baseline's.  Scenarios without a rate in
+    both are ignored."""
+    ours			= results.get( 'environment', {} )
+    theirs			= baseline.get( 'environment', {} )
+    differs			= [ k for k in ( 'python', 'implementation', 'machine', 'processor', 'cpus' )
+                                    if ours.get( k ) != theirs.get( k ) ]
+    if differs:
+        log.warning( "Benchmark environment differs from the baseline's: %s", ', '.join(
+            "%s %s vs. %s" % ( k, ours.get( k ), theirs.get( k )) for k in differs ))
+    comparisons			= []
+    for name,result in sorted( results.get( 'scenarios', {} ).items() ):
+        prior			= baseline.get( 'scenarios', {} ).get( name, {} )
+        if 'rate' not in result or 'rate' not in prior:
+            continue
+        comparisons.append( (name, prior['rate'], result['rate'],
+                             result['rate'] < prior['rate'] * ( 1 - tolerance )) )
+    return comparisons
+
+
+def main( argv=None ):
+    """Run the selected benchmark scenarios, report their rates, optionally save the JSON results and
+    compare them to a baseline.  Returns non-zero if any scenario failed or regressed."""
+    ap				= argparse.ArgumentParser(
+        description	= "Measure Cpppo throughput in named benchmark scenarios",
+        epilog		= "Scenario names may be glob patterns, eg. 'read_tag*'" )
+    ap.add_argument( '-v', '--verbose', action="count", default=0,
+                     help="Display logging information." )
+    ap.add_argument( '-l', '--list', action="store_true",
+                     help="List the available scenarios, and exit" )
+    ap.add_argument( '-r', '--repeat', type=int, default=REPEAT,
+                     help="Timed repetitions of each scenario (default: %d)" % REPEAT )
+    ap.add_argument( '-s', '--scale', type=float, default=None,
+                     help="Scale the operation count of each scenario (eg. .1 for a quick run)" )
+    ap.add_argument( '-o', '--output', default=None,
+                     help="Save the JSON results to the file ('-' for stdout)" )
+    ap.add_argument( '-c', '--compare', default=None,
+                     help="Compare the results against the JSON baseline in the file" )
+    ap.add_argument( '-t', '--tolerance', type=float, default=TOLERANCE,
+                     help="Fractional loss of rate deemed a regression (default: %s)" % TOLERANCE )
+    ap.add_argument( 'scenario', nargs="*",
+                     help="Scenarios to run (default: all)" )
+    args			= ap.parse_args( argv )
+
+    levelmap 			= {
+        0: logging.WARNING,
+        1: logging.NORMAL,
+        2: logging.DETAIL,
+        3: logging.INFO,
+        4: logging.DEBUG,
+        }
+    log_cfg['level']		= ( levelmap[args.verbose]
+                                    if args.verbose in levelmap
+                                    else logging.DEBUG )
+    logging.basicConfig( **log_cfg )
+    if args.verbose:
+        logging.getLogger().setLevel( log_cfg['level'] )
+
+    names			= select( args.scenario )
+    if args.list:
+        for name in names:
+            function,params	= scenarios[name]
+            print( "%-24s %s%s" % (
+                name, ( function.__doc__ or '' ).strip().split( '\n' )[0],
+                ''.join( "; %s=%r" % kv for kv in sorted( params.items() ))))
+        return 0
+
+    baseline			= None
+    if args.compare:
+        with open( args.compare, 'r' ) as f:
+            baseline		= json.load( f )
+
+    results			= run( names, repeat=args.repeat, scale=args.scale )
+
+    if args.output:
+        with ( contextlib.nullcontext( sys.stdout ) if args.output == '-'
+               else open( args.output, 'w' )) as f:
+            json.dump( results, f, indent=4, sort_keys=True )
+            f.write( '\n' )
+    # Human-readable summary; to stderr, if the JSON results are going to stdout
+    out				= sys.stderr if args.output == '-' else sys.stdout
+    failures			= 0
+    for name,result in sorted( results['scenarios'].items() ):
+        if 'rate' in result:
+            print( "%-24s %12.1f/s (median %12.1f/s) over %d x %d operations" % (
+                name, result['rate'], result['median'], args.repeat, result['operations'] ), file=out )
+        elif 'skipped' in result:
+            print( "%-24s %12s   (%s)" % ( name, "skipped", result['skipped'] ), file=out )
+        else:
+            print( "%-24s %12s\n%s" % ( name, "FAILED", result['failed'] ), file=out )
+            failures	       += 1
+
+    if baseline is not None:
+        for name,prior,rate,regressed in compare( results, baseline, tolerance=args.tolerance ):
+            print( "%-24s %12.1f/s vs. %12.1f/s baseline: %+6.1f%%%s" % (
+                name, rate, prior, ( rate / prior - 1 ) * 100 if prior else 0,
+                "  REGRESSION" if regressed else "" ), file=out )
+            failures	       += regressed
+    return 1 if failures else 0
+
+
+from . import suite			# Registers the standard scenarios
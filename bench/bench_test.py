@@ -0,0 +1,45 @@
+from __future__ import absolute_import, print_function, division
+
+import json
+import pytest
+
+from .. import bench
+
+
+def test_bench_select():
+    assert bench.select() == sorted( bench.scenarios )
+    assert bench.select( [ 'read_tag_d4*', 'enip_parse' ] ) == [ 'enip_parse', 'read_tag_d4', 'read_tag_d4_m500' ]
+    with pytest.raises( KeyError ):
+        bench.select( [ 'nonesuch*' ] )
+
+
+def test_bench_run_compare():
+    results			= bench.run( [ 'enip_parse', 'udt_decode', 'modbus_merge' ], repeat=2, scale=.05 )
+    assert results['repeat'] == 2 and results['environment']['cpppo'] == bench.__version__
+    parse			= results['scenarios']['enip_parse']
+    assert parse['params'] == { 'count': 50 } and parse['operations'] == 50
+    assert len( parse['seconds'] ) == 2 and parse['rate'] >= parse['median'] > 0
+    # Results are JSON, and compare equal to themselves
+    assert json.loads( json.dumps( results )) == results
+    assert all( not regressed for _,_,_,regressed in bench.compare( results, results ))
+
+    # A baseline 20% faster is a regression at the default 10% tolerance, but not at 25%
+    faster			= json.loads( json.dumps( results ))
+    faster['scenarios']['enip_parse']['rate'] *= 1.2
+    regressions			= [ name for name,_,_,regressed in bench.compare( results, faster ) if regressed ]
+    assert regressions == [ 'enip_parse' ]
+    assert not any( regressed for _,_,_,regressed in bench.compare( results, faster, tolerance=.25 ))
+
+
+def test_bench_main( tmp_path ):
+    output			= str( tmp_path / "baseline.json" )
+    assert bench.main( [ '--repeat', '1', '--scale', '.05', '--output', output, 'udt_decode' ] ) == 0
+    with open( output ) as f:
+        baseline		= json.load( f )
+    assert list( baseline['scenarios'] ) == [ 'udt_decode' ]
+
+    # An impossibly fast baseline is a regression
+    baseline['scenarios']['udt_decode']['rate'] *= 1000
+    with open( output, 'w' ) as f:
+        json.dump( baseline, f )
+    assert bench.main( [ '--repeat', '1', '--scale', '.05', '--compare', output, 'udt_decode' ] ) == 1
@@ -0,0 +1,280 @@
+
+# 
+# Cpppo -- Communication Protocol Python Parser and Originator
+# 
+# Copyright (c) 2013, Hard Consulting Corporation.
+# 
+# Cpppo is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.  See the LICENSE file at the top of the source tree.
+# 
+# Cpppo is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+# 
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry@hardconsulting.com"
+__copyright__                   = "Copyright (c) 2013 Hard Consulting Corporation"
+__license__                     = "Dual License: GPLv3 (or later) and Commercial (see LICENSE)"
+
+"""
+cpppo.bench.suite -- The standard benchmark scenarios
+
+Each scenario is self-contained: any server it exercises is started (on a dynamic localhost port)
+and stopped within the scenario, and any data it requires is embedded or generated.  Scenarios
+requiring optional dependencies (eg. pymodbus, pytz) are skipped if they are unavailable.
+
+"""
+__all__				= [ 'FRAMES', 'SENSOR' ]
+
+import asyncio
+import contextlib
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from .. import misc
+from ..dotdict import dotdict, apidict
+from ..automata import chainable
+from ..server.enip import parser, udt, client, device, logix
+from ..server.enip import defaults as enip_defaults
+from . import scenario
+
+# EtherNet/IP requests, from a ControlLogix SCADA read/write capture (see server/enip_test.py):
+# Register Session, Get Attributes All, Read Tag Fragmented, Write Tag, and a Multiple Service
+# Packet of Get Attribute Single requests.
+FRAMES				= [
+    bytes(bytearray([
+        0x65, 0x00, 0x04, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+        0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01, 0x00, 0x00, 0x00,
+    ])),
+    bytes(bytearray([
+        0x6f, 0x00, 0x16, 0x00, 0x01, 0x1e, 0x02, 0x11, 0x00, 0x00, 0x00, 0x00, 0x01, 0x00, 0x00, 0x00,
+        0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x05, 0x00, 0x02, 0x00,
+        0x00, 0x00, 0x00, 0x00, 0xb2, 0x00, 0x06, 0x00, 0x01, 0x02, 0x20, 0x66, 0x24, 0x01,
+    ])),
+    bytes(bytearray([
+        0x6f, 0x00, 0x32, 0x00, 0x02, 0x67, 0x02, 0x10, 0x00, 0x00, 0x00, 0x00, 0x07, 0x00, 0x00, 0x00,
+        0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x05, 0x00, 0x02, 0x00,
+        0x00, 0x00, 0x00, 0x00, 0xb2, 0x00, 0x22, 0x00, 0x52, 0x02, 0x20, 0x06, 0x24, 0x01, 0x05, 0x9d,
+        0x14, 0x00, 0x52, 0x06, 0x91, 0x05, 0x53, 0x43, 0x41, 0x44, 0x41, 0x00, 0x29, 0x00, 0x10, 0x27,
+        0x0a, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01, 0x00, 0x01, 0x00,
+    ])),
+    bytes(bytearray([
+        0x70, 0x00, 0x27, 0x00, 0x01, 0x85, 0x02, 0x14, 0x00, 0x00, 0x00, 0x00, 0x6e, 0x6f, 0x00, 0x00,
+        0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x02, 0x00,
+        0xa1, 0x00, 0x04, 0x00, 0x02, 0x8f, 0x97, 0x01, 0xb1, 0x00, 0x13, 0x00, 0x02, 0x00, 0x4d, 0x05,
+        0x91, 0x07, 0x49, 0x54, 0x45, 0x53, 0x54, 0x4f, 0x50, 0x00, 0xc1, 0x00, 0x01, 0x00, 0xff,
+    ])),
+    bytes(bytearray([
+        0x6f, 0x00, 0x36, 0x00, 0x02, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x30, 0x00, 0x00, 0x00,
+        0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x02, 0x00,
+        0x00, 0x00, 0x00, 0x00, 0xb2, 0x00, 0x26, 0x00, 0x0a, 0x02, 0x20, 0x02, 0x24, 0x01, 0x03, 0x00,
+        0x08, 0x00, 0x10, 0x00, 0x18, 0x00, 0x0e, 0x03, 0x20, 0x93, 0x24, 0x0b, 0x30, 0x0a, 0x0e, 0x03,
+        0x20, 0x93, 0x24, 0x03, 0x30, 0x0a, 0x0e, 0x03, 0x20, 0x93, 0x24, 0x01, 0x30, 0x0a,
+    ])),
+]
+
+
+@scenario( "enip_parse", count=1000 )
+def enip_parse( count ):
+    """Parse captured EtherNet/IP frames from a stream, with one enip_machine"""
+    stream			= b''.join( FRAMES[i % len( FRAMES )] for i in range( count ))
+
+    def trial():
+        source			= chainable( stream )
+        parsed			= 0
+        with parser.enip_machine( context='enip' ) as machine:
+            while source.peek() is not None:
+                data		= dotdict()
+                with contextlib.closing( machine.run( source=source, data=data )) as engine:
+                    for m,s in engine:
+                        pass
+                assert 'enip.command' in data, "Failed to parse EtherNet/IP frame %d" % parsed
+                parsed	       += 1
+        return parsed
+    yield trial
+
+
+@scenario( "read_tag_d0",       count=500, depth=0, multiple=0 )
+@scenario( "read_tag_d1",       count=500, depth=1, multiple=0 )
+@scenario( "read_tag_d4",       count=500, depth=4, multiple=0 )
+@scenario( "read_tag_d4_m500",  count=500, depth=4, multiple=500 )
+def read_tag( count, depth, multiple ):
+    """Read Tag round trips to a localhost EtherNet/IP server, at pipeline depth/multiple"""
+    from ..server.enip.main import main as enip_main
+
+    # Flush out any existing CIP Objects (eg. from a prior server), for a fresh start
+    device.lookup_reset()
+    logix.setup_reset()
+    control			= apidict( enip_defaults.timeout, done=False )
+    server			= threading.Thread( target=enip_main, kwargs=dict(
+        argv	= [ '--address', 'localhost:0', 'SCADA=INT[1000]' ],
+        server	= dict( control=control )))
+    server.daemon		= True
+    server.start()
+    try:
+        # The server_main supplies the dynamically bound address, once it is listening
+        begun			= misc.timer()
+        while 'address' not in control:
+            assert server.is_alive() and misc.timer() - begun < enip_defaults.timeout, \
+                "EtherNet/IP server failed to start"
+            time.sleep( .01 )
+        host,port		= control['address']
+
+        def trial():
+            operations		= client.parse_operations( [ 'SCADA[0-9]' ] * count )
+            done		= 0
+            with client.connector( host=host, port=port, timeout=enip_defaults.timeout ) as conn:
+                for idx,dsc,op,rpy,sts,val in conn.pipeline(
+                        operations=operations, depth=depth, multiple=multiple,
+                        timeout=enip_defaults.timeout ):
+                    assert val is not None, "Read Tag %s failed: %s" % ( dsc, sts )
+                    done       += 1
+            return done
+        yield trial
+    finally:
+        control['done']		= True
+        server.join( timeout=enip_defaults.timeout )
+
+
+# A UDT with a DINT, a (Logix "STRING" struct) string, a REAL array, an INT and a BOOL bit
+STRING				= dict(
+    name	= "STRING",
+    internal_tags = dict(
+        LEN	= dict( offset=0, tag_type="atomic", data_type="DINT", array=0 ),
+        DATA	= dict( offset=4, tag_type="atomic", data_type="SINT", array=82 ),
+    ),
+    attributes	= [ "LEN", "DATA" ],
+    string	= 82,
+    template	= dict( object_definition_size=16, structure_size=88, member_count=2, structure_handle=0x0FCE ),
+)
+SENSOR				= dict(
+    name	= "SENSOR",
+    internal_tags = dict(
+        ID	= dict( offset=0,   tag_type="atomic", data_type="DINT", array=0 ),
+        Name	= dict( offset=4,   tag_type="struct", data_type=STRING, array=0 ),
+        Values	= dict( offset=92,  tag_type="atomic", data_type="REAL", array=4 ),
+        Status	= dict( offset=108, tag_type="atomic", data_type="INT",  array=0 ),
+        Alarm	= dict( offset=110, tag_type="atomic", data_type="BOOL", bit=0 ),
+    ),
+    attributes	= [ "ID", "Name", "Values", "Status", "Alarm" ],
+    template	= dict( object_definition_size=40, structure_size=112, member_count=5, structure_handle=0x1234 ),
+)
+
+
+@scenario( "udt_decode", count=250 )
+def udt_decode( count ):
+    """Decode UDT records (with STRING, REAL[4], BOOL members) via tag_struct"""
+    coder			= udt.tag_struct()
+    records			= [
+        coder.produce( dotdict(
+            ID		= i,
+            Name	= "Sensor %d" % i,
+            Values	= [ i * .5, i * 1.5, i * 2.5, i * 3.5 ],
+            Status	= i % 100,
+            Alarm	= bool( i % 2 ),
+        ), SENSOR )
+        for i in range( count )
+    ]
+
+    def trial():
+        for i,rec in enumerate( records ):
+            record		= coder.parse( rec, SENSOR )
+            assert record.ID == i, "UDT %d decoded incorrectly: %r" % ( i, record )
+        return len( records )
+    yield trial
+
+
+@scenario( "history_replay", count=5000 )
+def history_replay( count ):
+    """Play back history records (as fast as possible) with a history loader"""
+    from ..history import logger, loader	# Requires the optional pytz, tzlocal
+
+    directory			= tempfile.mkdtemp( prefix="cpppo-bench-" )
+    path			= os.path.join( directory, "bench.hst" )
+    try:
+        now			= misc.timer()
+        with logger( path ) as l:
+            for i in range( count ):
+                l.write( { 40001 + i % 100: i, 40200: i, 1: i % 2 }, now=now - count + i )
+
+        def trial():
+            ld			= loader( path, historical=now - count - 1, factor=1e9 )
+            played		= 0
+            while ld:
+                _,events	= ld.load( limit=1000 )
+                played	       += len( events )
+            return played
+        yield trial
+    finally:
+        shutil.rmtree( directory, ignore_errors=True )
+
+
+@scenario( "modbus_merge", count=100, addresses=1000 )
+def modbus_merge( count, addresses ):
+    """Merge scattered Modbus addresses (coils and registers) into poll ranges"""
+    from ..remote.plc_modbus import merge, transaction_cost	# Requires the optional pymodbus
+
+    rnd				= random.Random( 0 )
+    ranges			= [ ( rnd.choice(( 1, 100001, 300001, 400001 )) + rnd.randrange( 5000 ), rnd.randint( 1, 4 ))
+                                    for _ in range( addresses ) ]
+    overhead			= transaction_cost( rtt=.05 )
+
+    def trial():
+        for _ in range( count ):
+            merged		= list( merge( ranges, overhead=overhead ))
+            assert merged
+        return count
+    yield trial
+
+
+@scenario( "modbus_poll",    count=20, registers=2000, pipeline=None )
+@scenario( "modbus_poll_p8", count=20, registers=2000, pipeline=8 )
+def modbus_poll( count, registers, pipeline ):
+    """Poll cycles of scattered registers from a localhost Modbus/TCP server, w/ pipeline"""
+    from pymodbus.framer import FramerType	# Requires the optional pymodbus
+    from ..remote.pymodbus_fixes import modbus_server_tcp, modbus_client_tcp
+    from ..remote.plc_modbus import poller_modbus, merge
+    from ..remote.plc_modbus_async import modbus_loop
+    from ..bin.modbus_sim import register_context
+
+    async def start():
+        srv			= modbus_server_tcp(
+            address=( 'localhost', 0 ), context=register_context( [ '40001-%d=0' % ( 40000 + registers ) ] ),
+            framer=FramerType.SOCKET )
+        task			= asyncio.ensure_future( srv.serve_forever() )
+        while not srv.transport:
+            await asyncio.sleep( .01 )
+        return srv,task
+
+    loop			= modbus_loop()
+    srv,task			= loop.call( start(), timeout=enip_defaults.timeout )
+    plc				= None
+    try:
+        host,port		= srv.transport.sockets[0].getsockname()[:2]
+        plc			= poller_modbus( "bench", client=modbus_client_tcp( host=host, port=port ),
+                                                 pipeline=pipeline )
+        ranges			= list( merge( ( a, 1 ) for a in range( 40001, 40001 + registers, 3 )))
+
+        def trial():
+            polled		= 0
+            for _ in range( count ):
+                for (address,cnt),value,exc in plc._reads( ranges ):
+                    assert exc is None, "Modbus read of %d failed: %s" % ( address, exc )
+                    polled     += 1
+            return polled
+        yield trial
+    finally:
+        if plc:
+            plc.join( timeout=enip_defaults.timeout )
+            plc.client.close()
+        loop.call( srv.shutdown(), timeout=enip_defaults.timeout )
+        loop.stop()
@@ -0,0 +1,76 @@
+#! /usr/bin/env python3
+'''
+history_convert.py -- Convert cpppo.history files between text and binary formats
+
+    Reads a (possibly compressed) history file in either the text (TSV/JSON) or binary blocks
+    format, and writes it in the other (or the specified) format.
+
+EXAMPLE
+
+  history_convert.py --codec lzma registers.hst.1.gz registers.hsb.1
+
+    Converts the compressed text history file into a binary history file, with lzma compressed
+    blocks of (default) 1000 records.
+
+'''
+import argparse
+import logging
+import sys
+
+import cpppo
+from cpppo.history import convert, blocks
+
+
+def main( argv=None ):
+    parser			= argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog = """\
+    Convert a history file between the text and binary blocks formats.  By default, a text
+    history file is converted to binary, and a binary history file to text.
+
+    EXAMPLE
+
+      history_convert --text registers.hsb registers.hst.gz
+
+    """ )
+    parser.add_argument( '-v', '--verbose',
+                         default=0, action="count", help="Display logging information." )
+    parser.add_argument( '-l', '--log',
+                         type=str, default=None, help="Direct log output to the specified file" )
+    parser.add_argument( '-b', '--binary', action='store_true', default=None,
+                         help="Write the binary blocks format" )
+    parser.add_argument( '-t', '--text', dest='binary', action='store_false',
+                         help="Write the text format" )
+    parser.add_argument( '-c', '--codec', default=None, choices=sorted( blocks.CODECS ),
+                         help="Binary block compression codec (default: zlib)" )
+    parser.add_argument( '-B', '--block', type=int, default=None,
+                         help="Records per binary block (default: 1000)" )
+    parser.add_argument( 'source', help="History file to read" )
+    parser.add_argument( 'target', help="History file to write" )
+    args			= parser.parse_args( argv )
+
+    # Deduce logging level and target file (if any)
+    levelmap 			= {
+        0: logging.WARNING,
+        1: logging.NORMAL,
+        2: logging.DETAIL,
+        3: logging.INFO,
+        4: logging.DEBUG,
+        }
+    cpppo.log_cfg['level']	= ( levelmap[args.verbose]
+                                    if args.verbose in levelmap
+                                    else logging.DEBUG )
+    if args.log:
+        cpppo.log_cfg['filename'] = args.log
+    logging.basicConfig( **cpppo.log_cfg )
+
+    try:
+        convert( args.source, args.target, binary=args.binary, codec=args.codec, block=args.block )
+    except Exception as exc:
+        logging.warning( "Failed to convert %s: %s", args.source, exc )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -58,6 +58,22 @@ OPTIONS
        :function       -- Function code
        :registers      -- Amount of response data
 
+  --dense N			Back contiguous runs of N+ registers with arrays (default 16; 0: all sparse)
+
+  --shared <name>		Place the dense register arrays in named shared memory
+
+    Contiguous ranges (eg. 40001-49999) are served from compact array.array (or
+    shared memory) blocks; only isolated registers are kept in sparse dicts.
+    The shared memory segments are named <name>-co, <name>-di, <name>-ir and
+    <name>-hr, and hold each table's dense runs in ascending address order.
+
+  --history <path>		Play back register values from cpppo.history file(s)
+  --historical <time>		  beginning at this historical time,
+  --factor #.#			  at this multiple of real time (default 1.0)
+
+    Each recorded register value is written into the served registers when its
+    (accelerated) historical time arrives; unserved registers are ignored.
+
   <begin>-<end>[=<val>[,<val>]] Ranges of registers to serve, and their initial value(s)
 
     If a range of registers is specified, the provided <val>[,<val>] provided is
@@ -72,9 +88,18 @@ EXAMPLE
     Starts a simulated PLC serving Holding registers 40001-40100 == 0, on port 7502
     on interface 'localhost', which delays all responses for 2.5 seconds.
 
+  modbus_sim.py --history plant.hst --historical "2014-04-01 00:00:00" --factor 10 40001-49999
+
+    Serves Holding registers 40001-49999, replaying a recorded day of plant data at 10x speed.
+
 '''
 import argparse
+import array
 import asyncio
+import bisect
+import collections
+import functools
+import heapq
 import json
 import logging
 import os
@@ -92,7 +117,7 @@ from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
 from pymodbus.pdu.register_message import ReadHoldingRegistersResponse, WriteSingleRegisterResponse, WriteMultipleRegistersResponse
 from pymodbus.framer import FRAMER_NAME_TO_CLASS, FramerType
 from pymodbus.exceptions import NotImplementedException
-from pymodbus.datastore.store import ModbusSparseDataBlock
+from pymodbus.datastore.store import ModbusSparseDataBlock, BaseModbusDataBlock
 
 if __name__ == "__main__" and __package__ is None:
     # Ensure that importing works (whether cpppo installed or not) with:
@@ -186,6 +211,21 @@ def register_decode( txt, default=None ):
     return beg,end,val
 
 
+def register_table( reg ):
+    """Return the table ('hr', 'ir', 'di' or 'co') and offset of the (1-based) Modbus register, eg.
+    40001 --> ('hr',40000), or (None,None) if invalid.
+
+    """
+    return (     ( 'hr',  40000 ) if  40001 <= reg <=  99999
+            else ( 'hr', 400000 ) if 400001 <= reg <= 465536
+            else ( 'ir',  30000 ) if  30001 <= reg <=  39999
+            else ( 'ir', 300000 ) if 300001 <= reg <= 365536
+            else ( 'di',  10000 ) if  10001 <= reg <=  19999
+            else ( 'di', 100000 ) if 100001 <= reg <= 165536
+            else ( 'co',      0 ) if      1 <= reg <=   9999
+            else ( None, None ))
+
+
 def register_definitions( registers, default=None ):
     """Parse the register ranges, as: registers[, registers ...], and produce a keywords dictionary
     suitable for construction of ModbusSparseDataBlock instances for a ModbusSlaveContext, for
@@ -223,20 +263,14 @@ def register_definitions( registers, default=None ):
     # Parse register ranges
     # 1  10001 30001 40001
     cod,   did,  ird,  hrd 	= {}, {}, {}, {}
+    tables			= dict( co=cod, di=did, ir=ird, hr=hrd )
     for txt in registers:
         beg,end,val		= register_decode( txt, default=0 )
 
         for reg in range( beg, end + 1 ):
-            dct, off		= (     ( hrd,  40000 ) if  40001 <= reg <=  99999
-                                   else ( hrd, 400000 ) if 400001 <= reg <= 465536
-                                   else ( ird,  30000 ) if  30001 <= reg <=  39999
-                                   else ( ird, 300000 ) if 300001 <= reg <= 365536
-                                   else ( did,  10000 ) if  10001 <= reg <=  19999
-                                   else ( did, 100000 ) if 100001 <= reg <= 165536
-                                   else ( cod,      0 ) if      1 <= reg <=   9999
-                                   else ( None, None ))
-            assert dct is not None, "Invalid Modbus register: %d" % ( reg )
-            dct[reg - off]	= val[reg - beg]
+            tbl, off		= register_table( reg )
+            assert tbl is not None, "Invalid Modbus register: %d" % ( reg )
+            tables[tbl][reg - off] = val[reg - beg]
     log.info( "Holding Registers: %5d, %6d-%6d; %s", len( hrd ),
               400000 + min( hrd ) if hrd else 0, 400000 + max( hrd ) if hrd else 0, cpppo.reprlib.repr( hrd ))
     log.info( "Input   Registers: %5d, %6d-%6d; %s", len( ird ),
@@ -246,15 +280,136 @@ def register_definitions( registers, default=None ):
     log.info( "Discrete Inputs:   %5d, %6d-%6d; %s", len( did ),
               100000 + min( did ) if did else 0, 100000 + max( did ) if did else 0, cpppo.reprlib.repr( did ))
 
-    return dict( co=cod, di=did, ir=ird, hr=hrd )
+    return tables
+
 
+DENSE				= 16		# Runs of this many (or more) registers are dense
 
-def register_context( registers, slaves=None ):
+class register_block( BaseModbusDataBlock ):
+    """A Modbus DataBlock serving the supplied { <address>: <value>, ... } (1-based, as produced by
+    register_definitions).  Each contiguous run of at least 'dense' addresses is backed by a compact
+    array.array of the given 'typecode' (eg. 'H' for registers, 'B' for coils), so a multi-register
+    read is a single slice; only the shorter (isolated) runs are kept in a sparse dict.  As with a
+    ModbusSparseDataBlock, only the supplied addresses are valid; the holes between runs are not.
+
+    If 'shared' names a multiprocessing.shared_memory segment, the dense runs are instead laid out
+    in ascending address order within it, so another process may monitor (or alter) the values.
+
+    """
+    def __init__( self, values, typecode='H', dense=None, shared=None ):
+        self.typecode		= typecode
+        self.starts		= []		# [ <address>, ... ] of each dense run, ascending
+        self.runs		= []		# [ <array>, ... ]  "
+        self.sparse		= {}		# { <address>: <value>, ... } of short runs
+        self.shm		= None
+        dense			= DENSE if dense is None else dense
+        runs			= []
+        for reg in sorted( values ):
+            if runs and reg == runs[-1][0] + len( runs[-1][1] ):
+                runs[-1][1].append( values[reg] )
+            else:
+                runs.append( (reg, [ values[reg] ]) )
+        for beg,val in runs:
+            if len( val ) < max( 1, dense ):
+                self.sparse.update( (beg + i, v) for i,v in enumerate( val ))
+                continue
+            self.starts.append( beg )
+            self.runs.append( array.array( typecode, val ))
+        if shared and self.runs:
+            from multiprocessing import shared_memory
+            itemsize		= self.runs[0].itemsize
+            self.shm		= shared_memory.SharedMemory(
+                name=shared, create=True, size=sum( len( run ) for run in self.runs ) * itemsize )
+            off			= 0
+            for i,run in enumerate( self.runs ):
+                size		= len( run ) * itemsize
+                view		= self.shm.buf[off:off+size].cast( typecode )
+                view[:]		= run
+                self.runs[i]	= view
+                off	       += size
+            log.info( "Shared memory:     %s: %d bytes", shared, off )
+        self.address		= min( values ) if values else 0
+        self.default_value	= [ array.array( typecode, run ) for run in self.runs ], dict( self.sparse )
+        self.values		= self.sparse	# for BaseModbusDataBlock.__str__; see __len__
+
+    def __len__( self ):
+        return len( self.sparse ) + sum( len( run ) for run in self.runs )
+
+    def __str__( self ):
+        return "register_block(%d in %d dense runs, %d sparse)" % (
+            len( self ), len( self.runs ), len( self.sparse ))
+
+    def __iter__( self ):
+        """Yields all (<address>,<value>) in ascending address order."""
+        sparse			= sorted( self.sparse.items() )
+        dense			= ( (beg + i, v)
+                                    for beg,run in zip( self.starts, self.runs )
+                                    for i,v in enumerate( run ))
+        return heapq.merge( sparse, dense )
+
+    def _run( self, address, count ):
+        """Return the index of the dense run containing address ... address+count-1, or None."""
+        i			= bisect.bisect_right( self.starts, address ) - 1
+        if i >= 0 and address + count <= self.starts[i] + len( self.runs[i] ):
+            return i
+        return None
+
+    def validate( self, address, count=1 ):
+        if count <= 0:
+            return False
+        if self._run( address, count ) is not None:
+            return True
+        return all( a in self.sparse for a in range( address, address + count ))
+
+    def getValues( self, address, count=1 ):
+        i			= self._run( address, count )
+        if i is not None:
+            off			= address - self.starts[i]
+            return self.runs[i][off:off+count].tolist()
+        return [ self.sparse[a] for a in range( address, address + count ) ]
+
+    def setValues( self, address, values ):
+        if not isinstance( values, (list,tuple) ):
+            values		= [ values ]
+        i			= self._run( address, len( values ))
+        if i is not None:
+            off			= address - self.starts[i]
+            self.runs[i][off:off+len( values )] = array.array( self.typecode, values )
+            return
+        for a,v in enumerate( values, address ):
+            self.sparse[a]	= v
+
+    def reset( self ):
+        runs,sparse		= self.default_value
+        for run,default in zip( self.runs, runs ):
+            run[:]		= default
+        self.sparse.clear()
+        self.sparse.update( sparse )
+
+    def close( self ):
+        """Release (and destroy) any shared memory.  The block may not be used thereafter."""
+        if self.shm is None:
+            return
+        for run in self.runs:
+            run.release()
+        self.runs		= []
+        self.starts		= []
+        self.shm.close()
+        self.shm.unlink()
+        self.shm		= None
+
+
+def register_context( registers, slaves=None, dense=None, shared=None ):
     """Parse a series of register ranges (and optional values), create a data
     store, and assign it to the given single (or sequence of) Slave IDs (if
     None, then it reports to any ID.)  The same data store is used to back all
     provided Slave IDs.
 
+    Each table is served by a register_block, with runs of 'dense' (default:
+    DENSE) or more contiguous registers backed by arrays; if 'shared' is
+    supplied, in shared memory segments named <shared>-hr, <shared>-co, ...  If
+    'dense' is 0, every table is served by a ModbusSparseDataBlock.
+
     --------------------------------------------------------------------------
     initialize your data store, returning an initialized ModbusServerContext
     --------------------------------------------------------------------------
@@ -303,11 +458,25 @@ def register_context( registers, slaves=None ):
     cod				= definitions.get( 'co' )
     hrd				= definitions.get( 'hr' )
     ird				= definitions.get( 'ir' )
-    store = ModbusSlaveContext(
-        di = ModbusSparseDataBlock( did ) if did else None,
-        co = ModbusSparseDataBlock( cod ) if cod else None,
-        hr = ModbusSparseDataBlock( hrd ) if hrd else None,
-        ir = ModbusSparseDataBlock( ird ) if ird else None )
+    if dense == 0:
+        store = ModbusSlaveContext(
+            di = ModbusSparseDataBlock( did ) if did else None,
+            co = ModbusSparseDataBlock( cod ) if cod else None,
+            hr = ModbusSparseDataBlock( hrd ) if hrd else None,
+            ir = ModbusSparseDataBlock( ird ) if ird else None )
+    else:
+        def block( values, typecode, table ):
+            if not values:
+                return None
+            blk			= register_block( values, typecode=typecode, dense=dense,
+                                          shared=shared and "%s-%s" % ( shared, table ))
+            log.info( "%-18s %s", table+':', blk )
+            return blk
+        store = ModbusSlaveContext(
+            di = block( did, 'B', 'di' ),
+            co = block( cod, 'B', 'co' ),
+            hr = block( hrd, 'H', 'hr' ),
+            ir = block( ird, 'H', 'ir' ))
 
     # If slaves is None, then just pass the store with single=True; it will be
     # used for every slave.  Otherwise, map all the specified slave IDs to the
@@ -325,6 +494,87 @@ def register_context( registers, slaves=None ):
         log.info( "Modbus Slave IDs:  %s", slaves or "(all)" )
 
 
+def register_update( context, values ):
+    """Write the { <register>: <value>, ... } (1-based Modbus registers, eg. 40001 or "40001") into
+    the context's data blocks, in bulk: each contiguous run of registers is written with a single
+    setValues.  Register values are truncated to 16 bits, coils to 0/1.  Registers not served by the
+    context are ignored.  Returns the number of registers written.
+
+    """
+    tables			= {}
+    for reg,val in values.items():
+        tbl,off			= register_table( int( reg ))
+        if tbl is not None:
+            tables.setdefault( tbl, {} )[int( reg ) - off] = (
+                ( 1 if val else 0 ) if tbl in ( 'co', 'di' ) else int( val ) & 0xFFFF )
+    _,slave			= next( iter( context ))	# The same store backs every Slave ID
+    written			= 0
+    for tbl,vals in tables.items():
+        block			= slave.store.get( tbl[0] )	# 'h', 'i', 'd' or 'c'
+        if block is None:
+            continue
+        addrs			= sorted( vals )
+        beg			= 0
+        for end in range( 1, len( addrs ) + 1 ):
+            if end < len( addrs ) and addrs[end] == addrs[end-1] + 1:
+                continue
+            run			= [ vals[a] for a in addrs[beg:end] ]
+            if block.validate( addrs[beg], len( run )):
+                block.setValues( addrs[beg], run )
+                written	       += len( run )
+            else:
+                # Some of the run isn't served; write those registers that are
+                for a in addrs[beg:end]:
+                    if block.validate( a ):
+                        block.setValues( a, [ vals[a] ] )
+                        written += 1
+            beg			= end
+    return written
+
+
+async def register_playback( context, path, historical, basis=None, factor=None, limit=1000, poll=.1, **kwds ):
+    """Play back the register values recorded in the history file(s) at 'path' into the context's
+    data blocks, beginning at the 'historical' time at wall-clock time 'basis' (default: now), and
+    proceeding at 'factor' (default: 1.0) times real time; see cpppo.history.loader.  Any other
+    keywords (eg. lookahead, duration) are passed to the loader.
+
+    Up to 'limit' events are loaded per batch, in a background thread so that the server isn't
+    blocked by history file I/O.  Each event is written when its historical time arrives; all the
+    events due at once are coalesced into one bulk register_update.  Returns the number of events
+    played back, when the history is exhausted.
+
+    """
+    from cpppo.history import loader	# Requires the optional pytz, tzlocal
+
+    ld				= loader( path, historical=historical, basis=basis, factor=factor, **kwds )
+    aio				= asyncio.get_running_loop()
+    pending			= collections.deque()	# [ { "timestamp": <ts>, "values": {...}, ...}, ... ]
+    played			= 0
+    try:
+        while ld or pending:
+            events		= []
+            if ld:
+                _,events	= await aio.run_in_executor( None, functools.partial( ld.load, limit=limit ))
+                pending.extend( events )
+            now			= ld.advance()
+            values		= {}
+            while pending and pending[0]['timestamp'] <= now:
+                values.update( pending.popleft()['values'] )
+                played	       += 1
+            if values:
+                log.info( "Playback of %d registers at %s", register_update( context, values ), now )
+            if len( events ) >= limit:
+                continue			# More history is probably ready; load it now
+            delay		= poll
+            if pending:
+                delay		= min( poll, max( 0, ( pending[0]['timestamp'].value - now.value ) / ld.factor ))
+            await asyncio.sleep( delay )
+    finally:
+        ld.close()
+    log.normal( "Playback of %d events complete: %s", played, ld )
+    return played
+
+
 # Global 'context'; The caller of 'main' may want a separate Thread to be able
 # to access/modify the data store of their single Start...ServerLogging instance
 context				= None
@@ -344,6 +594,9 @@ class StartAsyncServer( object ):
     :param identity: An optional identify structure
     :param address: An optional (interface, port) to bind to.
     :param slaves: An optional single (or list of) Slave IDs to serve
+    :param dense: Minimum run of registers backed by an array (0: all sparse)
+    :param shared: An optional shared memory name prefix, for the arrays
+    :param playback: Optional register_playback keywords (path, historical, ...)
 
     Assumes that the self.server_async asyncio program will identify failure
     conditions (ie. cannot connect), and signal itself to stop.  The
@@ -353,10 +606,30 @@ class StartAsyncServer( object ):
     Otherwise, they print the successfully bound i'face:port or serial device.
 
     '''
-    def __init__( self, *args, registers=None, slaves=None, **kwds ):
+    def __init__( self, *args, registers=None, slaves=None, dense=None, shared=None, playback=None, **kwds ):
         global context
-        self.context = context	= register_context( registers, slaves=slaves )
-        asyncio.run( self.server_async( *args, **kwds ))
+        self.context = context	= register_context( registers, slaves=slaves, dense=dense, shared=shared )
+        try:
+            asyncio.run( self.serve_async( playback, *args, **kwds ))
+        finally:
+            # The same blocks back every Slave ID; release any shared memory exactly once
+            blocks		= { id( blk ): blk for _,slave in self.context for blk in slave.store.values() }
+            for blk in blocks.values():
+                if isinstance( blk, register_block ):
+                    blk.close()
+
+    async def serve_async( self, playback, *args, **kwds ):
+        """Run the server, and any history playback into its context in a background task."""
+        task			= None
+        if playback:
+            task		= asyncio.create_task( register_playback( self.context, **playback ))
+        try:
+            await self.server_async( *args, **kwds )
+        finally:
+            if task:
+                task.cancel()
+                with suppress( asyncio.exceptions.CancelledError ):
+                    await task
 
 
 class StartTcpServerLogging( StartAsyncServer ):
@@ -439,6 +712,16 @@ def main( argv=None ):
                          help="Evil Modbus/TCP protocol framer       (default: None)" )
     parser.add_argument( '-c', '--config',	default=None,
                          help="""JSON config data for Modbus framer (eg. {"baudrate":19200}) (default: None)""" )
+    parser.add_argument( '-d', '--dense',	default=None, type=int,
+                         help="Back runs of N+ registers with arrays (default: %d; 0: sparse)" % DENSE )
+    parser.add_argument( '-s', '--shared',	default=None,
+                         help="Place register arrays in shared memory <name>-hr, ...(default: None)" )
+    parser.add_argument( '--history',	default=None,
+                         help="Play back register values from history file(s) (default: None)" )
+    parser.add_argument( '--historical',	default=None,
+                         help="Historical time to begin --history playback (eg. 2014-04-01 00:00:00)" )
+    parser.add_argument( '--factor',	default=None, type=float,
+                         help="Speed of --history playback, vs. real time (default: 1.0)" )
     parser.add_argument( 'registers', nargs="+" )
     args			= parser.parse_args( argv )
 
@@ -458,6 +741,12 @@ def main( argv=None ):
 
     logging.basicConfig( **cpppo.log_cfg )
 
+    playback			= None
+    if args.history:
+        if not args.historical:
+            parser.error( "--history playback requires a --historical starting time" )
+        playback		= dict( path=args.history, historical=args.historical, factor=args.factor )
+
     #---------------------------------------------------------------------------#
     # run the server you want
     #---------------------------------------------------------------------------#
@@ -663,7 +952,8 @@ def main( argv=None ):
         try:
             for k in sorted( starter_kwds.keys() ):
                 log.info( "config: %24s: %s", k, starter_kwds[k] )
-            starter( registers=args.registers, framer=framer, address=address, **starter_kwds )
+            starter( registers=args.registers, framer=framer, address=address,
+                     dense=args.dense, shared=args.shared, playback=playback, **starter_kwds )
             return 0
         except KeyboardInterrupt:
             return 1
@@ -26,7 +26,8 @@ __all__				= [
     "parse_offset", "format_offset", "AmbiguousTimeZoneError", "TZ_wrapper",
     "duration", "parse_datetime", "parse_seconds",
     "has_pytz_classic", "pytz",
-    "opener", "logger", "parse_record",
+    "opener", "mapped", "blocks", "indexer", "logger", "logger_background", "parse_record", "convert",
+    "query", "aggregate",
     "HistoryExhausted", "reader", 
     "DataError", "IframeError", "loader",
 ]
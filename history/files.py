@@ -1,4 +1,3 @@
-
 # 
 # Cpppo -- Communication Protocol Python Parser and Originator
 # 
@@ -26,47 +25,419 @@ __copyright__                   = "Copyright (c) 2013 Hard Consulting Corporatio
 __license__                     = "Dual License: GPLv3 (or later) and Commercial (see LICENSE)"
 
 __all__				= [
-    "opener", "logger", "parse_record",
+    "opener", "mapped", "blocks", "indexer", "logger", "logger_background", "parse_record", "convert",
+    "query", "aggregate",
     "HistoryExhausted", "reader",
     "DataError", "IframeError", "loader"
 ]
 
+import bisect
 import bz2
 import collections
 import gzip
+import io
 import json
 import logging
+import mmap
 import os
+import struct
 import subprocess
+import threading
 import traceback
+import zlib
+try:
+    import lzma
+except ImportError:
+    lzma			= None
+try:
+    import zstandard
+except ImportError:
+    zstandard			= None
 
 from .times		import timestamp, format_offset
 from ..misc		import timer, natural, reprlib
+from ..dotdict		import dotdict
 from ..automata		import type_str_base
 
 log				= logging.getLogger( __package__ )
 
-def opener( path, mode='rb', bufsize=4*1024 ):
+class blocks( object ):
+    """A compact binary history format; after the MAGIC file header, a sequence of length-prefixed
+    blocks, each compressed with its own codec:
+
+        <codec>		uint8	0: none, 1: zlib, 2: bz2, 3: lzma
+        <length>	uint32	length of the (compressed) block payload
+        <count>		uint32	number of records in the block
+        <payload>
+
+    Once decompressed, the payload contains 'count' records, each a float64 UNIX timestamp, and the
+    lengths of the serial number and data JSON which follow:
+
+        <timestamp>	float64	UNIX timestamp (NaN for a comment)
+        <serial>	uint32	length of the serial number JSON (0 for a comment)
+        <data>		uint32	length of the data JSON (or comment text)
+        <serial JSON><data JSON>
+
+    All values are little-endian.  No timestamp parsing is required to read a record; only the data
+    JSON remains to be decoded.  An opener stream reading a history file in this format (detected
+    by its MAGIC header) yields (<timestamp>,<serial>,<data>) tuples (skipping comments) instead of
+    lines, which parse_record understands.
+
+    """
+    MAGIC			= b'\x89HST\r\n\x1a\n'
+    HEADER			= struct.Struct( '<BII' )
+    RECORD			= struct.Struct( '<dII' )
+    CODECS			= {
+        'none':		0,
+        'zlib':		1,
+        'bz2':		2,
+        'lzma':		3,
+    }
+    COMPRESS			= {
+        0:		lambda b: b,
+        1:		zlib.compress,
+        2:		bz2.compress,
+        3:		lzma.compress if lzma else None,
+    }
+    DECOMPRESS			= {
+        0:		lambda b: b,
+        1:		zlib.decompress,
+        2:		bz2.decompress,
+        3:		lzma.decompress if lzma else None,
+    }
+
+    @classmethod
+    def encode( cls, records, codec=None ):
+        """Encode a block of (<timestamp>,<serial>,<data>) records (with JSON str/bytes <serial> and
+        <data>; a <timestamp> of None indicates a comment in <data>) using the named codec (default:
+        'zlib'), returning the bytes."""
+        code			= cls.CODECS[codec or 'zlib']
+        assert cls.COMPRESS[code], "Unsupported history block codec: %s" % ( codec )
+        payload			= []
+        for ts,sn,js in records:
+            if ts is None:
+                ts,sn		= float( 'nan' ),b''
+            if not isinstance( sn, bytes ):
+                sn		= sn.encode( 'utf-8' )
+            if not isinstance( js, bytes ):
+                js		= js.encode( 'utf-8' )
+            payload.append( cls.RECORD.pack( float( ts ), len( sn ), len( js )))
+            payload.append( sn )
+            payload.append( js )
+        payload			= cls.COMPRESS[code]( b''.join( payload ))
+        return cls.HEADER.pack( code, len( payload ), len( records )) + payload
+
+    @classmethod
+    def decode( cls, header, payload ):
+        """Decode a block, yielding its (<timestamp>,<serial>,<data>) records; comments have a
+        <timestamp> of None."""
+        code,length,count	= cls.HEADER.unpack( header )
+        decompress		= cls.DECOMPRESS.get( code )
+        assert decompress, "Unsupported history block codec: %d" % ( code )
+        data			= decompress( payload )
+        off			= 0
+        for _ in range( count ):
+            ts,snl,jsl		= cls.RECORD.unpack_from( data, off )
+            off		       += cls.RECORD.size
+            sn			= data[off:off+snl]
+            off		       += snl
+            js			= data[off:off+jsl]
+            off		       += jsl
+            yield ( None if ts != ts else ts ),sn,js
+
+    @classmethod
+    def detect( cls, stream ):
+        """Return True iff the (peekable) stream begins with the binary history format MAGIC."""
+        peek			= getattr( stream, 'peek', None )
+        if not peek:
+            return False
+        head			= peek( len( cls.MAGIC ))
+        return head[:len( cls.MAGIC )] == cls.MAGIC
+
+    class reader( object ):
+        """Iterate the (<timestamp>,<serial>,<data>) records of a binary history stream, skipping
+        comments unless 'comments' is True.  A partially written trailing block ends the iteration;
+        iterating again once more data has been written resumes with it."""
+        def __init__( self, stream, comments=False ):
+            self.stream		= stream
+            self.comments	= comments
+            magic		= stream.read( len( blocks.MAGIC ))
+            assert magic == blocks.MAGIC, "Not a binary history file"
+            self.records	= iter( () )
+            self.partial	= b''		# A partial trailing block, if the stream isn't seekable
+            try:
+                self.seekable	= stream.seekable()
+            except Exception:
+                self.seekable	= False
+
+        def __iter__( self ):
+            return self
+
+        def __next__( self ):
+            while True:
+                for rec in self.records:
+                    if rec[0] is not None or self.comments:
+                        return rec
+                # A trailing block may be only partially written (eg. a live history file); stop
+                # at its start, so a later iteration may retry once it is complete.
+                start		= self.stream.tell() if self.seekable else None
+                block		= self.partial + self.stream.read( max( 0, blocks.HEADER.size - len( self.partial )))
+                if len( block ) >= blocks.HEADER.size:
+                    code,length,count = blocks.HEADER.unpack( block[:blocks.HEADER.size] )
+                    needed	= blocks.HEADER.size + length
+                    block      += self.stream.read( needed - len( block ))
+                    if len( block ) == needed:
+                        self.partial = b''
+                        self.records = blocks.decode( block[:blocks.HEADER.size], block[blocks.HEADER.size:] )
+                        continue
+                if start is None:
+                    self.partial = block
+                else:
+                    self.stream.seek( start )
+                raise StopIteration
+
+        next			= __next__		# Python2
+
+        def read( self, *args ):
+            raise IOError( "Cannot read a binary history file's records as bytes" )
+
+        def close( self ):
+            self.stream.close()
+
+
+class readahead( io.RawIOBase ):
+    """Read (and decompress) a stream in a background thread, up to 'limit' bytes ahead of the
+    consumer, in chunks of 'chunk' bytes.  Closing stops the thread and closes the source stream.
+    Presents a raw, read-only, non-seekable stream; wrap in an io.BufferedReader to read lines.
+
+    """
+    def __init__( self, stream, limit, chunk=64*1024, name=None ):
+        super( readahead, self ).__init__()
+        self.stream		= stream
+        self.limit		= max( limit, chunk )
+        self.chunk		= chunk
+        self.chunks		= collections.deque()
+        self.buffered		= 0			# Total bytes in chunks
+        self.eof		= False
+        self.error		= None
+        self.stopped		= False
+        self.ready		= threading.Condition()
+        self.thread		= threading.Thread( target=self._run, name="readahead %s" % ( name or stream ))
+        self.thread.daemon	= True
+        self.thread.start()
+
+    def _run( self ):
+        try:
+            while True:
+                with self.ready:
+                    while not self.stopped and self.buffered >= self.limit:
+                        self.ready.wait()
+                    if self.stopped:
+                        return
+                data		= self.stream.read( self.chunk )
+                with self.ready:
+                    if data:
+                        self.chunks.append( data )
+                        self.buffered  += len( data )
+                    else:
+                        self.eof	= True
+                    self.ready.notify_all()
+                if not data:
+                    return
+        except Exception as exc:
+            with self.ready:
+                self.error	= exc
+                self.eof	= True
+                self.ready.notify_all()
+
+    def readable( self ):
+        return True
+
+    def readinto( self, b ):
+        with self.ready:
+            while not self.chunks and not self.eof:
+                self.ready.wait()
+            if not self.chunks:
+                if self.error is not None:
+                    raise IOError( "Read ahead failed: %s" % self.error )
+                return 0
+            data		= self.chunks[0]
+            n			= min( len( b ), len( data ))
+            b[:n]		= data[:n]
+            if n < len( data ):
+                self.chunks[0]	= data[n:]
+            else:
+                self.chunks.popleft()
+            self.buffered      -= n
+            self.ready.notify_all()
+            return n
+
+    def close( self ):
+        if not self.closed:
+            with self.ready:
+                self.stopped	= True
+                self.ready.notify_all()
+            self.thread.join()
+            self.stream.close()
+        super( readahead, self ).close()
+
+
+class mapped( object ):
+    """Scan an uncompressed text history file via mmap, finding record boundaries without reading lines
+    into Python; yields a (<time>,<serial>,<data>) tuple per record (or None for each blank line or
+    comment, so line numbers are preserved), with only the <time> string decoded; parse_record
+    understands these.  Each <data> includes its trailing newline, as parse_record presents text
+    records.
+
+    A partial record at the end of the file (eg. being written) is not yielded; once the iterator is
+    exhausted, it may be iterated again to yield any records since appended (the file is re-mapped
+    if it has grown; the data already scanned is never re-read).  A binary blocks format file may
+    also be read (via read/peek).
+
+    Since the canonical 'YYYY-MM-DD HH:MM:SS' timestamps of a history file's records collate in time
+    order, locate can binary search the mapped file for the first record near a target time without
+    decoding anything but the few lines probed.
+
+    """
+    def __init__( self, path ):
+        self.path		= path
+        self.f			= open( path, 'rb' )
+        self.map		= None
+        self.size		= 0
+        self.remap()
+
+    def remap( self ):
+        """Re-map the file if it has grown (retaining the position), returning True iff more data is
+        available."""
+        size			= os.fstat( self.f.fileno() ).st_size
+        if size <= self.size:
+            return False
+        offset			= self.tell()
+        if self.map is not None:
+            self.map.close()
+        self.map		= mmap.mmap( self.f.fileno(), size, access=mmap.ACCESS_READ )
+        self.map.seek( offset )
+        self.size		= size
+        return True
+
+    def __iter__( self ):
+        return self
+
+    def __next__( self ):
+        while True:
+            line		= b'' if self.map is None else self.map.readline()
+            if not line.endswith( b'\n' ):
+                # EOF, or a partial record still being written; back up, and see if the file has grown
+                if line:
+                    self.map.seek( self.map.tell() - len( line ))
+                if self.remap():
+                    continue
+                raise StopIteration
+            if line[:1] in ( b'\t', b' ', b'\r', b'\n', b'#' ):
+                # Not the usual "<time>\t<serial>\t<data>" line; blank, comment or indented.
+                line		= line.lstrip()
+                if not line or line.startswith( b'#' ):
+                    return None
+            dt,sn,js		= line.split( b'\t', 2 )
+            return dt.decode( 'ascii' ),sn,js
+
+    next			= __next__		# Python2
+
+    def record( self, offset ):
+        """Return the offset and (stripped) line of the first record beginning at or after 'offset', or
+        (<size>,None)."""
+        if offset > 0 and self.map[offset-1:offset] != b'\n':
+            offset		= self.map.find( b'\n', offset ) + 1 or self.size
+        while offset < self.size:
+            end			= self.map.find( b'\n', offset )
+            if end < 0:
+                break # a partial record
+            line		= self.map[offset:end].lstrip()
+            if line and not line.startswith( b'#' ):
+                return offset,line
+            offset		= end + 1
+        return self.size,None
+
+    def locate( self, target ):
+        """Position at (or somewhat before) the first record at or after the 'target' time, by binary
+        search from the current position; only whole seconds are compared, so records preceding the
+        target by up to a second may follow.  Returns the offset."""
+        self.remap()
+        if self.map is None:
+            return 0
+        key			= timestamp( timestamp( target ).value - timestamp._epsilon ).render( ms=False ).encode( 'ascii' )
+        lo,hi			= self.tell(),self.size
+        while lo < hi:
+            mid			= ( lo + hi ) // 2
+            _,line		= self.record( mid )
+            if line is None or line[:len( key )] >= key:
+                hi		= mid
+            else:
+                lo		= mid + 1
+        offset,_		= self.record( lo )
+        self.map.seek( offset )
+        return offset
+
+    def peek( self, size=1 ):
+        if self.map is None:
+            self.remap()
+        offset			= self.tell()
+        return b'' if self.map is None else self.map[offset:offset+size]
+
+    def read( self, size=-1 ):
+        if self.map is None or self.tell() + ( size if size >= 0 else 1 ) > self.size:
+            self.remap()
+        return b'' if self.map is None else self.map.read( size )
+
+    def seek( self, offset ):
+        if self.map is None or offset > self.size:
+            self.remap()
+        assert self.map is not None and offset <= self.size, \
+            "Cannot seek to %d beyond the end of %s" % ( offset, self.path )
+        self.map.seek( offset )
+
+    def tell( self ):
+        return 0 if self.map is None else self.map.tell()
+
+    def close( self ):
+        if self.map is not None:
+            self.map.close()
+            self.map		= None
+        self.f.close()
+
+
+def opener( path, mode='rb', bufsize=4*1024, prefetch=None, mmapped=False ):
     """Open a file in the specified mode ('r', 'w'), using the appropriate compressor if necessary.  All
     objects returned must be context managers (respond to 'with <obj>: ... ' by closing the object).
-    Presently this limits us to .gz, .bz2, .xz and (default) plain files.
+    Presently this limits us to .gz, .bz2, .xz, .zst (if the zstandard module is available) and
+    (default) plain files.  When reading, a history file in the binary blocks format is detected,
+    and its records are presented (see blocks.reader).
+
+    Compression is performed in-process; .xz files use the lzma module where available (Python 3),
+    and read/write through a buffer of 'bufsize' bytes.  Only where lzma is unavailable is an
+    external 'xz' subprocess used; the present implementation does *not* properly present the I/O
+    stream of a subprocess.Popen: it returns it either as an iterator, or via a context manager
+    which presents the open stdin/stdout file descriptor.  Therefore, it may *only* be used in the
+    form 'with <fd> as <var>: ...' or 'for <var> in <fd>: ...'
+
+    If 'prefetch' bytes is given (reading only), the file is read and decompressed in a background
+    thread, up to 'prefetch' bytes ahead of the consumer; the resultant stream is not seekable.
 
-    WARNING
-    
-    The present implementation does *not* properly present the I/O stream of a subprocess.Popen
-    (used for lzma '.xz' files); it returns it either as an iterator, or via a context manager which
-    presents the open stdin/stdout file descriptor.  Therefore, it may *only* be used in the form
-    'with <fd> as <var>: ...' or 'for <var> in <fd>: ...'
+    If 'mmapped' (reading only), an uncompressed text history file is scanned via mmap, yielding
+    (<time>,<serial>,<data>) tuples instead of lines (see mapped); compressed files are unaffected.
 
     """
     r, w			= 'r' in mode, 'w' in mode
     assert ( r or w ) and ( r ^ w ), "Invalid mode: %s" % mode
+    assert not ( w and ( prefetch or mmapped )), "Cannot prefetch or mmap a file opened for writing"
 
     class closer( object ):
-        """Present an open stream via context manager (close automatically) or iterator (close manually)."""
-        def __init__( self, path, fd ):
+        """Present an open stream via context manager (close automatically) or iterator (close manually).
+        Any 'others' (eg. underlying file objects) are closed after the stream."""
+        def __init__( self, path, fd, *others ):
             self.path		= path
             self.fd		= fd
+            self.others		= others
         def __iter__( self ):
             return self.fd
         def __enter__( self ):
@@ -76,6 +447,8 @@ def opener( path, mode='rb', bufsize=4*1024 ):
             return False
         def close( self ):
             self.fd.close()
+            for o in self.others:
+                o.close()
             log.info( "Closed file %s", self.path )
 
     class closer_subprocess( closer ):
@@ -87,6 +460,8 @@ def opener( path, mode='rb', bufsize=4*1024 ):
             self.sub		= sub
             self.terminate	= terminate
         def close( self ):
+            if self.fd not in ( self.sub.stdin, self.sub.stdout ):
+                self.fd.close() # eg. a readahead or blocks.reader of the subprocess' stdout
             for s in self.sub.stdin, self.sub.stderr, self.sub.stdout:
                 if s:
                     s.close()
@@ -98,12 +473,30 @@ def opener( path, mode='rb', bufsize=4*1024 ):
             self.sub.wait()
             log.info("Closed subprocess (%s) for %s", self.sub.returncode, self.path )
 
+    def detecting( c ):
+        """If reading a binary blocks format history file, present its records instead of lines.  If
+        prefetching, first interpose a readahead thread between the file and its reader."""
+        if r and prefetch:
+            log.info( "Prefetching %d bytes of %s", prefetch, c.path )
+            c.fd		= io.BufferedReader( readahead( c.fd, limit=prefetch, chunk=bufsize, name=c.path ),
+                                                     buffer_size=bufsize )
+        if r and blocks.detect( c.fd ):
+            log.info( "Reading binary history from %s", c.path )
+            c.fd		= blocks.reader( c.fd )
+        return c
+
     if path.endswith( '.bz2' ):
         log.info( "Opening bzip file for %s: %s", mode, path )
-        return closer( path, bz2.BZ2File( path, mode=mode ))
+        return detecting( closer( path, bz2.BZ2File( path, mode=mode )))
     elif path.endswith( '.gz' ):
         log.info( "Opening gzip file for %s: %s", mode, path )
-        return closer( path, gzip.GzipFile( path, mode=mode ))
+        return detecting( closer( path, gzip.GzipFile( path, mode=mode )))
+    elif path.endswith( '.xz' ) and lzma:
+        log.info( "Opening lzma file for %s: %s", mode, path )
+        if r:
+            return detecting( closer( path, io.BufferedReader( lzma.LZMAFile( path, mode='rb' ),
+                                                               buffer_size=bufsize )))
+        return closer( path, io.BufferedWriter( lzma.LZMAFile( path, mode='wb' ), buffer_size=bufsize ))
     elif path.endswith( '.xz' ):
         log.info( "Opening lzma sub. for %s: %s", mode, path )
         if r:
@@ -111,16 +504,166 @@ def opener( path, mode='rb', bufsize=4*1024 ):
                                     shell=False, bufsize=bufsize, stdout=subprocess.PIPE )
             # Reading; terminate the subprocess, because we don't want any more of the 
             # output decompressed
-            return closer_subprocess( path, sub.stdout, sub, terminate=True )
+            return detecting( closer_subprocess( path, sub.stdout, sub, terminate=True ))
         else:
             sub			= subprocess.Popen( 'xz --compress > ' + path,
                                     shell=True, bufsize=bufsize, stdin=subprocess.PIPE )
             # Writing; do not terminate; close the stdin stream and wait for the subprocess
             # to detect EOF and terminate naturally.
             return closer_subprocess( path, sub.stdin, sub )
+    elif path.endswith( '.zst' ):
+        assert zstandard, "Reading/writing %s requires the zstandard module" % path
+        log.info( "Opening zstd file for %s: %s", mode, path )
+        raw			= open( path, 'rb' if r else 'wb' )
+        if r:
+            # A history file may have been appended to in several zstd frames
+            try:
+                stream		= zstandard.ZstdDecompressor().stream_reader(
+                    raw, read_size=bufsize, read_across_frames=True )
+            except TypeError: # zstandard < 0.19
+                stream		= zstandard.ZstdDecompressor().stream_reader( raw, read_size=bufsize )
+            return detecting( closer( path, io.BufferedReader( stream, buffer_size=bufsize ), raw ))
+        return closer( path, zstandard.ZstdCompressor().stream_writer( raw, write_size=bufsize ), raw )
+    elif mmapped:
+        log.info( "Opening mmap file for %s: %s", mode, path )
+        return detecting( closer( path, mapped( path )))
     else:
         log.info( "Opening raw  file for %s: %s", mode, path )
-        return closer( path, open( path, mode, bufsize ))
+        return detecting( closer( path, open( path, mode, bufsize )))
+
+
+class indexer( object ):
+    """A sidecar index for a history file, allowing a reader to seek near a target time instead of
+    parsing every record from the start of the file.  For a history file 'blah.hst', the index is
+    stored in 'blah.hst.idx'; each line records an entry (about every 'interval' bytes of history):
+
+        <offset>\t<line>\t<timestamp>\t<json>\n
+
+    The <offset> and <line> number locate a record in the (uncompressed) history file, and the
+    <timestamp> (a UNIX timestamp value) is that of the latest record preceding it; the <json> is
+    the accumulated value of every (dict) record preceding it -- a "keyframe" equivalent to an
+    initial frame of history data, as of <timestamp>.  A reader can then yield the keyframe, and
+    resume parsing at <offset>.
+
+    Offsets are in uncompressed bytes, so an index remains valid after its history file is
+    compressed (eg. blah.hst.1 --> blah.hst.1.gz); the index may be renamed to 'blah.hst.1.gz.idx',
+    or left as 'blah.hst.1.idx'.  Seeking into a compressed file decompresses (but does not parse)
+    the data preceding the offset; .gz and .bz2 files seek in-process, and an .xz file's stream is
+    read and discarded.  An index may be created for an existing (possibly compressed) history file
+    using indexer.build, eg:
+
+        python -c "from cpppo.history import indexer; indexer.build( 'blah.hst.1.gz' )"
+
+    """
+    SUFFIX			= '.idx'
+    INTERVAL			= 1024 * 1024	# Default history bytes between index entries
+
+    def __init__( self, path, entries ):
+        self.path		= path
+        self.entries		= entries	# [(<timestamp>,<offset>,<line>,<json>), ...]
+        self.times		= [ e[0] for e in entries ]
+
+    @classmethod
+    def paths( cls, path ):
+        """The candidate sidecar index file names for the history file 'path'."""
+        yield path + cls.SUFFIX
+        base,ext		= os.path.splitext( path )
+        if ext in ( '.gz', '.bz2', '.xz' ):
+            yield base + cls.SUFFIX
+
+    @classmethod
+    def load( cls, path ):
+        """Load the sidecar index for the history file 'path', or return None if there is no (valid)
+        index."""
+        for idx in cls.paths( path ):
+            try:
+                entries		= []
+                with open( idx, 'rb' ) as fd:
+                    for l in fd:
+                        if not l.endswith( b'\n' ):
+                            break # incomplete final entry
+                        off,lin,ts,js = l.decode( 'ascii' ).split( '\t', 3 )
+                        entries.append( (float( ts ),int( off ),int( lin ),js) )
+                log.info( "Loaded %d entries from history index %s", len( entries ), idx )
+                return cls( idx, entries )
+            except Exception as exc:
+                log.debug( "No history index %s: %s", idx, exc )
+        return None
+
+    def locate( self, target ):
+        """Return the last (<timestamp>,<offset>,<line>,<json>) entry with a keyframe <timestamp> at or
+        before the 'target' (a timestamp or UNIX time), or None."""
+        i			= bisect.bisect_right( self.times, float( target ))
+        return self.entries[i-1] if i else None
+
+    @staticmethod
+    def entry( offset, line, ts, state ):
+        """Format an index entry line (a str), for the record at 'offset'/'line', keyframe <timestamp>
+        'ts' and accumulated 'state'."""
+        return '%d\t%d\t%.*f\t%s\n' % (
+            offset, line, timestamp._precision, ts.value if isinstance( ts, timestamp ) else ts,
+            json.dumps( state ))
+
+    @staticmethod
+    def accumulate( state, data ):
+        """Update the accumulated keyframe state with (dict) history record data; as JSON, the keys
+        are always strings."""
+        if isinstance( data, dict ):
+            state.update( ( k if isinstance( k, type_str_base ) else json.dumps( k ), v )
+                          for k,v in data.items() )
+
+    @staticmethod
+    def seek( fd, offset ):
+        """Position a newly opened opener stream 'fd' at the (uncompressed) 'offset', by seeking if
+        possible, or by reading and discarding the preceding data."""
+        stream			= getattr( fd, 'fd', fd )
+        try:
+            stream.seek( offset )
+            return
+        except Exception as exc:
+            log.debug( "Cannot seek %s; reading to offset %d: %s", stream, offset, exc )
+        remains			= offset
+        while remains > 0:
+            chunk		= stream.read( min( remains, 1024 * 1024 ))
+            assert chunk, "History file ended before offset %d" % ( offset )
+            remains	       -= len( chunk )
+
+    @classmethod
+    def scan( cls, fd, offset=0, line=0, state=None, encoding=None, interval=None, entries=None ):
+        """Scan the history records in the opener stream 'fd' (positioned at 'offset' and 'line'),
+        accumulating the keyframe state.  If a list of 'entries' is supplied, append index entry
+        lines every 'interval' bytes.  Returns the final offset, line, timestamp and state."""
+        if state is None:
+            state		= {}
+        if interval is None:
+            interval		= cls.INTERVAL
+        indexed,ts		= offset,None
+        for l in fd:
+            rec			= l.decode( encoding or 'ascii' ).lstrip()
+            if rec and not rec.startswith( '#' ):
+                dt,sn,js	= rec.split( '\t', 2 )
+                if entries is not None and ts is not None and offset - indexed >= interval:
+                    entries.append( cls.entry( offset, line, ts, state ))
+                    indexed	= offset
+                ts		= timestamp( dt )
+                cls.accumulate( state, json.loads( js ))
+            offset	       += len( l )
+            line	       += 1
+        return offset,line,ts,state
+
+    @classmethod
+    def build( cls, path, interval=None, encoding=None ):
+        """Create (or replace) the sidecar index for an existing (possibly compressed) history file,
+        returning the number of index entries."""
+        entries			= []
+        with opener( path ) as fd:
+            cls.scan( fd, interval=interval, encoding=encoding, entries=entries )
+        idx			= path + cls.SUFFIX
+        with open( idx, 'wb' ) as fd:
+            for e in entries:
+                fd.write( e.encode( 'ascii' ))
+        log.normal( "Indexed history file %s: %d entries in %s", path, len( entries ), idx )
+        return len( entries )
 
 
 class logger( object ):
@@ -134,11 +677,23 @@ class logger( object ):
     attribute between opens, and will take effect on the next log rotation.  If playback may catch
     up to the current time, it is critical to set line buffering.
 
+    If 'index' is True (or a number of bytes between index entries), a sidecar indexer file is
+    maintained, allowing readers to seek directly to a target time.  The accumulated keyframe state
+    of all history written is retained; if an existing history file is re-opened, it is scanned
+    (from its last index entry) to recover the state.  Any failure to maintain the index is logged,
+    and disables indexing 'til the next open; the history file itself is unaffected.
+
+    If 'binary', the history is written in the blocks format, compressed using 'codec' (default:
+    'zlib').  Records are accumulated 'til 'block' records (default: 1000) are pending (or the
+    history file is closed); with line buffering, each record is written as its own block.  A binary
+    history file cannot be indexed.
+
     """
     DFLT_BUF			= None
     LINE_BUF			= 1
+    BLOCK			= 1000
 
-    def __init__( self, path, bufsize=DFLT_BUF ):
+    def __init__( self, path, bufsize=DFLT_BUF, index=None, binary=False, codec=None, block=None ):
         log.info( "Logging history to path: %s", path )
         if type( path ) is str:
             path_dir		= os.path.dirname( path )
@@ -149,6 +704,17 @@ class logger( object ):
         self.f			= None
         self.error		= False
         self.bufsize		= bufsize
+        self.index		= indexer.INTERVAL if index is True else index
+        self.x			= None		# The sidecar index file, and the history file's
+        self.indexed		= None		#   offset of the last index entry,
+        self.line		= None		#   current line number,
+        self.last		= None		#   timestamp of the last record,
+        self.state		= None		#   and the accumulated keyframe state
+        assert not ( binary and index ), "A binary history file cannot be indexed"
+        self.binary		= binary
+        self.codec		= codec
+        self.block		= block or self.BLOCK
+        self.pending		= []		# Binary records awaiting a block write
 
     def __nonzero__( self ):
         """History logger should evaluate to false if:
@@ -196,14 +762,73 @@ class logger( object ):
         if self.path:
             log.info( "Opening history file: %s", self.path )
             self.f		= open( self.path, 'ab+', *( [] if self.bufsize is None else [self.bufsize]) )
+            if self.binary:
+                self.f.seek( 0, os.SEEK_END )
+                if self.f.tell():
+                    self.f.seek( 0 )
+                    magic	= self.f.read( len( blocks.MAGIC ))
+                    self.f.seek( 0, os.SEEK_END )
+                    if magic != blocks.MAGIC:
+                        self.f.close()
+                        self.f	= None
+                        raise AssertionError( "Cannot append binary history to %s" % self.path )
+                else:
+                    self.f.write( blocks.MAGIC )
+            if self.index:
+                self.open_index()
             return True
         else:
             return False
 
+    def open_index( self ):
+        """Open the sidecar index, recovering the keyframe state of any existing history records."""
+        try:
+            self.f.seek( 0, os.SEEK_END )
+            size		= self.f.tell()
+            offset,line,ts,state= 0,0,None,{}
+            idx			= indexer.load( self.path ) if size else None
+            if idx and idx.entries and idx.entries[-1][1] <= size:
+                ts,offset,line,js = idx.entries[-1]
+                state		= json.loads( js )
+                ts		= timestamp( ts )
+            indexed		= offset
+            if offset < size:
+                with opener( self.path ) as fd:
+                    indexer.seek( fd, offset )
+                    offset,line,last,state = indexer.scan( fd, offset=offset, line=line, state=state )
+                    ts		= last or ts
+            self.x		= open( self.path + indexer.SUFFIX, 'ab' if size else 'wb' )
+            self.indexed	= indexed
+            self.line		= line
+            self.last		= ts
+            self.state		= state
+        except Exception as exc:
+            log.error( "History indexing disabled for %s: %s", self.path, exc )
+            self.close_index()
+
+    def close_index( self ):
+        if self.x:
+            try:
+                self.x.close()
+            except Exception as exc:
+                log.warning( "Closing history index for %s failed: %s", self.path, exc )
+        self.x			= None
+        self.state		= None
+
+    def flush_block( self ):
+        """Write any pending binary records as a block; they are discarded, even on failure."""
+        if self.pending:
+            try:
+                self.f.write( blocks.encode( self.pending, codec=self.codec ))
+            finally:
+                self.pending	= []
+
     def close( self ):
         if self.f:
             log.info( "Closing history file: %s", self.path )
+            self.close_index()
             try:
+                self.flush_block()
                 self.f.close()			# May raise if file system full
             finally:
                 self.f		= None		# maintain integrity by clearing self.f
@@ -217,8 +842,40 @@ class logger( object ):
         """
         if not self.f:
             assert self.open(), "Could not open file %s for writing" % self.path
+        if self.binary:
+            return self._record( None, None, msg[2:-1] if msg.startswith( '# ' ) else msg, encoding=encoding )
         self.f.write( msg.encode( encoding or 'ascii' ))
-        
+        if self.x:
+            self.line	       += msg.count( '\n' )
+
+    def _index( self, ts, data ):
+        """Add an index entry for the record about to be appended (if due), and accumulate its data
+        into the keyframe state."""
+        if not self.f:
+            assert self.open(), "Could not open file %s for writing" % self.path
+        if not self.x:
+            return
+        try:
+            offset		= self.f.tell()
+            if self.last is not None and offset - self.indexed >= self.index:
+                self.x.write( indexer.entry( offset, self.line, self.last, self.state ).encode( 'ascii' ))
+                self.x.flush()
+                self.indexed	= offset
+            self.last		= ts
+            indexer.accumulate( self.state, data )
+        except Exception as exc:
+            log.error( "History indexing disabled for %s: %s", self.path, exc )
+            self.close_index()
+
+    def _record( self, ts, serial, data, encoding=None ):
+        """Appends a record (a comment, if 'ts' is None) of JSON str 'serial' and 'data' to the
+        binary history file, writing a block if enough records are pending."""
+        if not self.f:
+            assert self.open(), "Could not open file %s for writing" % self.path
+        self.pending.append( (ts,( serial or '' ).encode( encoding or 'ascii' ),data.encode( encoding or 'ascii' )) )
+        if len( self.pending ) >= self.block or self.bufsize == self.LINE_BUF:
+            self.flush_block()
+
     def comment( self, s, encoding=None ):
         if self.path is None:
             return
@@ -234,10 +891,21 @@ class logger( object ):
         """
         if self.path is None:
             return
-        ts		= timestamp( now )
+        self._commit( timestamp( now ), data, serial, encoding=encoding )
+
+    def _commit( self, ts, data, serial, encoding=None, encoded=None ):
+        """Append a record of the data and serial number (or their already 'encoded' JSON) at
+        timestamp 'ts'.  Log (and absorb) failures, and log the resumption of writing after a failure.
+
+        """
         try:
-            self._append( '\t'.join( (str( ts ), json.dumps( serial ), json.dumps( data ))) + '\n',
-                          encoding=encoding )
+            sn,js		= encoded or ( json.dumps( serial ), json.dumps( data ))
+            if self.binary:
+                self._record( ts.value, sn, js, encoding=encoding )
+            else:
+                if self.index:
+                    self._index( ts, data )
+                self._append( '\t'.join( (str( ts ), sn, js )) + '\n', encoding=encoding )
             if self.error:
                 log.error( "History writing resumed at %s", ts )
             self.error		= False
@@ -246,6 +914,185 @@ class logger( object ):
                 log.error( "History writing failure at %s: %s", ts, exc )
             self.error		= True
 
+
+class logger_background( logger ):
+    """Log history data to a file via a dedicated writer Thread, so that callers never block on disk
+    I/O (unless so configured, when the queue is full).  The file format, and the error/resume
+    logging semantics are the same as the logger's.
+
+    Records are serialized to JSON (and timestamped) in the caller's Thread, and queued (up to
+    'queue' records; default 10,000).  The writer Thread "group commits" all the queued records,
+    and flushes the file once per batch; it then awaits the 'flush' interval (default: 1.0s) to
+    allow more records to accumulate.  The 'fsync' policy may be None/False (never), True (after
+    every batch), or a number of seconds (at most that often).
+
+    If the queue is full, the 'overflow' policy determines what happens to a new record:
+
+        'block'		-- await room in the queue (default)
+        'drop'		-- discard the new record
+        'drop_oldest'	-- discard the oldest queued record
+
+    Discarded records are counted in .dropped.  Use .flush to await the writing of all queued records
+    (eg. before log rotation); .close flushes before closing the file, and .stop (also invoked on
+    exiting its context manager) terminates the writer Thread.
+
+    """
+    BLOCK			= 'block'
+    DROP			= 'drop'
+    DROP_OLDEST			= 'drop_oldest'
+
+    def __init__( self, path, bufsize=logger.DFLT_BUF, queue=None, flush=None, fsync=None, overflow=None,
+                  **kwds ):
+        super( logger_background, self ).__init__( path, bufsize=bufsize, **kwds )
+        self.queue_size		= 10000 if queue is None else queue
+        self.flush_interval	= 1.0 if flush is None else flush
+        self.fsync		= fsync
+        self.overflow		= overflow or self.BLOCK
+        assert self.overflow in ( self.BLOCK, self.DROP, self.DROP_OLDEST ), \
+            "Unrecognized history queue overflow policy: %r" % ( self.overflow, )
+        self.queue		= collections.deque()
+        self.ready		= threading.Condition()	# Protects queue and writer state
+        self.lock		= threading.RLock()	# Held while writing, opening or closing
+        self.writer		= None
+        self.busy		= False
+        self.flushing		= False
+        self.stopping		= False
+        self.synced		= timer()
+        self.dropped		= 0
+        self.written		= 0
+        self.batches		= 0
+
+    def __exit__( self, typ, val, tbk ):
+        try:
+            self.stop()
+        except Exception as exc:
+            log.warning( "Suppressed stop failure on logger_background.__exit__: %s", exc )
+        return super( logger_background, self ).__exit__( typ, val, tbk )
+
+    def _enqueue( self, item ):
+        with self.ready:
+            if self.writer is None:
+                self.writer	= threading.Thread( target=self._run, name="history %s" % ( self.path ))
+                self.writer.daemon = True
+                self.writer.start()
+            while len( self.queue ) >= self.queue_size:
+                if self.overflow == self.BLOCK:
+                    self.ready.wait()
+                    continue
+                self.dropped   += 1
+                if self.dropped == 1 or not self.dropped % 1000:
+                    log.warning( "History queue overflow; %d records dropped", self.dropped )
+                if self.overflow == self.DROP:
+                    return
+                self.queue.popleft()
+            self.queue.append( item )
+            self.ready.notify_all()
+
+    def write( self, data, now=None, serial=None, encoding=None ):
+        """Timestamp and serialize the record to JSON, and queue it for writing."""
+        if self.path is None:
+            return
+        ts			= timestamp( now )
+        try:
+            encoded		= json.dumps( serial ), json.dumps( data )
+        except Exception as exc:
+            if not self.error:
+                log.error( "History writing failure at %s: %s", ts, exc )
+            self.error		= True
+            return
+        if self.index and isinstance( data, dict ):
+            data		= dict( data )		# The keyframe state accumulates data later
+        self._enqueue( (ts,data,serial,encoding,encoded) )
+
+    def comment( self, s, encoding=None ):
+        if self.path is None:
+            return
+        self._enqueue( (None,s,None,encoding,None) )
+
+    def _batch( self, batch ):
+        """Write a batch of records, flushing (and perhaps syncing) the file once."""
+        with self.lock:
+            for ts,data,serial,encoding,encoded in batch:
+                if ts is None:
+                    super( logger_background, self ).comment( data, encoding=encoding )
+                else:
+                    self._commit( ts, data, serial, encoding=encoding, encoded=encoded )
+            self.written       += len( batch )
+            self.batches       += 1
+            if self.f:
+                try:
+                    self.f.flush()
+                    now		= timer()
+                    if self.fsync is True or ( self.fsync and now - self.synced >= self.fsync ):
+                        os.fsync( self.f.fileno() )
+                        self.synced = now
+                except Exception as exc:
+                    if not self.error:
+                        log.error( "History writing failure at %s: %s", timestamp(), exc )
+                    self.error	= True
+
+    def _run( self ):
+        while True:
+            with self.ready:
+                while not self.queue and not self.stopping:
+                    self.ready.wait()
+                if not self.queue:
+                    return # stopping
+                batch		= list( self.queue )
+                self.queue.clear()
+                self.busy	= True
+                self.ready.notify_all()
+            try:
+                self._batch( batch )
+            except Exception as exc:
+                log.error( "History writer failure: %s", exc )
+            with self.ready:
+                self.busy	= False
+                self.ready.notify_all()
+                # Group commit; allow records to accumulate for the flush interval
+                deadline	= timer() + self.flush_interval
+                while not ( self.stopping or self.flushing ) and len( self.queue ) < self.queue_size:
+                    remains	= deadline - timer()
+                    if remains <= 0:
+                        break
+                    self.ready.wait( remains )
+
+    def flush( self, timeout=None ):
+        """Await the writing of all queued records; returns True iff the queue has been drained."""
+        deadline		= None if timeout is None else timer() + timeout
+        with self.ready:
+            self.flushing	= True
+            self.ready.notify_all()
+            try:
+                while ( self.queue or self.busy ) and self.writer is not None and self.writer.is_alive():
+                    remains	= None if deadline is None else deadline - timer()
+                    if remains is not None and remains <= 0:
+                        break
+                    self.ready.wait( remains )
+                return not ( self.queue or self.busy )
+            finally:
+                self.flushing	= False
+
+    def close( self ):
+        self.flush()
+        with self.lock:
+            super( logger_background, self ).close()
+
+    def stop( self ):
+        """Write all queued records, and terminate the writer Thread."""
+        with self.ready:
+            writer		= self.writer
+            self.stopping	= True
+            self.ready.notify_all()
+        try:
+            if writer is not None:
+                writer.join()
+        finally:
+            with self.ready:
+                self.writer	= None
+                self.stopping	= False
+
+
 def parse_record( fd, n=-1, encoding=None ):
     """Parse the next non-comment record from a history file.  The date-time and serial number must be
     intact, but the remainder of the line are returned as-is.  Raise StopIteration if no record
@@ -254,10 +1101,20 @@ def parse_record( fd, n=-1, encoding=None ):
     The default 'ascii' encoding assumes no non-ASCII (eg. UTF-8) characters in the file, or an
     exception will be raised.
 
+    A binary blocks format history file's opener yields (<timestamp>,<serial>,<data>) records;
+    these require no timestamp parsing.  An mmapped opener yields (<time>,<serial>,<data>) records
+    (or None for a blank or comment line).
+
     """
     l				= None
     for l in fd:
         n		       += 1
+        if l is None:
+            continue # blank or comment (mmapped)
+        if type( l ) is tuple:
+            ts,sn,js		= l
+            return n,(timestamp( ts ), int( sn ) if sn.isdigit() else json.loads( sn.decode( encoding or 'ascii' )),
+                      js.decode( encoding or 'ascii' ))
         l			= l.decode( encoding or 'ascii' ).lstrip()
         if not l or l.startswith( '#' ):
             l			= None
@@ -266,7 +1123,179 @@ def parse_record( fd, n=-1, encoding=None ):
     if not l:
         raise StopIteration( "Empty file" )
     dt,sn,js			= l.split( '\t', 2 )
-    return n,(timestamp( dt ), json.loads( sn ), js )
+    return n,(timestamp( dt ), int( sn ) if sn.isdigit() else json.loads( sn ), js )
+
+
+def convert( src, dst, binary=None, codec=None, block=None, encoding=None ):
+    """Convert the history file 'src' between the text and binary blocks formats (by default, into the
+    other format), writing 'dst' (either may be compressed, eg. '.gz').  Comments are retained.
+    Returns the number of records (including comments) converted.
+
+    """
+    if block is None:
+        block			= logger.BLOCK
+    count			= 0
+    with opener( src ) as fd:
+        source			= isinstance( fd, blocks.reader )
+        if source:
+            fd.comments		= True
+        if binary is None:
+            binary		= not source
+        with opener( dst, mode='wb' ) as out:
+            pending		= []
+            if binary:
+                out.write( blocks.MAGIC )
+            for rec in fd:
+                if source:
+                    ts,sn,js	= rec
+                    sn,js	= sn.decode( encoding or 'ascii' ),js.decode( encoding or 'ascii' )
+                else:
+                    l		= rec.decode( encoding or 'ascii' ).strip()
+                    if not l:
+                        continue
+                    if l.startswith( '#' ):
+                        ts,sn,js= None,None,l[1:].strip()
+                    else:
+                        dt,sn,js= l.split( '\t', 2 )
+                        ts	= timestamp( dt ).value
+                count	       += 1
+                if binary:
+                    pending.append( (ts,sn or '',js) )
+                    if len( pending ) >= block:
+                        out.write( blocks.encode( pending, codec=codec ))
+                        pending	= []
+                elif ts is None:
+                    out.write( ( '# ' + js + '\n' ).encode( encoding or 'ascii' ))
+                else:
+                    out.write( '\t'.join( ( str( timestamp( ts )), sn, js )).encode( encoding or 'ascii' ) + b'\n' )
+            if pending:
+                out.write( blocks.encode( pending, codec=codec ))
+    log.normal( "Converted %d history records from %s to %s (%s)", count, src, dst, "binary" if binary else "text" )
+    return count
+
+
+def query( path, start=None, stop=None, keys=None, seek=True, encoding=None, mmapped=False ):
+    """Yield the (<timestamp>,<data>) records of the history file 'path' and its rotated files (oldest
+    first) with start <= <timestamp> < stop, as fast as they can be read; no playback clock is
+    involved.  Either bound may be None (unbounded), or a timestamp, UNIX time or UTC string.
+
+    If 'keys' is supplied (eg. register numbers), only those keys of each record's (dict) data are
+    yielded, and records containing none of them are skipped.  History files entirely before
+    'start' or after 'stop' are not read (beyond their initial record) and, if 'seek', a history
+    file's sidecar indexer is used to begin reading near 'start'.  Unparsable records are logged
+    and skipped.  If 'mmapped', uncompressed history files are scanned via mmap (see mapped), and
+    those without an index are binary searched for 'start'.
+
+    """
+    start			= None if start is None else timestamp( start )
+    stop			= None if stop is None else timestamp( stop )
+    if keys is not None:
+        keys			= set( k if isinstance( k, type_str_base ) else json.dumps( k ) for k in keys )
+
+    # Find the initial timestamp of each history file, newest first.  A file being compressed may
+    # momentarily also exist in uncompressed form (eg. blah.hst.1 and blah.hst.1.gz); prefer the
+    # uncompressed one.
+    dirs,name			= os.path.dirname( path ),os.path.basename( path )
+    found			= []
+    for f in sorted(( n for n in os.listdir( dirs or os.curdir )
+                      if n.startswith( name ) and not n.endswith( indexer.SUFFIX )), key=natural ):
+        try:
+            with opener( os.path.join( dirs, f )) as fd:
+                _,(ts,_,_)	= parse_record( fd, encoding=encoding )
+        except Exception as exc:
+            log.normal( "Ignoring history file %s: %s", f, exc )
+            continue
+        if found and f.startswith( found[-1][1] + '.' ) and ts == found[-1][0]:
+            log.info( "Ignoring duplicate history file %s", f )
+            continue
+        found.append( (ts,f) )
+    found.reverse()
+
+    for i,(ts,f) in enumerate( found ):
+        if stop is not None and ts >= stop:
+            break
+        if start is not None and i + 1 < len( found ) and found[i+1][0] < start:
+            continue # The next history file begins before 'start'; no records of interest in this one
+        with opener( os.path.join( dirs, f ), mmapped=mmapped ) as fd:
+            n			= -1
+            if seek and start is not None and ts < start and not isinstance( fd, blocks.reader ):
+                idx		= indexer.load( os.path.join( dirs, f ))
+                # The last entry whose keyframe (preceding record) is strictly before 'start'
+                e		= bisect.bisect_left( idx.times, start.value - timestamp._epsilon ) if idx else 0
+                if e:
+                    _,off,lin,_	= idx.entries[e-1]
+                    indexer.seek( fd, off )
+                    n		= lin - 1
+                    log.info( "Query seeking to %s, line %d, for %s", f, lin, start )
+                elif isinstance( fd, mapped ):
+                    # No index; binary search the mapped file.  Line numbers are no longer known.
+                    off		= fd.locate( start )
+                    log.info( "Query seeking to %s, offset %d, for %s", f, off, start )
+            while True:
+                try:
+                    n,(ts,sn,js)= parse_record( fd, n=n, encoding=encoding )
+                    if start is not None and ts < start:
+                        continue
+                    if stop is not None and ts >= stop:
+                        return
+                    data	= json.loads( js )
+                except StopIteration:
+                    break
+                except Exception as exc:
+                    log.warning( "Query ignoring unparsable record in %s, line %d: %s", f, n, exc )
+                    continue
+                if keys is not None:
+                    if not isinstance( data, dict ):
+                        continue
+                    data	= dict( (k,v) for k,v in data.items() if k in keys )
+                    if not data:
+                        continue
+                yield ts,data
+
+
+def aggregate( path, interval, start=None, stop=None, keys=None, seek=True, encoding=None, mmapped=False ):
+    """Summarize the history records (see query) in 'interval' second buckets, yielding a
+    (<timestamp>,{<key>: <summary>, ...}) for each bucket containing records; the <timestamp> is
+    the beginning of the bucket.  Buckets are aligned to 'start' (if supplied), otherwise to
+    multiples of 'interval' since the UNIX epoch.  Each key's <summary> is a dotdict of the .first,
+    .last, .min, .max and .mean of its values and their .count; .min/.max/.mean include only
+    numeric values (None if there are none).
+
+    """
+    assert interval > 0, "Aggregation interval must be positive"
+    origin			= 0.0 if start is None else timestamp( start ).value
+    bucket,summary		= None,{}
+
+    def summarize():
+        for v in summary.values():
+            v.mean		= None if not v.numeric else v.pop( 'total' ) / v.numeric
+            v.pop( 'numeric' )
+            v.pop( 'total', None )
+        return timestamp( bucket ),summary
+
+    for ts,data in query( path, start=start, stop=stop, keys=keys, seek=seek, encoding=encoding,
+                          mmapped=mmapped ):
+        if not isinstance( data, dict ):
+            continue
+        b			= origin + ( ts.value - origin ) // interval * interval
+        if b != bucket:
+            if summary:
+                yield summarize()
+            bucket,summary	= b,{}
+        for k,v in data.items():
+            agg			= summary.get( k )
+            if agg is None:
+                agg		= summary[k] = dotdict( first=v, last=v, min=None, max=None, count=0,
+                                                        numeric=0, total=0 )
+            agg.last		= v
+            agg.count	       += 1
+            if isinstance( v, (int,float) ) and not isinstance( v, bool ):
+                agg.min		= v if agg.min is None else min( agg.min, v )
+                agg.max		= v if agg.max is None else max( agg.max, v )
+                agg.numeric    += 1
+                agg.total      += v
+    if summary:
+        yield summarize()
 
 
 class HistoryExhausted( Exception ):
@@ -293,8 +1322,19 @@ class reader( object ):
     request can be found, then reader evaluates False, and register/updates will raise an exception
     if called; it is recommended that the user cease using the reader and discard it.
 
+    If 'prefetch' (bytes) is specified, then whenever a history file is opened for playback, the
+    next (newer) compressed history file is opened and decompressed in a background thread, up to
+    'prefetch' bytes ahead; when playback switches to it, its records are ready.  Call close to
+    discard any unused prefetched file.
+
+    If 'mmapped', uncompressed history files are scanned via mmap (see mapped); records are found
+    without reading lines into Python, and a history file still being written is tailed without
+    re-reading it.
+
     """
-    def __init__( self, path, historical, basis=None, factor=None ):
+    PREFETCHABLE		= ( '.gz', '.bz2', '.xz', '.zst' )
+
+    def __init__( self, path, historical, basis=None, factor=None, prefetch=None, mmapped=False ):
         log.info( "Reading history from path: %s", path )
         self.path		= path
         self.dirs		= os.path.dirname( self.path )
@@ -302,6 +1342,38 @@ class reader( object ):
         self.historical		= timestamp( historical )
         self.basis		= timestamp( basis )
         self.factor		= factor or 1.0
+        self.prefetch		= prefetch
+        self.mmapped		= mmapped
+        self.prefetched		= {}			# { <path>: (<inode>,<opener>), ... }
+
+    def prefetching( self, path ):
+        """Begin prefetching the (compressed) history file at 'path', if not already."""
+        if not self.prefetch or path in self.prefetched or not path.endswith( self.PREFETCHABLE ):
+            return
+        try:
+            ino			= os.stat( path ).st_ino
+            self.prefetched[path] = ino,opener( path, prefetch=self.prefetch )
+        except Exception as exc:
+            log.info( "%s Not prefetching history file %s: %s", self, path, exc )
+
+    def prefetched_opener( self, path ):
+        """Return the prefetched opener for path, if it is still the same file (not rotated), or None."""
+        ino,fd			= self.prefetched.pop( path, (None,None) )
+        if fd is not None:
+            try:
+                if os.stat( path ).st_ino == ino:
+                    log.info( "%s Using prefetched history file %s", self, path )
+                    return fd
+            except Exception:
+                pass
+            fd.close()
+        return None
+
+    def close( self ):
+        """Discard any unused prefetched history files."""
+        while self.prefetched:
+            _,(_,fd)		= self.prefetched.popitem()
+            fd.close()
 
     def __str__( self ):
         """Gives the historical start time, followed by how far the current historical time has advanced."""
@@ -356,7 +1428,7 @@ class reader( object ):
             when		= when.value
         return ( when - self.historical.value ) / self.factor + self.basis.value
 
-    def open( self, target=None, after=True, lookahead=None, strict=False, encoding=None ):
+    def open( self, target=None, after=True, lookahead=None, strict=False, encoding=None, seek=False ):
         """Open an iterator which will yield its historical records vs. self.historical, at the
         prescribed self.{basis,rate}, relative to the initial timestamp 'target' (eg. the last
         timestamp from the previous file).  If no appropriate historical file can be found, raises a
@@ -414,6 +1486,11 @@ class reader( object ):
         prudent to try again in a few milliseconds, in case files are being rotated at that instant
         and two subsequent files (momentarily) had the same timestamp, because it was moved.
 
+        If 'seek' (and not 'after'), and the file has a sidecar indexer, the keyframe of the last
+        index entry at or before 'target' is yielded in place of the file's initial record (an
+        "iframe" of all accumulated values), and parsing resumes at the indexed offset.  Sidecar
+        index files (ending in indexer.SUFFIX) are never considered to be history files.
+
         """
         if target is None:
             # If no target is supplied, we'll guess that we want to start from where we presently
@@ -438,14 +1515,18 @@ class reader( object ):
             # only the file name extension!
             fd			= None
             flen		= len( self.name )
-            for f in sorted(( n[flen:] for n in os.listdir( self.dirs ) if n.startswith( self.name )), key=natural ):
+            names		= sorted(( n[flen:] for n in os.listdir( self.dirs )
+                                           if n.startswith( self.name ) and not n.endswith( indexer.SUFFIX )),
+                                         key=natural )
+            for f in names:
                 fd		= None
                 try:
                     # Evaluate this file; load the first record and check before/after target If
                     # anything is wrong with the file or the header, skip it.  We are intolerant of
                     # errors at the beginning of a file, because this is where the "iframe" of all
                     # current register values must be.
-                    fd		= opener( self.path + f )
+                    fd		= self.prefetched_opener( self.path + f ) \
+                                          or opener( self.path + f, mmapped=self.mmapped )
                     n		= -1
                     n,(ts,sn,js)= parse_record( fd, encoding=encoding )
                 except StopIteration:
@@ -481,6 +1562,30 @@ class reader( object ):
                 fd.close()
 
             f,n,fd,(ts,js)	= opened[0]
+
+            # Any prefetched files not used by now are stale; begin prefetching the next (newer)
+            # history file, which playback will switch to after this one.
+            self.close()
+            i			= names.index( f )
+            if i > 0:
+                self.prefetching( self.path + names[i-1] )
+
+            if seek and not after:
+                idx		= indexer.load( self.path + f )
+                entry		= idx.locate( target ) if idx else None
+                if entry and entry[0] >= ts.value:
+                    # Resume parsing at the indexed offset, yielding the keyframe as the "iframe".
+                    # The indexed keyframe's timestamp is that of the preceding record; n is the
+                    # line number of the record preceding the one at the indexed offset.
+                    kts,off,lin,kjs	= entry
+                    fd.close()
+                    opened.pop()
+                    fd		= opener( self.path + f, mmapped=self.mmapped )
+                    opened.append( (f,n,fd,(ts,js)) )
+                    indexer.seek( fd, off )
+                    n,(ts,js)	= lin - 1,(timestamp( kts ),kjs)
+                    log.normal( "%s Playback seeking to %s, line %d (keyframe %s, before %s)", self,
+                                self.name+f, lin, ts, target )
             log.debug( "%s Playback starting on %s, line %d (%s %s %s)", self,
                              self.name+f, n, ts, "after" if after else "before", target )
 
@@ -574,9 +1679,12 @@ class loader( reader ):
         (SWITCHING,AWAITING):	logging.DETAIL,
     }
 
-    def __init__( self, path, historical, basis=None, factor=None, lookahead=None, duration=None, values=None ):
-        super( loader, self ).__init__( path=path, historical=historical, basis=basis, factor=factor )
+    def __init__( self, path, historical, basis=None, factor=None, lookahead=None, duration=None, values=None,
+                  seek=True, prefetch=None, mmapped=False ):
+        super( loader, self ).__init__( path=path, historical=historical, basis=basis, factor=factor,
+                                        prefetch=prefetch, mmapped=mmapped )
         self.lookahead		= lookahead
+        self.seek		= seek			# Use any indexer to seek on the initial open
         self._duration		= None
         self._deadline		= None
         self.duration		= duration		# How many historical seconds to run before terminating
@@ -626,6 +1734,8 @@ class loader( reader ):
                               self, self.statename[self._state], self.statename[value],
                               ': ' + str( msg ) if msg is not None else '' )
             self._state		= value
+            if value >= self.COMPLETE:
+                self.close() # No further history files will be opened; discard any prefetched
 
     def __str__( self ):
         return super( loader, self ).__str__() + "%-7s(%5d)" % ( ' none' if self._f is None else self._f, self._n )
@@ -709,7 +1819,8 @@ class loader( reader ):
                     # We need to open the initial (or next) history file.
                     after	= ( self.state != self.INITIAL )
                     self._i	= self.open( target=self._ts, after=after, lookahead=self.lookahead,
-                                             strict=self._strict, encoding=encoding )
+                                             strict=self._strict, encoding=encoding,
+                                             seek=self.seek and not after )
                     self._strict= True # remains until we see increasing timestamps
 
                 assert self.state in (self.INITIAL, self.SWITCHING, self.STREAMING, self.EXHAUSTED, self.AWAITING)
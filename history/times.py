@@ -218,6 +218,13 @@ class timestamp( object ):
                                     else str ).maketrans( ":-.", "   " )
     _fmt			= '%Y-%m-%d %H:%M:%S'	# 2014-04-01 10:11:12
 
+    # The UNIX timestamp of 00:00:00 UTC on each recently parsed 'YYYY-MM-DD' date prefix.
+    # Replayed history walks forward through a few dates, so this rarely exceeds a handful of
+    # entries; it is simply discarded if it ever grows beyond _daycache_max.
+    _daycache			= {}
+    _daycache_max		= 1024
+    _epoch_ordinal		= datetime.date( 1970, 1, 1 ).toordinal()
+
     # A map of all the common timezone abbreviations to their canonical timezones along with the
     # proper is_dst setting.
     _tzabbrev			= {}
@@ -562,6 +569,57 @@ class timestamp( object ):
         """
         return calendar.timegm( dt.utctimetuple() ) + dt.microsecond / 1000000
 
+    @classmethod
+    def number_from_canonical( cls, s ):
+        """Convert a canonical zone-free UTC 'YYYY-MM-DD HH:MM:SS[.ssssss]' string (as produced by
+        render, and written to every history file) directly to a UNIX timestamp, without building a
+        datetime or consulting pytz.  The date prefix is converted once, and its midnight UTC
+        timestamp cached; the time of day is just arithmetic.  The result is identical to
+        number_from_datetime( datetime_from_string( s )).
+
+        Returns None if the string is not in exactly this form (eg. it has a timezone, or extra
+        whitespace, or an invalid date/time), so the caller can fall back to the general parser.
+
+        """
+        try:
+            if not ( 19 <= len( s ) <= 26 and s[4] == '-' and s[7] == '-' and s[10] == ' '
+                     and s[13] == ':' and s[16] == ':' ):
+                return None
+            ymd			= s[:10]
+            day			= cls._daycache.get( ymd )
+            if day is None:
+                if not ( s[:4].isdigit() and s[5:7].isdigit() and s[8:10].isdigit() ):
+                    return None
+                day		= 86400 * ( datetime.date( int( s[:4] ), int( s[5:7] ), int( s[8:10] )).toordinal()
+                                            - cls._epoch_ordinal )
+                if len( cls._daycache ) >= cls._daycache_max:
+                    cls._daycache	= {}
+                cls._daycache[ymd] = day
+            hh,mm,ss		= s[11:13],s[14:16],s[17:19]
+            if not ( hh.isdigit() and mm.isdigit() and ss.isdigit() ):
+                return None
+            hh,mm,ss		= int( hh ),int( mm ),int( ss )
+            if hh > 23 or mm > 59 or ss > 59:
+                return None
+            us			= 0
+            if len( s ) > 19:
+                frac		= s[20:]
+                if s[19] != '.' or not frac.isdigit():
+                    return None
+                us		= int( frac + '0' * ( 6 - len( frac )))
+            return day + hh * 3600 + mm * 60 + ss + us / 1000000
+        except (ValueError, TypeError): # eg. invalid date, non-ASCII digits, not a str
+            return None
+
+    @classmethod
+    def number_from_string( cls, s ):
+        """Convert a time string to a UNIX timestamp; the canonical UTC form takes the fast path,
+        anything else (eg. a timezone) is parsed via datetime_from_string."""
+        value			= cls.number_from_canonical( s )
+        if value is None:
+            value		= cls.number_from_datetime( cls.datetime_from_string( s ))
+        return value
+
     def __init__( self, value=None ):
         self._str		= None
         if value is None:
@@ -569,8 +627,7 @@ class timestamp( object ):
         elif isinstance( value, (float, int)):
             self.value		= float( value )
         elif isinstance( value, type_str_base ):
-            dt			= self.datetime_from_string( value )
-            self.value		= self.number_from_datetime( dt )
+            self.value		= self.number_from_string( value )
         elif isinstance( value, timestamp ):
             self.value		= value.value
             self._str		= value._str
@@ -696,7 +753,7 @@ class timestamp( object ):
         to any timezone, and produces the correct UNIX timestamp.
 
         """
-        self.value		= self.number_from_datetime( self.datetime_from_string( utctime ))
+        self.value		= self.number_from_string( utctime )
         self._str		= None
 
     @property
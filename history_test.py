@@ -12,6 +12,7 @@ import pytest
 import random
 import string
 import sys
+import threading
 import time
 
 # For the purposes of this history_test, we assume the Canada/Mountain timezone 
@@ -33,7 +34,7 @@ try:
     from cpppo.history import (
         timestamp, parse_offset, format_offset, timedelta_total_seconds,
         AmbiguousTimeZoneError, HistoryExhausted, IframeError, DataError, 
-        opener, loader, reader, logger,
+        opener, mapped, indexer, blocks, convert, query, aggregate, loader, reader, logger, logger_background, parse_record,
         parse_seconds,
         has_pytz_classic, pytz,
     )
@@ -444,6 +445,39 @@ def test_history_timestamp():
                              '2014-10-26 01:01:00 UTC' )
 
 
+@pytest.mark.skipif( not has_pytz or not got_localzone, reason="Needs pytz and localzone" )
+def test_history_timestamp_canonical():
+    """The canonical UTC string fast path must yield exactly the same value as the general parser,
+    and must decline (returning None) anything it doesn't fully understand."""
+    slow			= lambda s: timestamp.number_from_datetime( timestamp.datetime_from_string( s ))
+    for s in ( '1970-01-01 00:00:00', '1970-01-01 00:00:00.000', '2000-02-29 23:59:59.999',
+               '2014-01-01 07:00:00.0', '2014-04-24 08:00:00.123456', '2038-01-19 03:14:08.5',
+               '1969-12-31 23:59:59.999' ):
+        assert timestamp.number_from_canonical( s ) == slow( s ), s
+        assert timestamp( s ).value == slow( s )
+    for s in ( '2014-04-24 08:00:00 MDT', '2014-04-24 08:00:00.000 UTC', ' 2014-04-24 08:00:00',
+               '2014-04-24T08:00:00', '2014-02-30 00:00:00', '2014-04-24 24:00:00',
+               '2014-04-24 08:00:00.1234567', '2014-04-24 08:00:00,123', '2014-04-24 08:00:0x' ):
+        assert timestamp.number_from_canonical( s ) is None, s
+    assert timestamp( '2014-04-24 14:00:00.000' ) == timestamp( '2014-04-24 14:00:00 UTC' )
+    with pytest.raises( ValueError ):
+        timestamp( '2014-02-30 00:00:00.000' )
+
+    # Compare replay-style parsing of a steadily advancing series of rendered timestamps
+    cnt				= 10000
+    strs			= [ timestamp( 1396531199 + i * 0.371 ).render() for i in range( cnt ) ]
+    beg				= timer()
+    vals_slow			= [ slow( s ) for s in strs ]
+    dur_slow			= timer() - beg
+    beg				= timer()
+    vals_fast			= [ timestamp( s ).value for s in strs ]
+    dur_fast			= timer() - beg
+    assert vals_fast == vals_slow
+    logging.normal( "timestamp parsing: general: %d/s, canonical: %d/s (%.1fx)",
+                     cnt/dur_slow, cnt/dur_fast, dur_slow/dur_fast )
+    assert dur_fast < dur_slow
+
+
 @pytest.mark.skipif( not has_pytz or not got_localzone, reason="Needs pytz and localzone" )
 def test_history_opener():
     # Try opening all the compressed files in the 2 acceptable ways: context or iterator
@@ -458,6 +492,36 @@ def test_history_opener():
                     assert line.decode() == "hi\n"
             finally:
                 fd.close()
+            with opener( os.path.join( path, f ), prefetch=1024 ) as fd:
+                assert list( fd ) == [ b"hi\n" ]
+
+
+def test_history_opener_roundtrip():
+    """Write and read back each compressed format in-process, with and without prefetch."""
+    path		= "/tmp/test_opener_%d" % random.randint( 100000, 999999 )
+    lines		= [ ( "%06d %s\n" % ( i, 'x' * ( i % 97 ))).encode() for i in range( 20000 ) ]
+    exts		= [ '', '.gz', '.bz2', '.xz' ]
+    try:
+        import zstandard
+        exts.append( '.zst' )
+    except ImportError:
+        pass
+    try:
+        for ext in exts:
+            with opener( path + ext, mode='wb', bufsize=64*1024 ) as fd:
+                for line in lines:
+                    fd.write( line )
+            for prefetch in ( None, 10000, 1024*1024 ):
+                with opener( path + ext, bufsize=4096, prefetch=prefetch ) as fd:
+                    assert list( fd ) == lines, "%s (prefetch %s)" % ( ext, prefetch )
+            # Abandon a prefetched file part way thru; the readahead must stop cleanly
+            fd			= opener( path + ext, prefetch=8192 )
+            assert next( iter( fd )) == lines[0]
+            fd.close()
+    finally:
+        for ext in exts:
+            if os.path.exists( path + ext ):
+                os.unlink( path + ext )
 
 
 @pytest.mark.skipif( not has_pytz or not got_localzone, reason="Needs pytz and localzone" )
@@ -501,7 +565,8 @@ def test_history_sequential():
         rdr		= reader( path,
                                   historical=now - random.uniform( 3.0, 9.0 ),
                                   basis=now + random.uniform( -.5, +.5 ),
-                                  factor=3 )
+                                  factor=3, prefetch=random.choice( (None, 4096) ),
+                                  mmapped=random.choice( (True, False) ))
 
         # Begin with the first historical file before our computed advancing historical time (we
         # could provide a specific timestamp here, if we wanted).  No lookahead.
@@ -532,6 +597,7 @@ def test_history_sequential():
         assert False, "Should have raised HistoryExhausted by now"
     except HistoryExhausted as exc:
         logging.normal( "History exhausted: %s", exc )
+        rdr.close()
 
     except Exception as exc:
         logging.normal( "Test failed: %s", exc )
@@ -697,6 +763,377 @@ if 'TRACEMALLOC' in os.environ:
     
 
 
+@pytest.mark.skipif( not has_pytz or not got_localzone, reason="Needs pytz and localzone" )
+def test_history_indexed():
+    """A sidecar index allows a loader to seek to a keyframe near its target time, producing the same
+    register values as a full scan of the history file.
+
+    """
+    for _ in range( 3 ):
+        path		= "/tmp/test_indexed_%d" % random.randint( 100000, 999999 )
+        if os.path.exists( path ):
+            continue
+    assert not os.path.exists( path ), "Couldn't find an unused name: %s" % path
+
+    files		= [ path, path + indexer.SUFFIX, path + '.gz', path + '.gz' + indexer.SUFFIX ]
+    try:
+        now		= timer()
+        count		= 500
+        values		= {}
+        with logger( path, index=1000 ) as l:
+            for i in range( count // 2 ):
+                updates	= { 40001 + i % 17: i, 40100 + i % 3: -i }
+                values.update( updates )
+                l.write( updates, now=now - count + i )
+        # Re-opening an existing history file recovers its keyframe state
+        with logger( path, index=1000 ) as l:
+            l.comment( "Re-opened" )
+            for i in range( count // 2, count ):
+                updates	= { 40001 + i % 17: i }
+                values.update( updates )
+                l.write( updates, now=now - count + i )
+            assert l.state == dict( ( str( r ), v ) for r,v in values.items() )
+        idx		= indexer.load( path )
+        assert idx and len( idx.entries ) > 10
+        assert idx.locate( now - count - 1 ) is None
+
+        # An index built from the (compressed) history file has identical entries
+        with opener( path + '.gz', mode='wb' ) as fd:
+            with open( path, 'rb' ) as rd:
+                fd.write( rd.read() )
+        assert indexer.build( path + '.gz', interval=1000 ) == len( idx.entries )
+        with open( path + indexer.SUFFIX, 'rb' ) as a, open( path + '.gz' + indexer.SUFFIX, 'rb' ) as b:
+            assert a.read() == b.read()
+        os.unlink( path + '.gz' )
+
+        # Load history up to ~100s before the end, with and without seeking
+        results		= []
+        for seek,mmapped in ( ( True, True ), ( False, False )):
+            ld		= loader( path, historical=now - 100.5, basis=timer(), factor=1e-6, seek=seek,
+                                  mmapped=mmapped )
+            events	= []
+            e		= True
+            while e:
+                cur,e	= ld.load( limit=1000 )
+                events.extend( e )
+            results.append( ( len( events ), dict( ( r,v ) for r,(t,v) in ld.values.items() )))
+        (seek_events,seek_values),(full_events,full_values) = results
+        assert seek_values == full_values
+        assert full_events == count - 100 and seek_events < full_events // 4
+        assert full_values[40001 + ( count - 101 ) % 17] == count - 101
+    finally:
+        for f in files:
+            try:
+                os.unlink( f )
+            except:
+                pass
+
+
+@pytest.mark.skipif( not has_pytz or not got_localzone, reason="Needs pytz and localzone" )
+def test_history_query():
+    """Query a time range of history (across rotated files, seeking via any index) at full speed, and
+    aggregate it into buckets."""
+    for _ in range( 3 ):
+        path		= "/tmp/test_query_%d" % random.randint( 100000, 999999 )
+        if os.path.exists( path ):
+            continue
+    assert not os.path.exists( path ), "Couldn't find an unused name: %s" % path
+
+    files		= [ path + '.1.gz', path + '.1', path + '.1' + indexer.SUFFIX, path, path + indexer.SUFFIX ]
+    try:
+        beg		= 1500000000.0
+        records		= []
+        for f,rng in ( ( path + '.1', range( 0, 600 )), ( path, range( 600, 1000 ))):
+            with logger( f, index=2000 ) as l:
+                for i in rng:
+                    data	= { 40001 + i % 5: i, 40010: i % 7 }
+                    l.write( data, now=beg + i * .5 )
+                    records.append( (beg + i * .5, data) )
+        with opener( path + '.1.gz', mode='wb' ) as fd: # A duplicate (momentarily, during compression)
+            with open( path + '.1', 'rb' ) as rd:
+                fd.write( rd.read() )
+
+        def expect( start, stop, keys=None ):
+            for t,data in records:
+                if start <= t < stop:
+                    data	= dict( ( str( k ),v ) for k,v in data.items() if keys is None or k in keys )
+                    if data:
+                        yield timestamp( t ),data
+
+        for start,stop,keys in ( ( beg, beg + 500, None ), ( beg + 123.5, beg + 321, None ),
+                                 ( beg + 280, beg + 310, [40002] ), ( beg + 499.6, beg + 1e6, [40010, 40003] ),
+                                 ( beg - 10, beg, None )):
+            for seek,mmapped in ( ( True, False ), ( False, False ), ( True, True ), ( False, True )):
+                got		= list( query( path, start=start, stop=stop, keys=keys, seek=seek, mmapped=mmapped ))
+                assert got == list( expect( start, stop, keys )), "%s - %s (keys %s)" % ( start, stop, keys )
+        assert len( list( query( path ))) == 1000
+
+        buckets		= list( aggregate( path, 60, start=beg + 30, stop=beg + 300, keys=[40010] ))
+        assert len( buckets ) == 5 and buckets[0][0] == timestamp( beg + 30 )
+        b,summary	= buckets[1]
+        values		= [ d[40010] for t,d in records if b.value <= t < b.value + 60 ]
+        assert summary['40010'] == dict( first=values[0], last=values[-1], min=min( values ),
+                                         max=max( values ), count=len( values ),
+                                         mean=sum( values ) / len( values ))
+        # Unaligned, epoch-based buckets
+        buckets		= list( aggregate( path, 100 ))
+        assert buckets[0][0] == timestamp( beg ) and len( buckets ) == 5
+        assert sum( s['40001'].count for b,s in buckets ) == 200
+    finally:
+        for f in files:
+            try:
+                os.unlink( f )
+            except:
+                pass
+
+
+@pytest.mark.skipif( not has_pytz or not got_localzone, reason="Needs pytz and localzone" )
+def test_history_mapped():
+    """An mmapped scan yields the same records as parsing lines, and tails a growing file."""
+    path		= "/tmp/test_mapped_%d" % random.randint( 100000, 999999 )
+    try:
+        now		= 1500000000.0
+        with logger( path ) as l:
+            for i in range( 1000 ):
+                l.write( { 40001 + i % 5: i }, now=now + i )
+                if i % 100 == 0:
+                    l.comment( "Checkpoint %d" % i )
+        with open( path, 'ab' ) as f:
+            f.write( b"\n   \n" ) # A blank and a whitespace line
+
+        def records( fd ):
+            n,recs		= -1,[]
+            while True:
+                try:
+                    n,rec	= parse_record( fd, n=n )
+                except StopIteration:
+                    return recs
+                recs.append( rec )
+
+        with opener( path ) as fd:
+            lines		= records( fd )
+        assert len( lines ) == 1000
+
+        cnt		= 10
+        durs		= []
+        for mmapped in ( False, True ):
+            beg		= timer()
+            for _ in range( cnt ):
+                with opener( path, mmapped=mmapped ) as fd:
+                    recs	= records( fd )
+            durs.append( timer() - beg )
+            assert recs == lines
+        logging.normal( "History scan: lines: %d/s, mmapped: %d/s", 1000*cnt/durs[0], 1000*cnt/durs[1] )
+
+        # Binary search (no index) for records at/after a time, vs. a full scan
+        for start in ( now - 5, now, now + 0.5, now + 1, now + 500.25, now + 999, now + 1000 ):
+            with opener( path, mmapped=True ) as fd:
+                off		= fd.locate( start )
+                assert off == 0 if start <= now + 1 else off > 0 # may back off up to 1s
+                recs		= records( fd )
+                assert recs[0][0] >= timestamp( start - 1 ) if recs else start > now + 999
+                assert [ r for r in recs if r[0] >= timestamp( start ) ] \
+                    == [ r for r in lines if r[0] >= timestamp( start ) ]
+            assert list( query( path, start=start, stop=now + 1e6, mmapped=True )) \
+                == list( query( path, start=start, stop=now + 1e6 ))
+
+        # Tail the file as it grows, including a record that is partially written
+        fd		= opener( path, mmapped=True )
+        try:
+            assert len( records( fd )) == 1000
+            assert records( fd ) == []
+            with open( path, 'ab' ) as f:
+                f.write( b"2017-07-14 02:56:40.000\t1000\t{\"40001\": 1000}\n2017-07-14 02:56:41" )
+                f.flush()
+                recs		= records( fd )
+                assert len( recs ) == 1 and json.loads( recs[0][2] ) == { "40001": 1000 }
+                f.write( b".000\t1001\t{\"40002\": 1001}\n" )
+            recs		= records( fd )
+            assert len( recs ) == 1 and recs[0][0] == timestamp( "2017-07-14 02:56:41.000" )
+        finally:
+            fd.close()
+    finally:
+        if os.path.exists( path ):
+            os.unlink( path )
+
+
+@pytest.mark.skipif( not has_pytz or not got_localzone, reason="Needs pytz and localzone" )
+def test_history_binary():
+    """Binary blocks format history files are auto-detected, and convert to/from the text format."""
+    for _ in range( 3 ):
+        path		= "/tmp/test_binary_%d" % random.randint( 100000, 999999 )
+        if os.path.exists( path ):
+            continue
+    assert not os.path.exists( path ), "Couldn't find an unused name: %s" % path
+
+    text,binary		= path + '.txt', path + '.bin'
+    files		= [ text, binary, path + '.hst.gz', path + '.hsb.xz', path + '.hst' ]
+    try:
+        now		= timer()
+        count		= 100
+        with logger( text ) as t, logger( binary, binary=True, codec='bz2', block=7 ) as b:
+            for l in ( t, b ):
+                l.comment( "Started" )
+            for i in range( count ):
+                for l in ( t, b ):
+                    l.write( { 40001 + i % 7: i }, now=round( now - count + i, 3 ), serial=i )
+        # Appending to an existing binary history file is allowed; but not to a text file
+        with logger( binary, binary=True, bufsize=logger.LINE_BUF ) as b:
+            b.write( { 40001: -1 }, now=now )
+            assert os.path.getsize( binary ) > 0
+        with logger( text ) as t:
+            t.write( { 40001: -1 }, now=now )
+        with logger( text, binary=True ) as b:
+            with pytest.raises( AssertionError ):
+                b.open()
+        assert blocks.HEADER.size == 9 and blocks.RECORD.size == 16
+
+        with opener( binary ) as fd:
+            assert isinstance( fd, blocks.reader )
+            n,(ts,sn,js)= parse_record( fd )
+            assert n == 0 and sn == 0 and json.loads( js ) == { '40001': 0 } and near( ts.value, now - count )
+
+        # Load the text and binary history files; identical events and values
+        results		= []
+        for f in ( text, binary ):
+            ld		= loader( f, historical=now - count - 1, basis=timer(), factor=1e6 )
+            events	= []
+            e		= True
+            while e:
+                cur,e	= ld.load( limit=1000 )
+                events.extend( e )
+            results.append( ( [ ( str( e['timestamp'] ), e['values'] ) for e in events ],
+                              dict( ( r,v ) for r,(t,v) in ld.values.items() )))
+        assert results[0] == results[1]
+        assert len( results[0][0] ) == count + 1 and results[0][1][40001] == -1
+
+        # Convert text --> binary (compressed) --> text; the text is preserved exactly
+        assert convert( text, path + '.hsb.xz', codec='lzma' ) == count + 2
+        with opener( path + '.hsb.xz' ) as fd:
+            assert isinstance( fd, blocks.reader )
+        from cpppo.bin.history_convert import main as history_convert
+        assert history_convert( [ path + '.hsb.xz', path + '.hst.gz' ] ) == 0
+        assert convert( path + '.hst.gz', path + '.hst', binary=False ) == count + 2
+        with open( text, 'rb' ) as a, open( path + '.hst', 'rb' ) as b:
+            assert a.read() == b.read()
+    finally:
+        for f in files:
+            try:
+                os.unlink( f )
+            except:
+                pass
+
+
+@pytest.mark.skipif( not has_pytz or not got_localzone, reason="Needs pytz and localzone" )
+def test_history_binary_truncated():
+    """A partially written trailing block (eg. of a live binary history file) ends reading, which
+    resumes with the block once it has been completely written."""
+    path			= "/tmp/test_binary_truncated_%d.bin" % random.randint( 100000, 999999 )
+    try:
+        now			= timer()
+        with logger( path, binary=True, block=4 ) as b:
+            for i in range( 10 ):
+                b.write( { 40001: i }, now=now + i, serial=i )
+        with open( path, 'rb' ) as f:
+            data		= f.read()
+        with open( path, 'wb' ) as f:
+            f.write( data[:-3] )
+
+        def records( fd ):
+            recs		= []
+            while True:
+                try:
+                    recs.append( parse_record( fd )[1][1] )
+                except StopIteration:
+                    return recs
+
+        with opener( path ) as fd:
+            assert isinstance( fd, blocks.reader )
+            assert records( fd ) == list( range( 8 ))
+            assert records( fd ) == []
+            with open( path, 'ab' ) as f:
+                f.write( data[-3:] )
+            assert records( fd ) == [ 8, 9 ]
+
+        # A non-seekable stream retains the partial block, 'til the rest arrives
+        class unseekable( object ):
+            def __init__( self, data ):
+                self.data	= data
+            def read( self, size ):
+                got,self.data	= self.data[:size],self.data[size:]
+                return got
+            def seekable( self ):
+                return False
+
+        stream			= unseekable( data[:-3] )
+        fd			= blocks.reader( stream )
+        assert records( fd ) == list( range( 8 ))
+        stream.data	       += data[-3:]
+        assert records( fd ) == [ 8, 9 ]
+    finally:
+        if os.path.exists( path ):
+            os.unlink( path )
+
+
+@pytest.mark.skipif( not has_pytz or not got_localzone, reason="Needs pytz and localzone" )
+def test_history_background():
+    """A logger_background writes the same file format, group-committing batches of records, and
+    applies its overflow policy when its queue is full."""
+    for _ in range( 3 ):
+        path		= "/tmp/test_background_%d" % random.randint( 100000, 999999 )
+        if os.path.exists( path ):
+            continue
+    assert not os.path.exists( path ), "Couldn't find an unused name: %s" % path
+
+    try:
+        now		= timer()
+        with logger_background( path, flush=.05, fsync=True ) as l:
+            l.comment( "Started" )
+            def writer( reg ):
+                for i in range( 500 ):
+                    l.write( { reg: i }, now=now + i / 1000, serial=i )
+            writers	= [ threading.Thread( target=writer, args=( r, )) for r in ( 40001, 40002 ) ]
+            for w in writers:
+                w.start()
+            for w in writers:
+                w.join()
+            assert l.flush( timeout=5.0 )
+            assert l.written == 1001 and l.batches < l.written and l.dropped == 0
+        assert l.writer is None and not l.opened()
+        with open( path, 'rb' ) as fd:
+            lines	= fd.read().decode( 'ascii' ).splitlines()
+        assert lines[0].startswith( "# Started" ) and len( lines ) == 1001
+        for reg in ( '40001', '40002' ):
+            vals	= [ json.loads( r.split( '\t' )[2] )[reg] for r in lines[1:] if '"%s"' % reg in r ]
+            assert vals == list( range( 500 ))
+
+        # Stall the writer (by holding its lock), and overflow its queue
+        for overflow,expect in ( ( 'drop', list( range( 10 ))), ( 'drop_oldest', list( range( 40, 50 )))):
+            os.unlink( path )
+            with logger_background( path, queue=10, flush=0, overflow=overflow ) as l:
+                with l.lock:
+                    l.write( { 40001: -1 } ) # the writer takes this one, and awaits the lock
+                    while l.queue:
+                        time.sleep( .01 )
+                    for i in range( 50 ):
+                        l.write( { 40001: i } )
+                    assert l.dropped == 40
+            with open( path, 'rb' ) as fd:
+                lines	= fd.read().decode( 'ascii' ).splitlines()
+            assert [ json.loads( r.split( '\t' )[2] )['40001'] for r in lines ] == [ -1 ] + expect
+
+        # Failures are logged, and the logger evaluates False; not the caller's problem
+        with logger_background( '/tmp' ) as l:
+            l.write( { 40001: 1 } )
+            l.flush()
+            assert l.error and not l
+    finally:
+        try:
+            os.unlink( path )
+        except:
+            pass
+
+
 @pytest.mark.skipif( not has_pytz or not got_localzone, reason="Needs pytz and localzone" )
 def test_parse_seconds():
     assert parse_seconds( '1w' ) == 604800
@@ -30,12 +30,13 @@ remote.io	-- Interact with remote I/O singularly and in groups
 """
 
 __all__				= ['address', 'input', 'output',
-                                   'capture', 'input_event', 'output_event',
+                                   'event_store', 'capture', 'input_event', 'output_event',
                                    'device', 'motor', 'motor_simulator']
 
 import json
 import logging
 import random
+import threading
 
 from .. import misc
 from ..automata import type_str_base
@@ -118,27 +119,109 @@ class output( input ):
 # 
 #     Capture and remember a series of I/O events.
 # 
+class event_store( object ):
+    """A bounded store of events (dicts w/ at least a "time" and "description"), in a ring buffer
+    of fixed 'capacity'; once full, each new event replaces the oldest.  The events are indexed by
+    a monotonic time (an event's "time", or the prior event's if the clock steps backwards), so
+    events( since=... ) finds the first event of interest by binary search, in O(log n).
+
+    Events older than 'retain' seconds (if supplied) are not returned, except for the most recent
+    event of each unique "description", which is always returned (even if lost from the ring).
+
+    Writers are serialized, but readers (eg. a web UI) never lock.  Each slot holds its event's
+    sequence number; a reader snapshots the number of events stored, and ignores any slot it finds
+    overwritten by a writer lapping the ring in the meantime.
+
+    """
+    CAPACITY			= 1024
+
+    def __init__( self, capacity=None, retain=None ):
+        self.capacity		= capacity or self.CAPACITY
+        self.retain		= retain
+        self._slots		= [ None ] * self.capacity # (<seq>, <key>, <event>)
+        self._seq		= 0		# Sequence number of next event; slots hold the last capacity
+        self._key		= None		# Monotonic time index of the last event
+        self._latest		= {}		# { <description>: (<seq>, <key>, <event>), ... }
+        self._lock		= threading.Lock()
+
+    def __len__( self ):
+        return min( self._seq, self.capacity )
+
+    def append( self, event ):
+        with self._lock:
+            key			= event["time"] if self._key is None else max( self._key, event["time"] )
+            record		= ( self._seq, key, event )
+            self._slots[self._seq % self.capacity] = record
+            self._latest[event.get( "description" )] = record
+            self._key		= key
+            self._seq	       += 1		# Publishes the event to readers
+
+    def _record( self, seq ):
+        """The record of event number 'seq', or None if it has been overwritten."""
+        record			= self._slots[seq % self.capacity]
+        return record if record is not None and record[0] == seq else None
+
+    def _bisect( self, lo, hi, key, inclusive=False ):
+        """Find the first event number in [lo,hi) with an index key greater than (or equal to, if
+        'inclusive') 'key'.  Any event overwritten during the search is (older, and hence) treated as
+        lesser."""
+        while lo < hi:
+            mid			= ( lo + hi ) // 2
+            record		= self._record( mid )
+            if record is None or record[1] < key or ( record[1] == key and not inclusive ):
+                lo		= mid + 1
+            else:
+                hi		= mid
+        return lo
+
+    def events( self, since=None, now=None ):
+        """Yields the retained events with a "time" strictly greater than 'since' (none, if since is
+        None), newest first: those in the ring w/in 'retain' seconds of 'now' (default: the current
+        time), and then the most recent event of each description older than that."""
+        if since is None:
+            return
+        if now is None:
+            now			= misc.timer()
+        hi			= self._seq
+        start			= self._bisect( max( 0, hi - self.capacity ), hi, since )
+        if self.retain:
+            start		= self._bisect( start, hi, now - self.retain, inclusive=True )
+        for seq in range( hi - 1, start - 1, -1 ):
+            record		= self._record( seq )
+            if record is None:
+                break		# Lapped by a writer; all older events are lost, too
+            if record[2]["time"] > since:
+                yield record[2]
+        for record in sorted( ( r for r in list( self._latest.values() )
+                                if r[0] < start and r[2]["time"] > since ), reverse=True ):
+            yield record[2]
+
+
 class capture( object ):
     """ Provide a means to remember an event of type 'what' to an (optionally
     supplied) events container; returned via .events().  The supplied level()
     and formatter() functions take an event type 'what', and the 'last' and
     'chng' values, and return a logging level (0/None to suppress) and formatted
-    message.  Must be composed with an 'address' or 'device' class, w/ a '._descr'"""
+    message.  Must be composed with an 'address' or 'device' class, w/ a '._descr'
+
+    Events are remembered in an event_store of the given 'capacity', retaining
+    'retain' seconds of events (and the last event of each description); an
+    event_store may be supplied in 'events', to share it between captures."""
     
     CHANGED		= 1
     REJECTED		= 2
     MODIFIED		= 3
 
-    def __init__( self, retain=None, group=None, level=None, formatter=None ):
-        self._events	= []
-        self._retain	= retain
+    def __init__( self, retain=None, group=None, level=None, formatter=None, events=None, capacity=None ):
+        self._events	= ( event_store( capacity=capacity, retain=retain )
+                            if events is None else events )
         self._group	= "" if group is None else group
         self._level	= level	     # May be None/0 (don't collect), int or function(what, last, curr)
         self._formatter	= formatter  # May be None (logs values), or a function(what, last, curr)
 
     def remember( self, what, last, chng ):
-        """ All new events are prepended (inserted at index 0) to the ._events
-        container, so newest events appear earliest. """
+        """ All new events are appended to the ._events store; the newest events
+        are returned first by .events(). """
         if self._events is not None:
             level	= ( self._level( what, last, chng )
                             if hasattr( self._level, '__call__' )
@@ -147,7 +230,7 @@ class capture( object ):
                 message	= ( self._formatter( what, last, chng )
                             if self._formatter
                             else "%s (was %s)" % ( misc.reprlib.repr( chng ), misc.reprlib.repr( last )))
-                self._events.insert( 0, { 
+                self._events.append( { 
                         "time":		misc.timer(),
                         "level":	level,
                         "group":	self._group,
@@ -158,34 +241,21 @@ class capture( object ):
     def events( self, since=None, purge=False ):
         """ A generator yielding the stream of relevant events (None if since is
         None, otherwise limited to those with a ["time"] strictly greater than
-        'since'), optionally purging as we go; if we complete the iteration, our
-        ._events will be replaced with the retain list.  This is not a property,
-        because it doesn't return simple value, and we want to (optionally)
-        purge the internal _events list, or provide a 'since' time."""
-        unique		= set()
-        retain		= []
-        now	        = misc.timer()
-        for e in self._events:
-            if self._retain:
-                if e["description"] not in unique:
-                    unique.add( e["description"] )
-                else:
-                    if e["time"] + self._retain < now:
-                        # old event, and we've seen this description before; skip
-                        log.debug( "Purging event: %r" % ( e ))
-                        continue
-                retain.append( e )
-            if since is not None and e["time"] > since:
+        'since'), newest first.  This is not a property, because it doesn't
+        return simple value, and we want to provide a 'since' time.  The
+        event_store is bounded, so 'purge' is no longer required (or used)."""
+        if self._events is not None:
+            for e in self._events.events( since=since ):
                 yield e
-        if self._retain:
-            self._events= retain
 
 
 class input_event( input, capture ):
     """ An input that captures changed events """
     def __init__( self, plc, address, 
-                  retain=None, group=None, level=None, formatter=None, **kwargs ):
-        capture.__init__( self, retain=retain, group=group, level=level, formatter=formatter )
+                  retain=None, group=None, level=None, formatter=None, events=None, capacity=None,
+                  **kwargs ):
+        capture.__init__( self, retain=retain, group=group, level=level, formatter=formatter,
+                          events=events, capacity=capacity )
         input.__init__( self, plc, address, **kwargs )
 
     def changed( self, last, chng ):
@@ -196,8 +266,10 @@ class input_event( input, capture ):
 class output_event( output, capture ):
     """ An output that captures changed/rejected/modified events """
     def __init__( self, plc, address, 
-                  retain=None, group=None, level=None, formatter=None, **kwargs ):
-        capture.__init__( self, retain=retain, group=group, level=level, formatter=formatter )
+                  retain=None, group=None, level=None, formatter=None, events=None, capacity=None,
+                  **kwargs ):
+        capture.__init__( self, retain=retain, group=group, level=level, formatter=formatter,
+                          events=events, capacity=capacity )
         output.__init__( self, plc, address, **kwargs )
 
     def changed( self, last, chng ):
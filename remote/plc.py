@@ -48,6 +48,7 @@ class poller( object ):
 
       .offline		-- True iff PLC is offline
       .poll		-- arrange for an address to be polled at a rate
+      .rate_of		-- the poll rate of an address
       .read		-- Read an address from the cache; None if offline
       .write		-- Write an address, blocks 'til complete; raise if offline/fails
 
@@ -60,19 +61,30 @@ class poller( object ):
       ._cache		-- Store a data value
       ._receive		-- Get a data value
 
+    Each address is polled at the minimum rate requested for it, or (if none) at the default rate
+    supplied at construction, or (if none) at the minimum rate requested for any address; .rate is
+    always the minimum rate requested overall.
+
     """
     def __init__( self, description=None, rate=None ):
         self.description	= id( self ) if description is None else description
         self.online		= True
         self.rate		= rate
+        self.default		= rate		# Poll rate of addresses w/o a requested rate
+        self.rates		= {}		# Minimum rates requested, by address
         self._data		= {}
 
     def poll( self, address, rate=None ):
         """ Remembers the minimum requested rate, and prepares to poll; ensure someone has specified a rate!"""
         if rate is not None:
             self.rate 		= min( self.rate or rate, rate )
+            self.rates[address]	= min( self.rates.get( address ) or rate, rate )
         self._poll( address )
 
+    def rate_of( self, address ):
+        """ The rate at which the address is to be polled (may be None, if no rate yet specified)."""
+        return self.rates.get( address ) or self.default or self.rate
+
     def read( self, address ):
         """ Establishes polling on the given address, receives incoming values,
         returning the latest known value, or None if offline. """
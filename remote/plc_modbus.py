@@ -28,8 +28,9 @@ __license__                     = "Dual License: GPLv3 (or later) and Commercial
 """
 remote.plc_modbus -- Modbus PLC polling, reading and writing infrastructure
 """
-__all__				= ['shatter', 'merge', 'poller_modbus']
+__all__				= ['shatter', 'merge', 'table', 'transaction_cost', 'poller_modbus_base', 'poller_modbus']
 
+import heapq
 import logging
 import threading
 import time
@@ -40,7 +41,7 @@ from .pymodbus_fixes import modbus_client_timeout, modbus_client_tcp, Defaults
 from .plc import poller, PlcOffline
 
 
-from pymodbus.exceptions import ModbusException, ParameterException
+from pymodbus.exceptions import ModbusException, ModbusIOException, ConnectionException, ParameterException
 from pymodbus.pdu.bit_message import ReadDiscreteInputsRequest, ReadCoilsRequest, WriteSingleCoilRequest, WriteMultipleCoilsRequest
 from pymodbus.pdu.register_message import ReadHoldingRegistersRequest, ReadInputRegistersRequest, WriteSingleRegisterRequest, WriteMultipleRegistersRequest
 from pymodbus.pdu import ExceptionResponse, ModbusPDU as ModbusResponse
@@ -69,182 +70,263 @@ def shatter( address, count, limit=None ):
         count	       -= taken
 
 
-def merge( ranges, reach=1, limit=None ):
+# The Modbus tables, by address range (both the 5- and 6-digit addressing conventions), and the
+# maximum number of bits/registers that may be read in one transaction from each.  Devices may
+# support less; supply overrides via merge's (or poller_modbus') limits=... keyword.
+TABLES				= [
+    ( 400001, 465536, 'holding' ),
+    ( 300001, 365536, 'input' ),
+    ( 100001, 165536, 'discrete' ),
+    (  40001,  99999, 'holding' ),
+    (  30001,  39999, 'input' ),
+    (  10001,  19999, 'discrete' ),
+    (      1,   9999, 'coils' ),
+]
+LIMITS				= dict( coils=2000, discrete=2000, input=125, holding=125 )
+
+# The cost, in bytes on the wire, of reading each unwanted bit/register of a table, and the framing
+# bytes of a typical Modbus/TCP read transaction (MBAP headers and PDU fields of the request and the
+# response), used to estimate the cost of issuing another transaction.
+WIDTHS				= dict( coils=1/8, discrete=1/8, input=2, holding=2 )
+FRAMING				= 21
+
+
+def table( address ):
+    """Returns the (name, base) of the Modbus table containing address, or (None, address) if the
+    address is invalid."""
+    for lo, hi, name in TABLES:
+        if lo <= address <= hi:
+            return name, lo
+    return None, address
+
+
+def transaction_cost( rtt=0.0, bandwidth=None, framing=FRAMING ):
+    """Estimate the cost of an additional transaction, in bytes: its framing, plus the bytes that
+    could have been transferred at 'bandwidth' (bytes/s) during the round-trip time 'rtt' (seconds)
+    that the transaction adds to the poll.  Supply the result as merge's (or poller_modbus')
+    overhead=...  """
+    return framing + ( rtt * bandwidth if rtt and bandwidth else 0 )
+
+
+def merge( ranges, reach=1, limit=None, limits=None, overhead=None, avoid=None ):
     """ Yields a series of independent register ranges: [(address, count), ...]
     from the provided ranges, merging any within 'reach' of each-other, with
-    maximum range length 'limit'.  Will not attempt to merge addresses across a
-    10000 boundary (to avoid merging different register types). """
+    maximum range length 'limit' (by default, the per-table LIMITS, updated by
+    any supplied 'limits' dict).  Will not merge addresses in different Modbus
+    tables (or invalid addresses).
+
+    If a per-transaction 'overhead' (in bytes; see transaction_cost()) is supplied, a
+    gap is instead bridged only if reading the unwanted bits/registers in it
+    costs no more than another transaction, and the merged range still fits
+    within the table's limit; coils are cheap to over-read, registers 16 times
+    as expensive.
+
+    Ranges known to be rejected by the device (eg. spanning holes in its
+    register map) may be supplied in 'avoid'; no merged range will overlap
+    any of them, so each requested range within them is read on its own. """
+    limits		= dict( LIMITS, **( limits or {} ))
+    avoid		= [ (a,c) for a,c in ( avoid or () ) ]
     input		= iter( sorted( ranges ))
 
+    def bridge( base, length, address, count ):
+        name, lo	= table( base )
+        if name is None or table( address ) != (name, lo):
+            return False
+        end		= max( base + length, address + count )
+        if any( a < end and base < a + c for a,c in avoid ):
+            return False
+        if overhead is None:
+            return address < base + length + ( reach or 1 )
+        if end - base > ( limit or limits[name] ):
+            return False
+        return ( address - base - length ) * WIDTHS[name] <= overhead
+
+    def emit( base, length ):
+        name, lo	= table( base )
+        lim		= limit or ( limits[name] if name else None )
+        for r in shatter( base, length, limit=lim ):
+            log.debug( "Emitting: %10r==>%10r w/limit %r" % ((base,length), r, lim ))
+            yield r
+
     base, length	= next( input )
     for address, count in input:
         if length:
-            if ( address // 10000 == base // 10000
-                 and address < base + length + ( reach or 1 )):
+            if bridge( base, length, address, count ):
                 log.debug( "Merging:  %10r + %10r == %r" % (
                         (base,length), (address,count), (base,address+count-base)))
-                length	= address + count - base
+                length	= max( base + length, address + count ) - base
                 continue
-            log.debug( "Unmerged: %10r + %10r w/reach %r" % (
-                    (base,length), (address,count), reach))
+            log.debug( "Unmerged: %10r + %10r w/reach %r, overhead %r" % (
+                    (base,length), (address,count), reach, overhead ))
             # We've been building a (base, length) merge range, but this
             # (address, count) doesn't merge; yield what we have
-            for r in shatter( base, length, limit=limit ):
-                log.debug( "Emitting: %10r==>%10r w/limit %r" % ((base,length), r, limit ))
+            for r in emit( base, length ):
                 yield r
         # ... and, continue from this new range
         base, length	= address, count
     # Finally, clean up whatever range we were building (if any)
-    for r in shatter( base, length, limit=limit ):
-        log.debug( "Emitting: %10r==>%10r w/limit %r" % ((base,length), r, limit))
+    for r in emit( base, length ):
         yield r
 
 
-class poller_modbus( poller, threading.Thread ):
-    """A PLC object that communicates with a physical PLC via Modbus/{TCP,RTU} protocol, using the
-    provided modbus_client_{tcp,rtu} instance.  Schedules polls of various registers at various
-    poll rates, prioritizing the polls by age.
-
-    Writes are transmitted at the earliest opportunity, and are synchronous (ie. do not return 'til
-    the write is complete, or the plc is already offline).
-
-    The first completely failed poll (no successful PLC I/O transactions) marks the PLC as offline,
-    and it stays offline 'til a poll again succeeds.
-
-    Only a single PLC I/O transaction is allowed to execute on the client, with self.client:...
-
-    A 'unit' ID value may be provided; if not, Defaults.UnitId will be used.  This is normally 0x00
-    (broadcast?), so it inappropriate for multi-drop slaves (eg. RS485).  The supplied default
-    'unit' will be passed to all read/write requests (unless a 'unit' keyword is supplied to write
-    request).  Since all 'read' requests are actually returning the results of the last polled
-    value, all underlying polling _reads use the supplied 'unit' value.
-
-    Maintains the prior ( ..., host="hostname", port=12345, ...) API, creating a Modbus/TCP client
-    connection by default.  However, it is now possible to explicitly supply either a
-    modbus_client_{tcp,rtu} instance using client=...
+class poller_modbus_base( poller ):
+    """The Modbus PLC polling machinery shared by the Thread-based poller_modbus and the asyncio
+    poller_modbus_async (see remote.plc_modbus_async): grouping polled addresses into rate classes
+    and merging them into ranges, scheduling the rate classes, building the read/write requests and
+    decoding their responses, and accounting for the results of each poll cycle.  See poller_modbus
+    for a description of the parameters.
 
     """
-    def __init__( self, description, client=None, reach=100, multi=False, unit=None,
-                  host=None, port=None, **kwargs ):
+    def __init__( self, description, reach=100, multi=False, unit=None, limits=None, overhead=None,
+                  similar=2.0, **kwargs ):
         poller.__init__( self, description=description, **kwargs )
-        threading.Thread.__init__( self, target=self._poller )
-        if client is None:
-            client		= modbus_client_tcp( host=host, port=port )
-        else:
-            assert host is None and port is None, "Must specify client or host/port; not both"
-        assert isinstance( client, modbus_client_timeout ), \
-            "Must provide a modbus_client_{tcp,rtu}, not: %r" % client
-        self.client		= client
         self.unit		= Defaults.UnitId if unit is None else unit
-        self.daemon		= True
         self.done		= False
         self.reach		= reach		# Merge registers this close into ranges
+        self.limits		= dict( LIMITS, **( limits or {} )) # Max. bits/registers per read, by table
+        self.overhead		= overhead	# Or, merge registers when cheaper than another transaction
         self.multi		= multi		# Force WriteMultipleRegisters... even for single registers
+        self.similar		= similar	# Poll rates w/in this factor are polled together
         self.polling		= set()		# Ranges known to be successfully polling
         self.failing		= set() 	# Ranges known to be failing
+        self.rejected		= set()		# Merged ranges rejected by the PLC; don't merge over these
         self.duration		= 0.0		# Duration of last poll completed
         self.counter		= 0		# Total polls performed
         self.load		= None,None,None# total poll durations over last ~1, 5 and 15 min
-        self.start()
+        self.durations		= {}		# Duration of last poll completed, by rate class
+        self.loads		= {}		# Poll loads over last ~1, 5 and 15 min, by rate class
+        self._polling		= {}		# Ranges successfully polling, by rate class
+        self._failing		= {}		# Ranges failing, by rate class
 
     def stop( self ):
         self.done		= True
 
-    def join( self, timeout=None ):
-        if self.is_alive():
-            log.info( "Joining: %s", self.description )
-        self.stop()
-        super( poller_modbus, self ).join( timeout=timeout )
+    def _classes( self ):
+        """Group the addresses to poll by rate class, returning { <rate>: [<address>, ...], ... }.  Each
+        class is polled at its fastest rate, and includes all addresses with rates within a factor
+        of self.similar of it.
 
-    def _poller( self, *args, **kwargs ):
-        """ Asynchronously (ie. in another thread) poll all the specified
-        registers, on the designated poll cycle.  Until we have something to do
-        (self.rate isn't None), just wait.
+        WARN: iteration over self._data must be atomic, because we don't lock, and someone could
+        call read/poll, adding entries to self._data between reads; list( self._data ) is.
 
-        We'll log whenever we begin/cease polling any given range of registers.
         """
-        log.info( "Poller starts: %r, %r ", args, kwargs )
-        target			= misc.timer()
-        while not self.done and logging:	# Module may be gone in shutting down
-            # Poller is dormant 'til a non-None/zero rate and data specified
-            if not self.rate or not self._data:
-                time.sleep( .1 )
-                continue
+        rates			= {}
+        for address in list( self._data ):
+            rate		= self.rate_of( address )
+            if rate:
+                rates.setdefault( rate, [] ).append( address )
+        classes			= {}
+        fastest			= None
+        for rate in sorted( rates ):
+            if fastest is None or rate > fastest * self.similar:
+                fastest		= rate
+            classes.setdefault( fastest, [] ).extend( rates[rate] )
+        return classes
+
+    def _due( self, schedule, due, epoch ):
+        """Schedule any new rate classes immediately (in the current cycle since the 'epoch'), and
+        forget any vanished ones (and any ranges they were polling).  The rate classes are scheduled
+        in the 'schedule' heap of (<due>,<rate>), and the 'due' dict of { <rate>: <due>, ... };
+        classes appear and disappear as addresses' rates are specified, so their heap entries are
+        added when first seen, and discarded when found to be stale.
+
+        Returns the delay 'til the next rate class is due, and the current rate classes.  If one is
+        due now, returns a delay of 0 and its rate, having rescheduled it for its next cycle.  The
+        delay is limited to short intervals, in case new (faster) addresses are polled.
 
-            # Delay 'til poll target
-            now			= misc.timer()
-            if now < target:
-                time.sleep( target - now )
-                now		= misc.timer()
-
-            # Ready for another poll.  Check if we've slipped (missed cycle(s)), and then compute
-            # the next poll cycle target; this attempts to retain cadence.
-            slipped		= int( ( now - target ) / self.rate )
-            if slipped:
-                log.normal( "Polling: PLC %s slipped; missed %d cycles", self.description, slipped )
-            target	       += self.rate * ( slipped + 1 )
-
-            # Perform polls, re-acquiring lock between each poll to allow others
-            # to interject.  We'll sort the known register addresses in _data,
-            # merge ranges, read the values from the PLC, and store them in
-            # _data.
-
-            # TODO: Split on and optimize counts for differing multi-register
-            # limits for Coils, Registers
-
-            # WARN: list comprehension over self._data must be atomic, because
-            # we don't lock, and someone could call read/poll, adding entries to
-            # self._data between reads.  However, since merge's register ranges
-            # are sorted, all self._data keys are consumed before the list is
-            # iterated.
-            rngs		= set( merge( ( (a,1) for a in self._data ), reach=self.reach ))
-            succ		= set()
-            fail		= set()
-            busy		= 0.0 # time spent polling (excluding time blocked, ie. writes)
-            for address, count in rngs:
-                with self.client: # block 'til we can begin a transaction
-                    begin	= misc.timer()
-                    try:
-                        # Read values; on success (no exception, something other
-                        # than None returned), immediately take online;
-                        # otherwise attempts to _store will be rejected.
-                        value	= self._read( address, count, unit=self.unit )
-                        if not self.online:
-                            self.online = True
-                            log.critical( "Polling: PLC %s online; success polling %s: %s",
-                                    self.description, address, misc.reprlib.repr( value ))
-                        if (address,count) not in self.polling:
-                            log.detail( "Polling: PLC %s %6d-%-6d (%5d)", self.description,
-                                        address, address+count-1, count )
-                        succ.add( (address, count) )
-                        self._store( address, value, create=False ) # Handle scalar or list/tuple value(s)
-                    except ModbusException as exc:
-                        # Modbus error; Couldn't read the given range.  Only log
-                        # the first time failure to poll this range is detected
-                        fail.add( (address, count) )
-                        if (address, count) not in self.failing:
-                            log.warning( "Failing: PLC %s %6d-%-6d (%5d): %s", self.description,
-                                         address, address+count-1, count, str( exc ))
-                    except Exception:
-                        # Something else; always log
-                        fail.add( (address, count) )
-                        log.warning( "Failing: PLC %s %6d-%-6d (%5d): %s", self.description,
-                                address, address+count-1, count, traceback.format_exc() )
-                    busy       += misc.timer() - begin
-
-                # Prioritize other lockers (ie. write).  Contrary to popular opinion, sleep(0) does
-                # *not* effectively yield the current Thread's quanta, at least on Python 2.7.6!
-                time.sleep(0.001)
+        """
+        classes			= self._classes()
+        now			= misc.timer()
+        for rate in classes:
+            if rate not in due:
+                due[rate]	= epoch + rate * int( ( now - epoch ) / rate )
+                heapq.heappush( schedule, (due[rate], rate) )
+        for rate in list( due ):
+            if rate not in classes:
+                del due[rate]
+                self._cycled( rate, set(), set(), None )
+        while schedule and due.get( schedule[0][1] ) != schedule[0][0]:
+            heapq.heappop( schedule )
+        if not schedule:
+            return .1, None, classes
+
+        target, rate		= schedule[0]
+        if now < target:
+            return min( target - now, .1 ), None, classes
+        heapq.heappop( schedule )
+
+        # Ready for another poll.  Check if we've slipped (missed cycle(s)), and then compute
+        # the next poll cycle target; this attempts to retain cadence.
+        slipped			= int( ( now - target ) / rate )
+        if slipped:
+            log.normal( "Polling: PLC %s slipped; missed %d cycles of %.3fs rate",
+                        self.description, slipped, rate )
+        due[rate]		= target + rate * ( slipped + 1 )
+        heapq.heappush( schedule, (due[rate], rate) )
+        return 0, rate, classes
+
+    def _ranges( self, addresses ):
+        """Merge the addresses into the sorted (address,count) ranges to poll."""
+        return sorted( set( merge( ( (a,1) for a in addresses ), reach=self.reach,
+                                   limits=self.limits, overhead=self.overhead,
+                                   avoid=self.rejected )))
+
+    def _polled( self, address, count, value, exc, succ, fail ):
+        """Account for the result of polling a range; the value read, or the exception raised.
+        Adds the range to the 'succ' or 'fail' set."""
+        if exc is None:
+            # Read values; on success (no exception, something other
+            # than None returned), immediately take online;
+            # otherwise attempts to _store will be rejected.
+            if not self.online:
+                self.online = True
+                log.critical( "Polling: PLC %s online; success polling %s: %s",
+                        self.description, address, misc.reprlib.repr( value ))
+            if (address,count) not in self.polling:
+                log.detail( "Polling: PLC %s %6d-%-6d (%5d)", self.description,
+                            address, address+count-1, count )
+            succ.add( (address, count) )
+            self._store( address, value, create=False ) # Handle scalar or list/tuple value(s)
+        elif isinstance( exc, ModbusException ):
+            # Modbus error; Couldn't read the given range.  Only log
+            # the first time failure to poll this range is detected
+            fail.add( (address, count) )
+            if (address, count) not in self.failing:
+                log.warning( "Failing: PLC %s %6d-%-6d (%5d): %s", self.description,
+                             address, address+count-1, count, str( exc ))
+            # If the PLC responded, but rejected a range of several registers,
+            # avoid merging registers over it in future; it may span a hole.
+            if count > 1 and not isinstance( exc, (ModbusIOException, ConnectionException) ):
+                log.normal( "Avoided: PLC %s %6d-%-6d (%5d) in future merges",
+                            self.description, address, address+count-1, count )
+                self.rejected.add( (address, count) )
+        else:
+            # Something else; always log
+            fail.add( (address, count) )
+            log.warning( "Failing: PLC %s %6d-%-6d (%5d): %s", self.description,
+                    address, address+count-1, count, exc )
 
-            # We've already warned about polls that have failed; also log all
-            # polls that have ceased (failed, or been replaced by larger polls)
-            ceasing		= self.polling - succ - fail
-            for address, count in ceasing:
-                log.info( "Ceasing: PLC %s %6d-%-6d (%5d)", self.description,
-                          address, address+count-1, count )
+    def _cycled( self, rate, succ, fail, busy ):
+        """Account for the completion of a poll cycle of the rate class, taking 'busy' seconds (None
+        if the rate class has vanished), successfully polling 'succ' and failing 'fail' ranges.
 
-            self.polling	= succ
-            self.failing	= fail
+        """
+        # We've already warned about polls that have failed; also log all
+        # polls that have ceased (failed, or been replaced by larger polls)
+        ceasing			= self._polling.get( rate, set() ) - succ - fail
+        for address, count in ceasing:
+            log.info( "Ceasing: PLC %s %6d-%-6d (%5d)", self.description,
+                      address, address+count-1, count )
+
+        if busy is None:
+            self._polling.pop( rate, None )
+            self._failing.pop( rate, None )
+            self.durations.pop( rate, None )
+            self.loads.pop( rate, None )
+        else:
+            self._polling[rate]	= succ
+            self._failing[rate]	= fail
+            self.durations[rate]= busy
             self.duration	= busy
 
             # The "load" is computed by comparing the "duration" of the last poll vs. the target
@@ -253,38 +335,37 @@ class poller_modbus( poller, threading.Thread ):
             # of polls.  The load is the proportion of the current poll rate that is consumed by
             # poll activity.  Even if the load < 1.0, polls may "slip" due to other (eg. write)
             # activity using PLC I/O capacity.
-            load		= ( busy / self.rate ) if self.rate > 0 else 1.0
-            ppm			= ( 60.0 / self.rate ) if self.rate > 0 else 1.0
-            self.load		= tuple(
+            load		= ( busy / rate ) if rate > 0 else 1.0
+            ppm			= ( 60.0 / rate ) if rate > 0 else 1.0
+            self.loads[rate]	= tuple(
                 misc.exponential_moving_average( cur, load, 1.0 / ( minutes * ppm ))
-                for minutes,cur in zip((1, 5, 15), self.load ))
-
-            # Finally, if we've got stuff to poll and we aren't polling anything successfully, and
-            # we're not yet offline, warn and take offline, and then report the completion of another
-            # poll cycle.
-            if self._data and not succ and self.online:
-                log.critical( "Polling: PLC %s offline", self.description )
-                self.online	= False
-            self.counter       += 1
-
-    def write( self, address, value, **kwargs ):
-        with self.client: # block 'til we can begin a transaction
-            super( poller_modbus, self ).write( address, value, **kwargs )
-
-    def _write( self, address, value, **kwargs ):
-        """Perform the write, enforcing Defaults.Timeout around the entire transaction.  Normally
-        returns None, but may raise a ModbusException or a PlcOffline if there are communications
-        problems.
-
-        Use a supplied 'unit' ID, or the one specified/deduced at construction.
+                for minutes,cur in zip((1, 5, 15), self.loads.get( rate, (None,None,None) )))
+
+        self.polling		= set().union( *self._polling.values() )
+        self.failing		= set().union( *self._failing.values() )
+
+        # The total load of all rate classes' polls
+        self.load		= tuple(
+            sum( l[i] for l in self.loads.values() if l[i] is not None )
+            if any( l[i] is not None for l in self.loads.values() ) else None
+            for i in range( 3 ))
+        if busy is None:
+            return
+
+        # Finally, if we had stuff to poll and we aren't polling anything successfully in any rate
+        # class (every range either succeeded or failed), and we're not yet offline, warn and take
+        # offline, and then report the completion of another poll cycle.
+        if self.failing and not self.polling and self.online:
+            log.critical( "Polling: PLC %s offline", self.description )
+            self.online		= False
+        self.counter	       += 1
+
+    def _writer( self, address, value, **kwargs ):
+        """Produce the write request for the value(s) at address, or raise a ParameterException if the
+        address isn't writable.  Use a supplied 'unit' ID, or the one specified/deduced at
+        construction.
 
         """
-        self.client.timeout 	= True
-
-        if not self.client.connect():
-            raise PlcOffline( "Modbus Write to PLC %s/%6d failed: Offline; Connect failure" % (
-                    self.description, address ))
-
         # Use address to deduce Holding Register or Coil (the only writable
         # entities); Statuses and Input Registers result in a pymodbus
         # ParameterException
@@ -327,26 +408,20 @@ class poller_modbus( poller, threading.Thread ):
             pass
         if not writer:
             raise ParameterException( "Invalid Modbus address for write: %d" % ( address ))
-        request			= writer( **kwargs )
-        result			= self.client.execute( no_response_expected=False, request=request )
+        return writer( **kwargs )
+
+    def _written( self, address, result ):
+        """Check the write request's result, raising a ModbusException if the PLC rejected it."""
         if isinstance( result, ExceptionResponse ):
             raise ModbusException( str( result ))
         assert isinstance( result, ModbusResponse ), "Unexpected non-ModbusResponse: %r" % result
 
-    def _read( self, address, count=1, **kwargs ):
-        """Perform the read, enforcing Defaults.Timeout around the entire transaction.  Returns the
-        result bit(s)/register(s), or raises an Exception; probably a ModbusException or a
-        PlcOffline for communications errors, but could be some other type of Exception.
-
-        Use a supplied 'unit' ID, or the one specified/deduced at construction.
+    def _request( self, address, count=1, **kwargs ):
+        """Produce the read request for count bit(s)/register(s) at address, or raise a
+        ParameterException if the address is invalid.  Use a supplied 'unit' ID, or the one
+        specified/deduced at construction.
 
         """
-        self.client.timeout 	= True
-
-        if not self.client.connect():
-            raise PlcOffline( "Modbus Read  of PLC %s/%6d failed: Offline; Connect failure" % (
-                    self.description, address ))
-
         unit			= kwargs.pop( 'unit', self.unit )
         kwargs.update( dev_id=unit, count=count )
 
@@ -396,10 +471,15 @@ class poller_modbus( poller, threading.Thread ):
         request			= reader( **kwargs )
         log.debug( "%s/%6d-%6d transformed to %s", self.description, address, address + count - 1,
                    request )
+        return request
 
-        result 			= self.client.execute( no_response_expected=False, request=request )
+    def _response( self, address, count, result ):
+        """Return the bit(s)/register(s) from the read request's result, or raise a ModbusException."""
         log.debug( "%s/%6d-%6d responded w/:  %s", self.description, address, address + count - 1,
                    result )
+        if isinstance( result, Exception ):
+            # A pipelined transaction failed (eg. no response)
+            raise result
         if isinstance( result, ExceptionResponse ):
             # The remote PLC returned a response indicating it encountered an
             # error processing the request.  Convert it to raise a ModbusException.
@@ -415,3 +495,208 @@ class poller_modbus( poller, threading.Thread ):
                    values )
         return values[:count] if count > 1 else values[0]
 
+
+class poller_modbus( poller_modbus_base, threading.Thread ):
+    """A PLC object that communicates with a physical PLC via Modbus/{TCP,RTU} protocol, using the
+    provided modbus_client_{tcp,rtu} instance.  Schedules polls of various registers at various
+    poll rates, prioritizing the polls by age.
+
+    Writes are transmitted at the earliest opportunity, and are synchronous (ie. do not return 'til
+    the write is complete, or the plc is already offline).
+
+    The first completely failed poll (no successful PLC I/O transactions) marks the PLC as offline,
+    and it stays offline 'til a poll again succeeds.
+
+    Only a single PLC I/O transaction is allowed to execute on the client, with self.client:...
+
+    A 'unit' ID value may be provided; if not, Defaults.UnitId will be used.  This is normally 0x00
+    (broadcast?), so it inappropriate for multi-drop slaves (eg. RS485).  The supplied default
+    'unit' will be passed to all read/write requests (unless a 'unit' keyword is supplied to write
+    request).  Since all 'read' requests are actually returning the results of the last polled
+    value, all underlying polling _reads use the supplied 'unit' value.
+
+    Maintains the prior ( ..., host="hostname", port=12345, ...) API, creating a Modbus/TCP client
+    connection by default.  However, it is now possible to explicitly supply either a
+    modbus_client_{tcp,rtu} instance using client=...
+
+    If 'pipeline' > 1 is supplied (Modbus/TCP only; ignored for RTU), the poll ranges are read in
+    batches of up to 'pipeline' transactions in flight at once, instead of awaiting each response
+    before issuing the next request.  On high-latency links (eg. cellular), this reduces a poll
+    cycle from one round-trip per range to about one per batch.  Writes may interject between
+    batches.
+
+    Polled registers are merged into ranges (see merge) within 'reach' of each other, or (if an
+    'overhead' is supplied) wherever reading the unwanted registers costs less than another
+    transaction, up to the per-table read LIMITS updated by any device-specific 'limits'.  Any
+    merged range the device rejects with a Modbus exception (eg. because it spans a hole in the
+    device's register map) is remembered in .rejected, and the registers within it are thereafter
+    polled without merging.
+
+    Each address is polled at its own rate (see poller.rate_of).  Addresses with 'similar' rates
+    (within a factor of 'similar' of the fastest rate in the class) are polled together, at the
+    fastest of their rates; only the addresses within a rate class are merged into ranges, so slowly
+    polled registers aren't dragged along with the fast ones.  The rate classes are scheduled by
+    their next due time.  The .duration and .load of the polls of each rate class are available in
+    .durations and .loads (indexed by the class' poll rate); .load is their total.
+
+    """
+    def __init__( self, description, client=None, host=None, port=None, pipeline=None, **kwargs ):
+        poller_modbus_base.__init__( self, description=description, **kwargs )
+        threading.Thread.__init__( self, target=self._poller )
+        if client is None:
+            client		= modbus_client_tcp( host=host, port=port )
+        else:
+            assert host is None and port is None, "Must specify client or host/port; not both"
+        assert isinstance( client, modbus_client_timeout ), \
+            "Must provide a modbus_client_{tcp,rtu}, not: %r" % client
+        self.client		= client
+        self.daemon		= True
+        self.pipeline		= None		# Max. read transactions in flight (Modbus/TCP only)
+        if pipeline and pipeline > 1:
+            if isinstance( client, modbus_client_tcp ):
+                self.pipeline	= pipeline
+            else:
+                log.normal( "Polling: PLC %s cannot pipeline over %r; polling serially",
+                            description, client )
+        self.start()
+
+    def join( self, timeout=None ):
+        if self.is_alive():
+            log.info( "Joining: %s", self.description )
+        self.stop()
+        super( poller_modbus, self ).join( timeout=timeout )
+
+    def _poller( self, *args, **kwargs ):
+        """ Asynchronously (ie. in another thread) poll all the specified
+        registers, on the designated poll cycle of each rate class.  Until we
+        have something to do (self.rate isn't None), just wait.
+
+        We'll log whenever we begin/cease polling any given range of registers.
+        """
+        log.info( "Poller starts: %r, %r ", args, kwargs )
+        epoch			= misc.timer()	# poll cycles of all rate classes are aligned to this
+        schedule		= []		# heap of (<due>,<rate>)
+        due			= {}		# { <rate>: <due>, ... } of each scheduled rate class
+        while not self.done and logging:	# Module may be gone in shutting down
+            # Poller is dormant 'til a non-None/zero rate and data specified
+            if not self.rate or not self._data:
+                time.sleep( .1 )
+                continue
+
+            # Delay 'til the next rate class is due
+            delay, rate, classes = self._due( schedule, due, epoch )
+            if delay:
+                time.sleep( delay )
+                continue
+
+            # Perform polls, re-acquiring lock between each poll (or batch of polls) to allow
+            # others to interject.  We'll sort the rate class' register addresses, merge ranges,
+            # read the values from the PLC, and store them in _data.
+            rngs		= self._ranges( classes[rate] )
+            succ		= set()
+            fail		= set()
+            busy		= 0.0 # time spent polling (excluding time blocked, ie. writes)
+            batch		= self.pipeline or 1
+            for b in range( 0, len( rngs ), batch ):
+                with self.client: # block 'til we can begin a transaction (or batch of transactions)
+                    begin	= misc.timer()
+                    for (address, count),value,exc in self._reads( rngs[b:b+batch] ):
+                        self._polled( address, count, value, exc, succ, fail )
+                    busy       += misc.timer() - begin
+
+                # Prioritize other lockers (ie. write).  Contrary to popular opinion, sleep(0) does
+                # *not* effectively yield the current Thread's quanta, at least on Python 2.7.6!
+                time.sleep(0.001)
+
+            self._cycled( rate, succ, fail, busy )
+
+    def _reads( self, ranges ):
+        """Read each of the (address,count) 'ranges', yielding (address,count),value,exc; the value
+        read, or the exception raised (and value None).  Exceptions other than ModbusException are
+        supplied as a string including the traceback, if available.
+
+        If there is more than one range and we're pipelining, issues all of the reads at once.
+
+        """
+        if len( ranges ) < 2 or not self.pipeline:
+            for address, count in ranges:
+                try:
+                    yield (address, count),self._read( address, count, unit=self.unit ),None
+                except ModbusException as exc:
+                    yield (address, count),None,exc
+                except Exception:
+                    yield (address, count),None,traceback.format_exc()
+            return
+
+        # Allow each transaction its usual timeout (the requests are still processed in sequence)
+        self.client.timeout	= Defaults.Timeout * len( ranges )
+        if not self.client.connect():
+            for address, count in ranges:
+                yield (address, count),None,PlcOffline(
+                    "Modbus Read  of PLC %s/%6d failed: Offline; Connect failure" % ( self.description, address ))
+            return
+        requests		= []
+        for address, count in ranges:
+            try:
+                requests.append( self._request( address, count, unit=self.unit ))
+            except ModbusException as exc:
+                requests.append( exc )
+        try:
+            results		= iter( self.client.execute_pipelined(
+                [ r for r in requests if not isinstance( r, Exception ) ] ))
+        except Exception:
+            results		= None
+            failure		= traceback.format_exc()
+        for (address, count),request in zip( ranges, requests ):
+            if isinstance( request, Exception ):
+                yield (address, count),None,request
+                continue
+            if results is None:
+                yield (address, count),None,failure
+                continue
+            try:
+                yield (address, count),self._response( address, count, next( results )),None
+            except ModbusException as exc:
+                yield (address, count),None,exc
+            except Exception:
+                yield (address, count),None,traceback.format_exc()
+
+    def write( self, address, value, **kwargs ):
+        with self.client: # block 'til we can begin a transaction
+            super( poller_modbus, self ).write( address, value, **kwargs )
+
+    def _write( self, address, value, **kwargs ):
+        """Perform the write, enforcing Defaults.Timeout around the entire transaction.  Normally
+        returns None, but may raise a ModbusException or a PlcOffline if there are communications
+        problems.
+
+        Use a supplied 'unit' ID, or the one specified/deduced at construction.
+
+        """
+        self.client.timeout 	= True
+
+        if not self.client.connect():
+            raise PlcOffline( "Modbus Write to PLC %s/%6d failed: Offline; Connect failure" % (
+                    self.description, address ))
+
+        request			= self._writer( address, value, **kwargs )
+        result			= self.client.execute( no_response_expected=False, request=request )
+        self._written( address, result )
+
+    def _read( self, address, count=1, **kwargs ):
+        """Perform the read, enforcing Defaults.Timeout around the entire transaction.  Returns the
+        result bit(s)/register(s), or raises an Exception; probably a ModbusException or a
+        PlcOffline for communications errors, but could be some other type of Exception.
+
+        Use a supplied 'unit' ID, or the one specified/deduced at construction.
+
+        """
+        self.client.timeout 	= True
+
+        if not self.client.connect():
+            raise PlcOffline( "Modbus Read  of PLC %s/%6d failed: Offline; Connect failure" % (
+                    self.description, address ))
+
+        request			= self._request( address, count, **kwargs )
+        result 			= self.client.execute( no_response_expected=False, request=request )
+        return self._response( address, count, result )
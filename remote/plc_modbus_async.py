@@ -0,0 +1,247 @@
+
+# 
+# Cpppo -- Communication Protocol Python Parser and Originator
+# 
+# Copyright (c) 2013, Hard Consulting Corporation.
+# 
+# Cpppo is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.  See the LICENSE file at the top of the source tree.
+# 
+# Cpppo is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+# 
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry@hardconsulting.com"
+__copyright__                   = "Copyright (c) 2013 Hard Consulting Corporation"
+__license__                     = "Dual License: GPLv3 (or later) and Commercial (see LICENSE)"
+
+"""
+remote.plc_modbus_async -- Modbus PLC polling of many PLCs, multiplexed on one asyncio event loop
+
+Each remote.plc_modbus.poller_modbus polls its PLC in a dedicated Thread; a site with hundreds of
+Modbus/TCP PLCs would require hundreds of Threads.  A poller_modbus_async provides the same poll,
+read, write and online API, but polls its PLC in a coroutine on a (shared) modbus_loop, using the
+pymodbus asyncio client:
+
+    plcs			= [ poller_modbus_async( "PLC %d" % i, host=h, rate=1.0 )
+                                    for i,h in enumerate( hosts ) ]
+    plcs[0].poll( 40001 )
+    ...
+    plcs[0].read( 40001 )
+
+"""
+__all__				= ['modbus_loop', 'poller_modbus_async']
+
+import asyncio
+import concurrent.futures
+import contextlib
+import logging
+import threading
+import traceback
+
+from .. import misc
+from .pymodbus_fixes import modbus_client_tcp_async, Defaults
+from .plc import PlcOffline
+from .plc_modbus import poller_modbus_base
+
+from pymodbus.exceptions import ModbusException, ModbusIOException
+
+log				= logging.getLogger( __package__ )
+
+
+class modbus_loop( threading.Thread ):
+    """Runs an asyncio event loop in a daemon Thread, upon which any number of poller_modbus_async
+    PLCs are polled.  Up to 'concurrency' Modbus transactions (default: unlimited) may be in flight
+    at once, across all the PLCs using the loop.  Unless a specific modbus_loop is supplied, all
+    poller_modbus_async share the modbus_loop.default().
+
+    """
+    shared			= None
+    shared_lock			= threading.Lock()
+
+    def __init__( self, concurrency=None ):
+        super( modbus_loop, self ).__init__( name="modbus_loop" )
+        self.daemon		= True
+        self.loop		= asyncio.new_event_loop()
+        self.concurrency	= concurrency
+        self.limit		= None		# asyncio.Semaphore; created in the loop, when first used
+        self.start()
+
+    @classmethod
+    def default( cls ):
+        with cls.shared_lock:
+            if cls.shared is None or not cls.shared.is_alive():
+                cls.shared	= cls()
+            return cls.shared
+
+    def run( self ):
+        asyncio.set_event_loop( self.loop )
+        self.loop.run_forever()
+
+    def stop( self ):
+        self.loop.call_soon_threadsafe( self.loop.stop )
+
+    def submit( self, coro ):
+        """Schedule the coroutine on the loop, returning a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe( coro, self.loop )
+
+    def call( self, coro, timeout=None ):
+        """Run the coroutine on the loop from another Thread, returning its result (or raising)."""
+        assert threading.current_thread() is not self, \
+            "Cannot synchronously call a coroutine from within the modbus_loop"
+        return self.submit( coro ).result( timeout=timeout )
+
+    @contextlib.asynccontextmanager
+    async def limited( self ):
+        """Await permission to begin a transaction, if the loop's concurrency is limited."""
+        if not self.concurrency:
+            yield
+            return
+        if self.limit is None:
+            self.limit		= asyncio.Semaphore( self.concurrency )
+        async with self.limit:
+            yield
+
+
+class poller_modbus_async( poller_modbus_base ):
+    """A PLC object that polls a physical PLC via Modbus/TCP, using pymodbus asyncio clients on a
+    shared modbus_loop (or the supplied 'loop') instead of a dedicated Thread.  Supports the same
+    poll/read/write/online API and polling parameters (reach, limits, overhead, similar, unit, ...)
+    as poller_modbus.
+
+    Each transaction (including any connect) must complete within 'timeout' (default:
+    Defaults.Timeout, at the time of the transaction).  The first completely failed poll cycle of a
+    rate class marks the PLC as offline, 'til a poll again succeeds.
+
+    The pymodbus asyncio client allows only a single transaction in flight on its connection.  Up
+    to 'concurrency' connections are made to the PLC (if supplied a 'client', it is the only one);
+    the ranges of each poll cycle, and any writes, are transacted concurrently over them.  Most
+    Modbus/TCP PLCs accept a handful of simultaneous connections.  Writes are synchronous (ie. do
+    not return 'til the write is complete), and may not be issued from within the modbus_loop.
+
+    """
+    def __init__( self, description, client=None, host=None, port=None, loop=None, timeout=None,
+                  concurrency=1, **kwargs ):
+        poller_modbus_base.__init__( self, description=description, **kwargs )
+        self.loop		= modbus_loop.default() if loop is None else loop
+        self.timeout		= timeout
+        if client is None:
+            # The pymodbus asyncio clients must be created within the event loop
+            async def connections():
+                return [ modbus_client_tcp_async( host=host, port=port, timeout=timeout )
+                         for _ in range( max( 1, concurrency )) ]
+            clients		= self.loop.call( connections() )
+        else:
+            assert host is None and port is None, "Must specify client or host/port; not both"
+            clients		= [ client ]
+        self.clients		= clients
+        self.client		= clients[0]
+        self.idle		= None		# asyncio.Queue of idle clients; created in the loop
+        self.task		= self.loop.submit( self._poller() )
+
+    def is_alive( self ):
+        return not self.task.done()
+
+    def join( self, timeout=None ):
+        if self.is_alive():
+            log.info( "Joining: %s", self.description )
+        self.stop()
+        concurrent.futures.wait( [ self.task ], timeout=timeout )
+
+    async def _transaction( self, request, address, what ):
+        """Execute the request on an idle client (connecting, if necessary), returning the result.
+        Raises PlcOffline on connection failure, or ModbusIOException on timeout."""
+        if self.idle is None:
+            self.idle		= asyncio.Queue()
+            for c in self.clients:
+                self.idle.put_nowait( c )
+        timeout			= self.timeout or Defaults.Timeout
+        client			= await self.idle.get()
+        try:
+            async with self.loop.limited():
+                if not client.connected:
+                    try:
+                        connected = await asyncio.wait_for( client.connect(), timeout=timeout )
+                    except asyncio.TimeoutError:
+                        connected = False
+                    if not connected:
+                        raise PlcOffline( "Modbus %s PLC %s/%6d failed: Offline; Connect failure" % (
+                            what, self.description, address ))
+                try:
+                    return await asyncio.wait_for(
+                        client.execute( no_response_expected=False, request=request ), timeout=timeout )
+                except ( asyncio.TimeoutError, ModbusIOException ) as exc:
+                    # No response (by our, or the client's own timeout).  Abandon the connection; a
+                    # late response would otherwise be mistaken for the next one's (or worse).
+                    client.close()
+                    if isinstance( exc, ModbusIOException ):
+                        raise
+                    raise ModbusIOException( "No response from PLC %s/%6d w/in %.3fs" % (
+                        self.description, address, timeout ))
+        finally:
+            self.idle.put_nowait( client )
+
+    def _write( self, address, value, **kwargs ):
+        """Perform the write on the modbus_loop, blocking 'til complete.  Normally returns None, but
+        may raise a ModbusException or a PlcOffline if there are communications problems."""
+        return self.loop.call( self._write_async( address, value, **kwargs ))
+
+    async def _write_async( self, address, value, **kwargs ):
+        request			= self._writer( address, value, **kwargs )
+        self._written( address, await self._transaction( request, address, "Write to" ))
+
+    async def _read_async( self, address, count=1, **kwargs ):
+        request			= self._request( address, count, **kwargs )
+        return self._response( address, count, await self._transaction( request, address, "Read  of" ))
+
+    async def _reads( self, address, count ):
+        """Read the range, returning (address,count),value,exc; the value read, or the exception
+        raised (and value None).  Exceptions other than ModbusException are supplied as a string
+        including the traceback, if available."""
+        try:
+            return (address, count),await self._read_async( address, count, unit=self.unit ),None
+        except ModbusException as exc:
+            return (address, count),None,exc
+        except Exception:
+            return (address, count),None,traceback.format_exc()
+
+    async def _poller( self ):
+        """Poll all the specified registers, on the designated poll cycle of each rate class; see
+        poller_modbus._poller.  The ranges of each poll cycle are read concurrently (limited by the
+        number of clients).
+        """
+        log.info( "Poller starts: %s", self.description )
+        epoch			= misc.timer()	# poll cycles of all rate classes are aligned to this
+        schedule		= []		# heap of (<due>,<rate>)
+        due			= {}		# { <rate>: <due>, ... } of each scheduled rate class
+        try:
+            while not self.done and logging:	# Module may be gone in shutting down
+                # Poller is dormant 'til a non-None/zero rate and data specified
+                if not self.rate or not self._data:
+                    await asyncio.sleep( .1 )
+                    continue
+
+                # Delay 'til the next rate class is due
+                delay, rate, classes = self._due( schedule, due, epoch )
+                if delay:
+                    await asyncio.sleep( delay )
+                    continue
+
+                rngs		= self._ranges( classes[rate] )
+                succ		= set()
+                fail		= set()
+                begin		= misc.timer()
+                for (address, count),value,exc in await asyncio.gather(
+                        *( self._reads( address, count ) for address, count in rngs )):
+                    self._polled( address, count, value, exc, succ, fail )
+                self._cycled( rate, succ, fail, misc.timer() - begin )
+        finally:
+            log.info( "Poller ceases: %s", self.description )
+            for c in self.clients:
+                c.close()
@@ -34,9 +34,9 @@ Upgrade to pymodbus 3.
 
 """
 __all__				= [
-    'modbus_server_tcp', 'modbus_server_tcp_printing',
+    'modbus_server_request_handler', 'modbus_server_tcp', 'modbus_server_tcp_printing',
     'modbus_server_rtu', 'modbus_server_rtu_printing',
-    'modbus_client_timeout', 'modbus_client_rtu', 'modbus_client_tcp',
+    'modbus_client_timeout', 'modbus_client_rtu', 'modbus_client_tcp', 'modbus_client_tcp_async',
     'Defaults',
 ]
 
@@ -70,10 +70,12 @@ except ImportError:
 from .. import misc
 from ..server import network
 
-from pymodbus.client import ModbusTcpClient, ModbusSerialClient
+from pymodbus.client import ModbusTcpClient, ModbusSerialClient, AsyncModbusTcpClient
+from pymodbus.exceptions import ConnectionException, ModbusIOException
 from pymodbus.datastore.store import ModbusSparseDataBlock
 from pymodbus.framer import FramerType, FramerBase
 from pymodbus.server import ModbusTcpServer, ModbusSerialServer
+from pymodbus.server.async_io import ModbusServerRequestHandler
 
 
 # Historically part of pymodbus to contain global defaults; now hosted here
@@ -142,12 +144,41 @@ class modbus_communication_monitor( object ):
         asyncio.run_coroutine_threadsafe( self.shutdown(), loop )
 
 
+class modbus_server_request_handler( ModbusServerRequestHandler ):
+    """The pymodbus server request handler decodes only the first frame of each chunk of data
+    received, leaving any subsequent frames buffered 'til more data arrives.  A Modbus/TCP client
+    pipelining several transactions (see modbus_client_tcp.execute_pipelined) may send them all in
+    one segment, and would then wait for the remaining responses 'til it times out.  Decode every
+    complete frame received, and queue the requests for the connection's handler to execute in order.
+
+    """
+    def __init__( self, owner ):
+        super( modbus_server_request_handler, self ).__init__( owner )
+        self.requests		= asyncio.Queue()
+
+    def callback_data( self, data, addr=None ):
+        used			= 0
+        while used < len( data ):
+            cut			= super( modbus_server_request_handler, self ).callback_data( data[used:], addr=addr )
+            if not cut:
+                break
+            used	       += cut
+            if self.response_future.done():
+                self.requests.put_nowait( self.response_future.result() )
+                self.response_future = asyncio.Future()
+        return used
+
+    async def server_execute( self ):
+        return await self.requests.get()
+
+
 class modbus_server_tcp( modbus_communication_monitor, ModbusTcpServer ):
     """An asyncio.BaseProtocol based Modbus TCP server.  This is an async server program, and must
-    be run in an asyncio loop.
+    be run in an asyncio loop.  Handles pipelined requests (several transactions in flight at once).
 
     """
-    pass
+    def callback_new_connection( self ):
+        return modbus_server_request_handler( self )
 
 
 class modbus_server_tcp_printing( modbus_server_tcp ):
@@ -273,10 +304,100 @@ class modbus_client_tcp( modbus_client_timeout, ModbusTcpClient ):
     """A ModbusTcpClient with transaction timeouts and locking for Threaded connection sharing.
     These are synchronous clients, and run in the calling thread.
 
+    Modbus/TCP allows several transactions to be outstanding on a connection, distinguished by their
+    transaction IDs; execute_pipelined issues a number of requests without awaiting each response.
+
     """
     def __repr__( self ):
         return "<%s: %s>" % ( self, self.socket.__repr__() if self.socket else "closed" )
 
+    def execute_pipelined( self, requests, depth=None ):
+        """Execute the Modbus/TCP 'requests', keeping up to 'depth' (default: all) transactions in flight
+        at once, matching each response to its request by transaction ID.  Returns a list of the
+        responses, in request order.  Any request not responded to before the transaction timeout
+        (see .timeout) expires has a ModbusIOException in place of its response; if the response
+        stream cannot be decoded or the connection is lost, the connection is closed.
+
+        """
+        if not self.connect():
+            raise ConnectionException( "Failed to connect[{self!s}]".format( self=self ))
+        transaction		= self.transaction
+        results			= [ None ] * len( requests )
+        pending			= {}	# { <transaction_id>: <index>, ... }
+        queued			= iter( enumerate( requests ))
+        depth			= depth or len( requests )
+        failure			= None
+        databuffer		= b''
+
+        def send_next():
+            for i,request in queued:
+                request.transaction_id = transaction.getNextTID()
+                pending[request.transaction_id] = i
+                transaction.pdu_send( request )
+                return True
+            return False
+
+        # If no transaction timeout has been set, .timeout is always Defaults.Timeout; compute a
+        # deadline once, so a lost response cannot keep us waiting forever.
+        deadline		= misc.timer() + ( self.timeout or Defaults.Timeout )
+        with transaction._sync_lock:
+            while len( pending ) < depth and send_next():
+                pass
+            while pending:
+                remains		= deadline - misc.timer()
+                if remains <= 0:
+                    failure	= "Timeout"
+                    break
+                readable,_,_	= select.select( [ self.socket ], [], [], remains )
+                if not readable:
+                    continue # re-evaluate remaining timeout
+                data		= self.socket.recv( 4096 )
+                if not data:
+                    failure	= "Connection closed"
+                    self.close()
+                    break
+                databuffer     += data
+                try:
+                    while databuffer:
+                        used,pdu	= self.framer.processIncomingFrame( databuffer )
+                        databuffer	= databuffer[used:]
+                        if not pdu:
+                            break
+                        i	= pending.pop( pdu.transaction_id, None )
+                        if i is None:
+                            logging.warning( "Discarding response to unknown transaction {tid}: {pdu}".format(
+                                tid=pdu.transaction_id, pdu=pdu ))
+                            continue
+                        results[i] = pdu
+                        if len( pending ) < depth:
+                            send_next()
+                except ModbusIOException as exc:
+                    failure	= "Invalid response: {exc}".format( exc=exc )
+                    self.close()
+                    break
+        if pending:
+            logging.info( "Pipelined Modbus/TCP transactions failed: {failure}; {pending} of {total} outstanding".format(
+                failure=failure, pending=len( pending ), total=len( requests )))
+        return [ ModbusIOException( "No response: {failure}".format( failure=failure or "Not sent" ))
+                 if r is None else r for r in results ]
+
+
+class modbus_client_tcp_async( AsyncModbusTcpClient ):
+    """An asyncio ModbusTcpClient, which must be created and used within an asyncio event loop.  By
+    default, connects to the Defaults.Port, and neither retries transactions nor automatically
+    reconnects; the caller (eg. remote.plc_modbus_async.poller_modbus_async) handles timeouts and
+    reconnection.  Only one transaction may be in flight at a time.
+
+    """
+    def __init__( self, host, port=None, timeout=None, retries=0, reconnect_delay=0, **kwargs ):
+        super( modbus_client_tcp_async, self ).__init__(
+            host, port=Defaults.Port if port is None else port,
+            timeout=Defaults.Timeout if timeout is None else timeout,
+            retries=retries, reconnect_delay=reconnect_delay, **kwargs )
+
+    def __repr__( self ):
+        return "<%s: %s:%s>" % ( self.__class__.__name__, self.comm_params.host, self.comm_params.port )
+
 
 class modbus_client_rtu( modbus_client_timeout, ModbusSerialClient ):
     """A ModbusSerialClient with timeouts and locking for Threaded serial port sharing.  These are
@@ -25,8 +25,10 @@ __email__                       = "perry@hardconsulting.com"
 __copyright__                   = "Copyright (c) 2013 Hard Consulting Corporation"
 __license__                     = "Dual License: GPLv3 (or later) and Commercial (see LICENSE)"
 
+import asyncio
 import errno
 import logging
+import os
 import socket
 import threading
 import time
@@ -34,10 +36,11 @@ import traceback
 
 import pytest
 
+from . import misc
 from .tools.waits import waitfor
 from .modbus_test import start_modbus_simulator, has_o_nonblock, run_plc_modbus_polls
 from .remote.plc import poller_simulator, PlcOffline
-from .remote.io	import motor
+from .remote.io	import motor, event_store, capture, input_event
 
 log				= logging.getLogger(__name__)
 
@@ -47,12 +50,21 @@ has_pymodbus			= False
 try:
     import pymodbus
     from pymodbus.exceptions import ModbusException
-    from .remote.plc_modbus import poller_modbus, merge, shatter
+    from .remote.plc_modbus import poller_modbus, merge, shatter, table, transaction_cost
     from .remote.pymodbus_fixes import modbus_client_tcp, modbus_server_tcp, Defaults
+    from .remote.plc_modbus_async import modbus_loop, poller_modbus_async
+    from .bin.modbus_sim import register_context, register_block, register_definitions, register_update, register_playback
     has_pymodbus		= True
 except ImportError as exc:
     logging.warning( "Failed to import pymodbus module; skipping Modbus/TCP related tests; run 'pip install pymodbus': {exc}".format( exc=exc ))
 
+has_history			= False
+try:
+    from .history import logger
+    has_history			= True
+except Exception as exc:
+    logging.warning( "Failed to import history module; skipping history playback tests: {exc}".format( exc=exc ))
+
 
 @pytest.fixture( scope="module" )
 def simulated_modbus_tcp( request ):
@@ -146,6 +158,43 @@ def test_device():
     assert m.running
 
 
+def test_event_store():
+    """A bounded event store; since queries, retention of the last event of each description, and
+    lapping of the ring buffer."""
+    es				= event_store( capacity=10, retain=5 )
+    for t in range( 100 ):
+        es.append( dict( time=float( t ), description="abc"[t % 3] if t < 50 else "a", message=t ))
+    assert len( es ) == 10
+    assert list( es.events() ) == []
+    # Only the last 5s (w/in retain of now), and then the latest "b" and "c" (older than retain)
+    assert [ e["message"] for e in es.events( since=0, now=100.0 ) ] == [ 99, 98, 97, 96, 95, 49, 47 ]
+    assert [ e["message"] for e in es.events( since=96.0, now=100.0 ) ] == [ 99, 98, 97 ]
+    assert [ e["message"] for e in es.events( since=48.0, now=100.0 ) ] == [ 99, 98, 97, 96, 95, 49 ]
+    # W/o retain, the whole ring
+    es.retain			= None
+    assert [ e["message"] for e in es.events( since=0 ) ] == list( range( 99, 89, -1 )) + [ 49, 47 ]
+    # A clock stepping backwards doesn't break the (monotonic) index
+    es.append( dict( time=95.5, description="a", message=100 ))
+    assert [ e["message"] for e in es.events( since=97.0 ) ] == [ 99, 98 ]
+    assert [ e["message"] for e in es.events( since=95.0 ) ] == [ 100, 99, 98, 97, 96 ]
+
+    # Captures of several inputs into a shared store
+    p				= poller_simulator( "PLC 1", rate=.1 )
+    shared			= event_store( capacity=100 )
+    inputs			= [ input_event( p, address=a, description="input %d" % a, level=logging.INFO,
+                                                 events=shared )
+                                    for a in ( 1, 2 ) ]
+    before			= misc.timer() - 1
+    for v in range( 200 ):
+        inputs[v % 2].remember( what=capture.CHANGED, last=v - 2, chng=v )
+    assert len( shared ) == 100
+    events			= list( inputs[0].events( since=before ))
+    assert len( events ) == 100
+    assert events == list( inputs[1].events( since=before ))
+    assert events[0]["message"] == "199 (was 197)" and events[0]["description"] == "input 2"
+    assert all( a["time"] >= b["time"] for a,b in zip( events, events[1:] ))
+
+
 @pytest.mark.skipif( not has_pymodbus, reason="Needs pymodbus" )
 def test_plc_merge():
     """ plc utility functions for merging/shattering Modbus address ranges """
@@ -163,6 +212,118 @@ def test_plc_merge():
     assert list( merge( [(1,130), (140,4), (232,170), (40001,100)], reach=5 )) \
         == [(1,130), (140,4), (232,170), (40001,100)]
 
+    # Per-table read limits, and device-specific overrides
+    assert table( 40001 ) == ('holding', 40001) and table( 400001 ) == ('holding', 400001)
+    assert table( 10000 ) == (None, 10000)
+    assert list( merge( [ (1,2500), (40001,200) ] )) == [ (1,2000), (2001,500), (40001,125), (40126,75) ]
+    assert list( merge( [ (1,2500), (40001,200) ], limits=dict( holding=100 ))) \
+        == [ (1,2000), (2001,500), (40001,100), (40101,100) ]
+    # Different (5- vs. 6-digit) addressing of the same table isn't merged
+    assert list( merge( [ (99999,1), (400001,1) ], reach=1000000 )) == [ (99999,1), (400001,1) ]
+
+    # Cost-based merging: bridge a gap only if the unwanted bits/registers cost less than another
+    # transaction; 21 bytes of framing bridges 10 registers, or 168 coils
+    cost			= transaction_cost()
+    assert cost == 21 and transaction_cost( rtt=.01, bandwidth=1000 ) == 31
+    assert list( merge( [ (1,1), (170,1), (340,1), (40001,1), (40012,1), (40024,1) ], overhead=cost )) \
+        == [ (1,170), (340,1), (40001,12), (40024,1) ]
+    # ... but never beyond the table's limit
+    assert list( merge( [ (40001,120), (40125,5) ], overhead=cost )) == [ (40001,120), (40125,5) ]
+
+    # Avoid merging over ranges known to be rejected by the device
+    assert list( merge( [ (40001,1), (40003,1), (40010,1), (40030,1), (40032,1) ], reach=5,
+                        avoid=[ (40001,10) ] )) \
+        == [ (40001,1), (40003,1), (40010,1), (40030,3) ]
+
+
+@pytest.mark.skipif( not has_pymodbus, reason="Needs pymodbus" )
+def test_modbus_sim_blocks():
+    """Contiguous register ranges are served from dense arrays; isolated registers sparsely."""
+    hr				= register_definitions( [ '40001-40100=1,2,3', '40200-40203', '40300' ] )['hr']
+    blk				= register_block( hr, dense=16 )
+    assert len( blk.runs ) == 1 and len( blk.sparse ) == 5 and len( blk ) == 105
+    assert blk.validate( 1, 100 ) and not blk.validate( 1, 101 ) and not blk.validate( 0, 1 )
+    assert blk.validate( 200, 4 ) and not blk.validate( 199, 2 ) and not blk.validate( 200, 0 )
+    assert blk.getValues( 99, 2 ) == [3, 1]
+    blk.setValues( 99, [ 9, 8 ] )
+    blk.setValues( 300, 7 )
+    assert blk.getValues( 98, 3 ) == [2, 9, 8] and blk.getValues( 300 ) == [7]
+    blk.reset()
+    assert blk.getValues( 99, 2 ) == [3, 1] and blk.getValues( 300 ) == [0]
+    assert list( blk )[-2:] == [ (203, 0), (300, 0) ]
+
+    # Shared memory dense runs are visible (and alterable) by others, eg. other processes
+    from multiprocessing import shared_memory
+    name			= "remote_test-%d-hr" % ( os.getpid() )
+    blk				= register_block( hr, dense=16, shared=name )
+    try:
+        shm			= shared_memory.SharedMemory( name=name )
+        view			= shm.buf.cast( 'H' )
+        assert view[:4].tolist() == [1, 2, 3, 1]
+        view[0]			= 999
+        assert blk.getValues( 1, 2 ) == [999, 2]
+        view.release()
+        shm.close()
+    finally:
+        blk.close()
+
+
+def modbus_sim_reads( context, reads ):
+    """Read 125-register blocks (as a Modbus/TCP server would) across holding registers 40001-49999."""
+    slave			= context[0]
+    for i in range( reads ):
+        address			= i * 125 % 9875
+        assert slave.validate( 3, address, 125 )
+        assert len( slave.getValues( 3, address, 125 )) == 125
+
+
+@pytest.mark.skipif( not has_pymodbus, reason="Needs pymodbus" )
+def test_modbus_sim_bench():
+    """Benchmark multi-register reads of a large contiguous range, served dense vs. sparse."""
+    reads			= 500
+    durations			= {}
+    for dense in ( None, 0 ):
+        context			= register_context( [ '40001-49999' ], dense=dense )
+        test			= misc.assert_tps( scale=reads )( modbus_sim_reads )
+        beg			= misc.timer()
+        test( context, reads )
+        durations[dense]	= misc.timer() - beg
+    log.normal( "Dense: %7.3f TPS, Sparse: %7.3f TPS", reads / durations[None], reads / durations[0] )
+    assert durations[None] < durations[0]
+
+
+@pytest.mark.skipif( not has_pymodbus or not has_history, reason="Needs pymodbus and history (pytz)" )
+def test_modbus_sim_playback():
+    """Recorded register history is played back into the simulator's data blocks, accelerated."""
+    context			= register_context( [ '40001-40020', '40100', '1-16' ] )
+    _,slave			= next( iter( context ))
+    hr,co			= slave.store['h'], slave.store['c']
+
+    # Bulk updates of contiguous runs; unserved registers are ignored, values are truncated
+    assert register_update( context, { 40001: 1, "40002": 2, 40003: -1, 40100: 4, 40101: 5, 3: 9 } ) == 5
+    assert hr.getValues( 1, 3 ) == [ 1, 2, 0xFFFF ] and hr.getValues( 100 ) == [ 4 ] and co.getValues( 3 ) == [ 1 ]
+
+    # 10s of history, played back at 20x real time
+    path			= "/tmp/remote_test_playback_%d.hst" % os.getpid()
+    now				= misc.timer()
+    # Not asyncio.run; it would discard this Thread's default event loop (used by pymodbus)
+    aio				= asyncio.new_event_loop()
+    try:
+        with logger( path ) as l:
+            for i in range( 11 ):
+                l.write( { 40001 + i: i, 40020: i, 1: i % 2 }, now=now - 100 + i )
+        beg			= misc.timer()
+        played			= aio.run_until_complete(
+            register_playback( context, path, historical=now - 100.5, factor=20 ))
+        dur			= misc.timer() - beg
+    finally:
+        aio.close()
+        os.unlink( path )
+    assert played == 11
+    assert .4 < dur < 2.0, "10.5s of history at 20x should take ~.5s, not %.3fs" % dur
+    assert hr.getValues( 1, 11 ) == list( range( 11 )) and hr.getValues( 20 ) == [ 10 ]
+    assert co.getValues( 1 ) == [ 0 ]
+
 
 @pytest.mark.skipif( not has_pymodbus or not has_o_nonblock, reason="Needs pymodbus and fcntl/O_NONBLOCK" )
 def test_plc_modbus_basic( simulated_modbus_tcp ):
@@ -255,3 +416,182 @@ def test_plc_modbus_polls( simulated_modbus_tcp ):
         log.info( "Stopping plc polling" )
         plc.done		= True
         waitfor( lambda: not plc.is_alive(), "Motor PLC poller done", timeout=1.0 )
+
+
+@pytest.mark.skipif( not has_pymodbus or not has_o_nonblock, reason="Needs pymodbus and fcntl/O_NONBLOCK" )
+def test_plc_modbus_pipelined( simulated_modbus_tcp ):
+    """Several reads in flight at once on the Modbus/TCP connection yield the same results as reading
+    one at a time, and a pipelined poller polls correctly."""
+    Defaults.Timeout		= TCP_TIMEOUT
+    command,(iface,port)	= simulated_modbus_tcp
+    client			= modbus_client_tcp( host=iface, port=port )
+    plc				= poller_modbus( "Motor PLC", client=client, reach=10, rate=1.0, pipeline=4 )
+    try:
+        assert plc.pipeline == 4
+        ranges			= [ (40001,10), (40011,5), (1,8), (40101,3), (999999,1), (40201,1) ]
+        with client:
+            serial		= list( plc._reads( ranges[:1] )) + list( plc._reads( ranges[1:2] ))
+            pipelined		= list( plc._reads( ranges ))
+        assert [ r for r,v,e in pipelined ] == ranges
+        assert pipelined[:2] == serial
+        assert len( pipelined[0][1] ) == 10 and len( pipelined[2][1] ) == 8
+        assert isinstance( pipelined[4][2], ModbusException ) # Invalid address
+        assert all( e is None for r,v,e in pipelined[:4] + pipelined[5:] )
+
+        plc.write( 40002, 2 ) # Restore simulator default (the simulator is shared w/ test_plc_modbus_polls)
+        run_plc_modbus_polls( plc )
+    finally:
+        log.info( "Stopping plc polling" )
+        plc.done		= True
+        waitfor( lambda: not plc.is_alive(), "Motor PLC poller done", timeout=1.0 )
+
+
+@pytest.mark.skipif( not has_pymodbus, reason="Needs pymodbus" )
+def test_plc_modbus_pipelined_silent():
+    """A pipelined transaction to a server that never responds times out after Defaults.Timeout, even
+    if no transaction .timeout has been set on the client."""
+    from pymodbus.pdu.register_message import ReadHoldingRegistersRequest
+    listener			= socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+    listener.bind( ('localhost', 0) )
+    listener.listen( 1 )
+    timeout			= Defaults.Timeout
+    Defaults.Timeout		= .5
+    iface,port			= listener.getsockname()
+    client			= modbus_client_tcp( host=iface, port=port )
+    try:
+        begun			= misc.timer()
+        results			= client.execute_pipelined( [ ReadHoldingRegistersRequest( address=0, count=1 ) ], depth=2 )
+        elapsed			= misc.timer() - begun
+        assert len( results ) == 1 and isinstance( results[0], pymodbus.exceptions.ModbusIOException )
+        assert .4 < elapsed < 2.0, "Pipelined timeout took %.3fs" % elapsed
+    finally:
+        Defaults.Timeout	= timeout
+        client.close()
+        listener.close()
+
+
+@pytest.mark.skipif( not has_pymodbus or not has_o_nonblock, reason="Needs pymodbus and fcntl/O_NONBLOCK" )
+def test_plc_modbus_rejected( simulated_modbus_tcp ):
+    """A merged range spanning a hole in the PLC's register map is rejected; the poller learns to
+    avoid it, and polls the registers within it separately.  The simulator has 40001-41000."""
+    Defaults.Timeout		= TCP_TIMEOUT
+    command,(iface,port)	= simulated_modbus_tcp
+    client			= modbus_client_tcp( host=iface, port=port )
+    plc				= poller_modbus( "Motor PLC", client=client, reach=10, rate=.25 )
+    try:
+        plc.poll( 40999 )
+        plc.poll( 41002 )
+        success,elapsed		= waitfor( lambda: (40999,1) in plc.polling, "40999 polled", timeout=5.0 )
+        assert success
+        assert (40999,4) in plc.rejected
+        assert plc.read( 40999 ) is not None
+        assert plc.read( 41002 ) is None
+        success,elapsed		= waitfor( lambda: (41002,1) in plc.failing, "41002 failing", timeout=5.0 )
+        assert success
+    finally:
+        log.info( "Stopping plc polling" )
+        plc.done		= True
+        waitfor( lambda: not plc.is_alive(), "Motor PLC poller done", timeout=1.0 )
+
+
+@pytest.mark.skipif( not has_pymodbus or not has_o_nonblock, reason="Needs pymodbus and fcntl/O_NONBLOCK" )
+def test_plc_modbus_rates( simulated_modbus_tcp ):
+    """Addresses are polled at their own rates; only those with similar rates are merged."""
+    Defaults.Timeout		= TCP_TIMEOUT
+    command,(iface,port)	= simulated_modbus_tcp
+    client			= modbus_client_tcp( host=iface, port=port )
+    plc				= poller_modbus( "Motor PLC", client=client, reach=10, rate=5.0 )
+    try:
+        plc.poll( 40001, rate=.25 )
+        plc.poll( 40003, rate=.4 )	# similar to .25; polled with it
+        plc.poll( 40005 )		# default rate 5.0
+        plc.poll( 40007, rate=.6 )
+        plc.poll( 40007, rate=1.0 )	# remembers the fastest requested
+        assert plc.rate == .25
+        assert [ plc.rate_of( a ) for a in (40001, 40003, 40005, 40007) ] == [ .25, .4, 5.0, .6 ]
+        assert { r: sorted( a ) for r,a in plc._classes().items() } \
+            == { .25: [ 40001, 40003 ], .6: [ 40007 ], 5.0: [ 40005 ] }
+
+        success,elapsed		= waitfor( lambda: len( plc.loads ) == 3, "all rate classes polled", timeout=2.0 )
+        assert success
+        assert plc.polling == { (40001,3), (40005,1), (40007,1) }
+        # The fast class is polled many times before the slow one is polled again
+        counter			= plc.counter
+        time.sleep( 1.0 )
+        assert plc.counter - counter >= 5
+        assert all( l[0] is not None for l in plc.loads.values() )
+        assert plc.load[0] == pytest.approx( sum( l[0] for l in plc.loads.values() ))
+    finally:
+        log.info( "Stopping plc polling" )
+        plc.done		= True
+        waitfor( lambda: not plc.is_alive(), "Motor PLC poller done", timeout=1.0 )
+
+
+@pytest.mark.skipif( not has_pymodbus or not has_o_nonblock, reason="Needs pymodbus and fcntl/O_NONBLOCK" )
+def test_plc_modbus_rates_failing( simulated_modbus_tcp ):
+    """A PLC isn't taken offline by a failing slow rate class, while a fast one is polling successfully."""
+    Defaults.Timeout		= TCP_TIMEOUT
+    command,(iface,port)	= simulated_modbus_tcp
+    client			= modbus_client_tcp( host=iface, port=port )
+    plc				= poller_modbus( "Motor PLC", client=client, reach=10, rate=.5 )
+    try:
+        plc.poll( 40001, rate=.1 )
+        plc.poll( 999999 )		# Invalid address; always fails
+        success,elapsed		= waitfor( lambda: (999999,1) in plc.failing and plc.read( 40001 ) is not None,
+                                           "slow class failed", timeout=2.0 )
+        assert success
+        begun			= misc.timer()
+        while misc.timer() - begun < 1.5:
+            assert plc.online and plc.read( 40001 ) is not None
+            time.sleep( .01 )
+    finally:
+        log.info( "Stopping plc polling" )
+        plc.done		= True
+        waitfor( lambda: not plc.is_alive(), "Motor PLC poller done", timeout=1.0 )
+
+
+@pytest.mark.skipif( not has_pymodbus or not has_o_nonblock, reason="Needs pymodbus and fcntl/O_NONBLOCK" )
+def test_plc_modbus_async( simulated_modbus_tcp ):
+    """Several asyncio PLC pollers multiplexed on one modbus_loop behave as the Threaded poller.  The
+    simulator handles requests serially, so concurrent pollers need a longer transaction timeout."""
+    Defaults.Timeout		= TCP_TIMEOUT
+    command,(iface,port)	= simulated_modbus_tcp
+    loop			= modbus_loop( concurrency=4 )
+    plc				= None
+    plcs			= [ poller_modbus_async( "Motor PLC %d" % i, host=iface, port=port, loop=loop,
+                                                         rate=.25, concurrency=2, timeout=.5 )
+                                    for i in range( 3 ) ]
+    plc_bad			= poller_modbus_async( "Motor PLC bad", host=iface, port=port+1, loop=loop,
+                                                       rate=.25 )
+    try:
+        assert threading.active_count() < 10 + len( plcs ) # No Thread per PLC
+        for i,p in enumerate( plcs ):
+            p.poll( 40011 + i )
+            p.poll( 1 )
+        plc_bad.poll( 40001 )
+        success,elapsed		= waitfor( lambda: all( p.read( 40011 + i ) is not None for i,p in enumerate( plcs )),
+                                           "async PLCs polled", timeout=2.0 )
+        assert success
+        assert all( p.online for p in plcs )
+        success,elapsed		= waitfor( lambda: not plc_bad.online, "bad PLC offline", timeout=2.0 )
+        assert success
+        try:
+            plc_bad.write( 40001, 1 )
+            assert False, "Write to offline PLC should have failed"
+        except PlcOffline as exc:
+            log.info( "Write to offline PLC failed as expected: %s", exc )
+
+        # Stop the others, so they don't slow the (serial) simulator during the timing-sensitive polls
+        for p in [ plc_bad ] + plcs:
+            p.join( timeout=1.0 )
+            assert not p.is_alive()
+        plc			= poller_modbus_async( "Motor PLC", host=iface, port=port, loop=loop,
+                                                       reach=10, rate=1.0 )
+        plc.write( 40002, 2 ) # Restore simulator default (the simulator is shared w/ test_plc_modbus_polls)
+        run_plc_modbus_polls( plc )
+    finally:
+        log.info( "Stopping plc polling" )
+        for p in [ plc_bad ] + plcs + ( [ plc ] if plc else [] ):
+            p.join( timeout=1.0 )
+            assert not p.is_alive()
+        loop.stop()
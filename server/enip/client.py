@@ -27,7 +27,8 @@ __license__                     = "Dual License: GPLv3 (or later) and Commercial
 
 __all__				= ['parse_int', 'parse_path', 'parse_path_elements', 'parse_path_component',
                                    'format_path', 'format_context', 'parse_context', 'CIP_TYPES', 'parse_operations',
-                                   'client', 'await_response', 'connector', 'recycle', 'main', 'ENIPStatusError' ]
+                                   'fragment_operations', 'prepared', 'lazy_reply', 'client', 'await_response', 'connector', 'recycle', 'main',
+                                   'ENIPStatusError' ]
 
 
 """enip.client	-- EtherNet/IP client API and module entry point
@@ -44,6 +45,7 @@ import argparse
 import array
 import collections
 import contextlib
+import copy
 import csv
 import itertools
 import json
@@ -51,6 +53,7 @@ import logging
 import random
 import select
 import socket
+import struct
 import sys
 import traceback
 import warnings
@@ -215,12 +218,17 @@ def parse_operations( tags, fragment=False, int_type=None, **kwds ):
         TAG[1-5]		read 5 values from element indices 1 to 5
         TAG[1-5]+4		read 5 values from element indices 1 to 5, beginning at byte offset 4
         TAG[4-7]=1,2,3,4	write 4 values from indices 4 to 7
+        TAG[0-999](DINT)	read 1000 values from indices 0 to 999, known to be DINT
         @0x1FF/01/0x1A[99]	read the 100th element of class 511/0x1ff, instance 1, attribute 26
 
     To support access to scalar attributes (no element index allowed in path), we cannot default to
     supply an element index of 0; default is no element in path, and a data value count of 1.  If a
     byte offset is specified, the request is forced to use Read/Write Tag Fragmented.
 
+    A Tag's data type is not required to read it, but if supplied as a trailing (TYPE), it is used to
+    estimate the size of the reply (and allows a large read to be split by fragment_operations).  It
+    is also the default type of any write data.
+
     Default CIP int_type for int data (data with no '.' in it, by default) is CIP 'INT'.
 
     """
@@ -241,6 +249,12 @@ def parse_operations( tags, fragment=False, int_type=None, **kwds ):
             tag,val		= [s.strip() for s in tag.split( '=', 1 )]
             opr['method']	= 'write'
 
+        typ			= None
+        if tag.endswith( ')' ) and '(' in tag:
+            # A Tag data type; strip off the trailing (TYPE)
+            tag,typ		= [s.strip() for s in tag[:-1].rsplit( '(', 1 )]
+            opr['tag_type'],size,cast = CIP_TYPES[typ.upper()]
+
         if '+' in tag:
             # A byte offset (valid for Fragmented)
             tag,off		= [s.strip() for s in tag.split( '+', 1 )]
@@ -255,8 +269,11 @@ def parse_operations( tags, fragment=False, int_type=None, **kwds ):
             opr['elements']	= cnt
 
         if val:
-            # Default between REAL/INT, by simply checking for '.' in the provided value(s)
-            if '.' in val:
+            # Default between REAL/INT (unless the Tag's type is known), by simply checking for '.'
+            # in the provided value(s)
+            if typ is not None:
+                pass
+            elif '.' in val:
                 opr['tag_type'],size,cast = CIP_TYPES['REAL']
             else:
                 opr['tag_type'],size,cast = CIP_TYPES[int_type.strip().upper()]
@@ -313,6 +330,61 @@ def parse_operations( tags, fragment=False, int_type=None, **kwds ):
         yield opr
 
 
+def fragment_operations( operations, fragment_size=None ):
+    """Split each Read/Write Tag [Fragmented] operation too large to fit in 'fragment_size' bytes (default:
+    defaults.fragment_size) into a sequence of Read/Write Tag Fragmented operations, with all byte
+    offsets computed up front.  These may then all be pipelined at full depth, instead of awaiting
+    each 0x06 Partial Data reply before issuing the next offset.  Use connector.reassemble to
+    recombine the harvested fragments, in order.
+
+    Only operations with a known 'tag_type' of fixed element size (eg. from an explicit tag_type, or
+    from write data), and a known number of 'elements' (or write 'data') may be split; all others
+    (and any small enough to fit in one fragment) are passed thru unchanged.  Each fragment
+    operation carries a 'fragmented' = (<index>,<count>,<elements>) entry, identifying its position
+    in the sequence, and the number of elements it is responsible for.
+
+    """
+    if fragment_size is None:
+        fragment_size		= defaults.fragment_size
+    for op in operations:
+        method			= op.get( 'method', 'write' if 'data' in op else 'read' )
+        tag_type		= op.get( 'tag_type' )
+        if ( method not in ('read','write') or not tag_type or 'fragmented' in op
+             or tag_type not in parser.typed_data.TYPES_SUPPORTED or tag_type >= parser.STRING.tag_type ):
+            if method == 'read' and not tag_type and op.get( 'elements', 1 ) > 1:
+                log.warning( "Cannot fragment read of %d elements of unknown type; specify it, eg. %s(DINT)",
+                             op['elements'], format_path( op['path'], count=op['elements'] ) if 'path' in op else 'Tag' )
+            yield op
+            continue
+        size			= parser.typed_data.datasize( tag_type=tag_type )
+        beg			= ( op.get( 'offset' ) or 0 ) // size		# elements skipped by initial byte offset
+        if method == 'write':
+            elements		= op.get( 'elements', len( op['data'] ))
+            remains		= len( op['data'] )
+        else:
+            elements		= op.get( 'elements', 1 )
+            remains		= elements - beg
+        chunk			= max( fragment_size // size, 1 )		# elements per fragment
+        if remains <= chunk:
+            yield op
+            continue
+        count			= ( remains + chunk - 1 ) // chunk
+        log.detail( "Fragmenting %s of %d %d-byte elements (from %d) into %d fragments of %d elements",
+                    method, remains, size, beg, count, chunk )
+        for index in range( count ):
+            frg			= op.copy()
+            first		= index * chunk
+            last		= min( first + chunk, remains )
+            frg['elements']	= elements
+            frg['offset']	= ( beg + first ) * size
+            if method == 'write':
+                frg['data']	= op['data'][first:last]
+            else:
+                frg['data_size']= ( last - first ) * size
+            frg['fragmented']	= ( index, count, last - first )
+            yield frg
+
+
 def enip_replies( response, multiple=False ):
     """Return valid EtherNet/IP response(s), or Falsey (None if nothing, {} if EOF).  Raises Exception
     if invalid response, EnipStatusError if valid but unsuccessful.
@@ -359,6 +431,107 @@ def enip_replies( response, multiple=False ):
     return replies
 
 
+class prepared( object ):
+    """A poll set of I/O operations, precompiled into fully encoded EtherNet/IP request frames.  Create
+    one via connector.prepare (or get_attribute.proxy.prepare), and supply it as the 'operations' to
+    any connector.issue, synchronous, pipeline, operate, etc.  The first time it is issued on a
+    connector (or if later issued on a connector of a different class), the operations are encoded;
+    thereafter, each cycle only patches the session handle and sender_context (and for Implicit
+    connections, the connection ID and sequence number) in place, before sending the saved frames.
+
+    The operations (and 'fragment', 'multiple' and 'fragment_size' options) are fixed at creation;
+    since the session and context are patched on each issue, the same prepared poll set may be used
+    on any (re-)connected connector of the same class.  Any caller-specific 'details' (eg. the
+    get_attribute.proxy's (<attribute>,<type>,<units>) for each operation) or 'params' (eg. poll
+    parameter names) are retained for the caller.
+
+    """
+    def __init__( self, operations, fragment=False, multiple=0, fragment_size=None,
+                  details=None, params=None ):
+        self.operations		= list( operations )
+        self.fragment		= fragment
+        self.multiple		= multiple
+        self.fragment_size	= fragment_size
+        self.details		= details
+        self.params		= params
+        self.frames		= None	# [(<frame>,[(<descr>,<op>,<request>),...]),...]
+        self.compiler		= None	# The connector class that encoded the frames
+
+    def __len__( self ):
+        return len( self.operations )
+
+    def __repr__( self ):
+        return "<%s: %d operations in %s frames>" % (
+            self.__class__.__name__, len( self.operations ),
+            len( self.frames ) if self.frames is not None else "(unencoded)" )
+
+
+class lazy_reply( dotdict ):
+    """A device (eg. Logix) reply from an EtherNet/IP CIP CPF item, retaining only its raw 'input'
+    payload 'til any of its contents (eg. .status, .read_frag.data) are accessed; only then is it
+    decoded (in place) by the supplied dialect's parser.  Used by a client with lazy=True, to avoid
+    parsing replies that are only counted, forwarded (eg. by a routing UCMM) or discarded.
+
+    """
+    __slots__			= ( '_dialect', )
+
+    def __init__( self, request, dialect ):
+        super( lazy_reply, self ).__init__( request )
+        object.__setattr__( self, '_dialect', dialect )
+
+    def decode( self ):
+        """Parse the raw 'input' payload (if not already done); returns self."""
+        dialect			= self._dialect
+        if dialect is not None:
+            object.__setattr__( self, '_dialect', None ) # parser may access our (decoded) contents
+            with dialect.parser as machine:
+                with contextlib.closing( machine.run(
+                        source	= peekable( dict.__getitem__( self, 'input' )),
+                        data	= self )) as engine:
+                    for m,s in engine:
+                        pass
+                    assert machine.terminal, "No %r request in the EtherNet/IP CIP CPF frame: %r" % (
+                        dialect, dict.__getitem__( self, 'input' ))
+        return self
+
+    @property
+    def decoded( self ):
+        return self._dialect is None
+
+    def __getitem__( self, key ):
+        if key != 'input':
+            self.decode()
+        return super( lazy_reply, self ).__getitem__( key )
+
+    def iteritems( self, depth=None ):
+        return super( lazy_reply, self.decode() ).iteritems( depth=depth )
+
+    def pop( self, *args ):
+        return super( lazy_reply, self.decode() ).pop( *args )
+
+    def __len__( self ):
+        return super( lazy_reply, self.decode() ).__len__()
+
+    def __eq__( self, other ):
+        return super( lazy_reply, self.decode() ).__eq__( other )
+
+    def __ne__( self, other ):
+        return not self.__eq__( other )
+
+    __hash__			= None
+
+    def __repr__( self ):
+        return super( lazy_reply, self.decode() ).__repr__()
+
+    __str__			= __repr__
+
+    def __copy__( self ):
+        return dotdict( (k,copy.copy( v )) for k,v in dict.items( self.decode() ))
+
+    def __deepcopy__( self, memo ):
+        return dotdict( (k,copy.deepcopy( v, memo )) for k,v in dict.items( self.decode() ))
+
+
 class client( object ):
     """Establish a connection (within timeout), and Transmit request(s), and yield replies as
     available.  The request will fail (raise exception) if it cannot be sent within the specified
@@ -383,7 +556,7 @@ class client( object ):
     timeout_ticks		= defaults.timeout_ticks
 
     def __init__( self, host, port=None, timeout=None, dialect=None, profiler=None,
-                  udp=False, broadcast=False, source_address=None, configuration=None ):
+                  udp=False, broadcast=False, source_address=None, configuration=None, lazy=False ):
         """Connect to the EtherNet/IP client, waiting up to 'timeout' for a connection.  Avoid using
         the host OS platform default if 'host' is empty; this will be different on Mac OS-X, Linux,
         Windows, ...  So, for an empty host, we'll default to 'localhost'; this should be IPv4/IPv6
@@ -405,6 +578,9 @@ class client( object ):
         If host of None is provided, we'll load the default from 'Address' in the named
         'configuration' section.
 
+        If 'lazy', each device reply in a received EtherNet/IP frame's CIP CPF items is returned as
+        a lazy_reply, decoded only when its contents are accessed; see __next__.
+
         """
         # Bind to nothing by default (use default i'face as source address).  Otherwise, use the
         # specified interface (or the system default, specified by ''), and the specified port (or
@@ -425,8 +601,10 @@ class client( object ):
         self.addr		= str( host ),int( port ) # host may be ip_address; str-ingify...
         self.addr_connected	= not ( udp and broadcast )
         self.conn		= None
+        self.receiver		= None	# A network.receiver w/ a reusable buffer, for self.conn
         self.udp		= udp
         self.dialect		= dialect # May be (temporarily) changed
+        self.lazy		= lazy
         # If provided, we'll disable/enable a profiler around the I/O code, to avoid corrupting the
         # profile data with arbitrary I/O related delays
         self.profiler		= profiler
@@ -481,6 +659,7 @@ class client( object ):
                              self.addr[0], self.addr[1], exc )
 
         self.session		= None	# Not set w/in client class; set manually, or in derived class
+        self.capturing		= None	# If a list, cip_send captures encoded requests instead of sending
         self.source		= chainable()
         self.data		= None
         # Parsers
@@ -562,6 +741,11 @@ class client( object ):
         The response may not actually contain a payload, eg. if the EtherNet/IP header contains a
         non-zero status.
 
+        If self.lazy, parsing of the device replies in the CPF items is deferred; each is returned as
+        a lazy_reply, which is decoded only if/when its contents are accessed.  This is transparent
+        to collect/harvest, but avoids all parsing of the reply payloads for callers that only
+        forward or count them.
+
         TODO: Defer parsing of CPF items in response payload to caller; only the caller knows the
         corresponding request, and hence the correct CIP Object that knows how to parse the
         request's reply! For example, a "Forward Open" is known to the Connection_Manager @6/1,
@@ -588,10 +772,11 @@ class client( object ):
                 self.profiler.disable()
             try:
                 rcvd,addr	= self.recvfrom( timeout=0 )
-                log.info(
-                    "EtherNet/IP<--%16s:%-5s rcvd %5d: %r",
-                    addr[0] if addr else None, addr[1] if addr else None,
-                    len( rcvd ) if rcvd is not None else 0, rcvd )
+                if log.isEnabledFor( logging.INFO ):
+                    log.info(
+                        "EtherNet/IP<--%16s:%-5s rcvd %5d: %r",
+                        addr[0] if addr else None, addr[1] if addr else None,
+                        len( rcvd ) if rcvd is not None else 0, bytes( rcvd ) if rcvd is not None else None )
                 if rcvd is not None:
                     # Some input (or EOF); source is empty; chain the input and drop back into 
                     # the framer engine.  It will detect a no-progress condition on EOF.  If we
@@ -668,8 +853,15 @@ class client( object ):
                     "Response did not contain a recognized CIP send_data CPF item"
                 # A Connected/Unconnected Send that contained an encapsulated request (ie. not just a Get
                 # Attribute All).  Use the globally-defined cpppo.server.enip.client's dialect's
-                # (eg. logix.Logix) parser to parse the contents of the CIP payload's CPF items.
+                # (eg. logix.Logix) parser to parse the contents of the CIP payload's CPF items.  If
+                # lazy, defer this 'til the request's contents are actually accessed.
                 dialect		= self.dialect or device.dialect # May be (temporarily) changed
+                if self.lazy:
+                    if 'unconnected_send.request' in item:
+                        item.unconnected_send.request = lazy_reply( request, dialect )
+                    else:
+                        item.connection_data.request = lazy_reply( request, dialect )
+                    continue
                 with dialect.parser as machine:
                     with contextlib.closing( machine.run( # for pypy, where gc may delay destruction of generators
                             source	= peekable( request.input ),
@@ -686,12 +878,17 @@ class client( object ):
     next = __next__ # Python 2/3 compatibility
 
     def recvfrom( self, timeout=None ):
-        """Receive data (if any) and source address, if available within timeout."""
+        """Receive data (if any) and source address, if available within timeout.  The data is a
+        memoryview into this client's reusable receive buffer, valid only 'til the next recvfrom.
+
+        """
+        if self.receiver is None or self.receiver.conn is not self.conn:
+            self.receiver	= network.receiver( self.conn, size=defaults.recv_size )
         addr			= self.addr
         if self.addr_connected:
-            rcvd		= network.recv( self.conn, timeout=timeout )
+            rcvd		= self.receiver.recv( timeout=timeout )
         else:
-            rcvd,addr		= network.recvfrom( self.conn, timeout=timeout )
+            rcvd,addr		= self.receiver.recvfrom( timeout=timeout )
         return rcvd,addr
 
     def send( self, request, timeout=None ):
@@ -1198,6 +1395,10 @@ class client( object ):
                   len( data.input ) - len( data.enip.input ),
                   len( data.enip.input ), len( data.input ))
 
+        if self.capturing is not None:
+            self.capturing.append( data ) # Encoding a prepared poll set; don't send
+            return data
+
         if self.profiler:
             self.profiler.disable()
         try:
@@ -1304,6 +1505,65 @@ class connector( client ):
     def index_to_sender_context( self, index ):
         return str( index ).encode( 'iso-8859-1' )
 
+    def prepare( self, operations, fragment=False, multiple=0, fragment_size=None, **kwds ):
+        """Precompile a sequence of I/O operations into a prepared poll set of encoded EtherNet/IP
+        request frames, for repeated (eg. cyclic) issuing.  Nothing is sent.
+
+        """
+        prep			= prepared( operations, fragment=fragment, multiple=multiple,
+                                            fragment_size=fragment_size, **kwds )
+        self.prepared_encode( prep )
+        return prep
+
+    def prepared_encode( self, prep ):
+        """Encode the prepared poll set's operations into request frames, using this connector.  Each
+        frame is saved with the (<descr>,<op>,<request>) of each operation it carries.
+
+        """
+        operations		= prep.operations
+        if prep.fragment_size:
+            operations		= fragment_operations( operations, fragment_size=prep.fragment_size )
+        frames			= []
+        self.capturing		= []
+        try:
+            for idx,ctx,dsc,op,req in self.issue(
+                    operations=operations, fragment=prep.fragment, multiple=prep.multiple ):
+                if idx == len( frames ):
+                    frames.append( (self.capturing[idx].input,[]) )
+                frames[idx][1].append( (dsc,op,req) )
+        finally:
+            self.capturing	= None
+        prep.frames		= frames
+        prep.compiler		= self.__class__
+        log.detail( "Prepared %r", prep )
+
+    def prepared_patch( self, frame, sender_context ):
+        """Patch the encoded EtherNet/IP frame's session handle and sender_context, in place."""
+        struct.pack_into( '<I', frame, 4, self.session or 0 )
+        frame[12:20]		= format_context( sender_context )
+
+    def issue_prepared( self, prep, index=0, timeout=None ):
+        """Issue the prepared poll set's request frames (encoding them first, if necessary), yielding
+        the same (<index>,<context>,<descr>,<op>,<request>) sequence as issue.
+
+        """
+        if prep.frames is None or prep.compiler is not self.__class__:
+            self.prepared_encode( prep )
+        for frame,requests in prep.frames:
+            sender_context	= self.index_to_sender_context( index )
+            self.prepared_patch( frame, sender_context )
+            if self.profiler:
+                self.profiler.disable()
+            try:
+                self.send( frame, timeout=timeout )
+            finally:
+                if self.profiler:
+                    self.profiler.enable()
+            log.detail( "Sending %2d (Context %10r) prepared", len( requests ), sender_context )
+            for d,o,r in requests:
+                yield index,sender_context,d,o,r
+            index	       += 1
+
     def issue( self, operations, index=0, fragment=False, multiple=0, timeout=None ):
         """Issue a sequence of I/O operations, returning the corresponding sequence of:
         (<index>,<context>,<descr>,<op>,<request>).  If a non-zero 'multiple' is provided, bundle
@@ -1338,7 +1598,14 @@ class connector( client ):
         is an average [S]STRING, and for Get Attributes All is the maximum Multiple Service Packet
         size (so it isn't merged, by default)
 
+        If 'operations' is a prepared poll set, its precompiled request frames are issued instead
+        (its own fragment and multiple options apply).
+
         """
+        if isinstance( operations, prepared ):
+            for iss in self.issue_prepared( operations, index=index, timeout=timeout ):
+                yield iss
+            return
         sender_context		= self.index_to_sender_context( index )
         reqsiz = reqmin		= 68
         rpysiz = rpymin		= 68
@@ -1352,6 +1619,7 @@ class connector( client ):
             descr		= "Multi. " if multiple else "Single "
             begun		= misc.timer()
             method		= op.pop( 'method', 'write' if 'data' in op else 'read' )
+            fragmented		= op.pop( 'fragmented', None ) # see fragment_operations
             if method == 'write':
                 descr	       += "Write "
                 if 'offset' not in op:
@@ -1412,6 +1680,8 @@ class connector( client ):
                     rpyest	= multiple
             else:
                 assert False, "Unrecognized operation method %s: %r" % ( method, op )
+            if fragmented:
+                req.fragmented	= fragmented + ( op, ) # for reassemble; not part of the produced request
             elapsed		= misc.timer() - begun
             descr	       += '    ' if 'offset' not in op else 'Frag' if op['offset'] is not None else 'Tag '
             if 'path' in op:
@@ -1572,6 +1842,95 @@ class connector( client ):
                     idx, req_ctx, rpy_ctx, parser.enip_format( op ), parser.enip_format( req ), parser.enip_format( rpy ))
             yield idx,dsc,req,rpy,sts,val
 
+    def reassemble( self, harvested, timeout=None ):
+        """Recombine the harvested (<index>,<descr>,<request>,<reply>,<status>,<value>) records of
+        operations split by fragment_operations, yielding one record for each original operation.
+        All other records are re-yielded unchanged.
+
+        Each read fragment contributes exactly the number of elements it is responsible for (a reply
+        may carry more).  If a reply carries fewer (eg. the device's reply capacity is smaller than
+        the fragment_size), the gap must be re-read; we cannot issue more requests 'til all of the
+        pipelined requests are harvested, so this and all subsequent records are held back 'til
+        then.  The gaps are then filled with synchronous Read Tag Fragmented requests, and the held
+        records are yielded in order.  Only if a gap cannot be filled, the data up to the gap is
+        returned with a 0x06 (Partial Data) status, just as for an unfragmented Read Tag Fragmented.
+
+        If any fragment fails, its status and reply are returned, with a None value.  The <request>
+        yielded is the first fragment's (for writes, a copy augmented with all of the data
+        written), and the <reply> is the last fragment's.
+
+        """
+        def complete( idx, dsc, first, rpy, failed, pieces, short ):
+            for i,op in ( [] if failed else short ):
+                got,wanted	= pieces[i]
+                size		= parser.typed_data.datasize( tag_type=op['tag_type'] )
+                while len( got ) < wanted:
+                    gap		= dict( op, offset=op['offset'] + len( got ) * size,
+                                        data_size=( wanted - len( got )) * size )
+                    gap.pop( 'sender_context', None )
+                    (_,_,_,_,sts,val), = self.synchronous( operations=[ gap ], timeout=timeout )
+                    if sts not in (0x00,0x06) or not val:
+                        log.warning( "Failed to re-read %d element gap at offset %d; status %r: %s",
+                                     wanted - len( got ), gap['offset'], sts, dsc )
+                        break
+                    got.extend( val[:wanted - len( got )] )
+            partial		= False
+            data		= []
+            if failed:
+                sts,rpy		= failed
+                val		= None
+            elif 'write_frag' in first:
+                # Don't alter the (possibly prepared, and hence re-issued) fragment's request
+                for piece,_ in pieces:
+                    data.extend( piece )
+                first		= dotdict( first )
+                first.write_frag= dotdict( first.write_frag )
+                first.write_frag.data = data
+                sts,val		= 0x00,True
+            else:
+                for piece,wanted in pieces:
+                    data.extend( piece )
+                    if len( piece ) < wanted:
+                        partial	= True
+                        break
+                sts,val		= 0x06 if partial else 0x00,data
+            log.detail( "Reassembled %d fragments: %s", len( pieces ), dsc )
+            return idx,dsc,first,rpy,sts,val
+
+        held			= []	# records held behind any short read fragment, 'til harvested
+        for idx,dsc,req,rpy,sts,val in harvested:
+            fragmented		= req.get( 'fragmented' )
+            if not fragmented:
+                if held:
+                    held.append( ((idx,dsc,req,rpy,sts,val),None) )
+                else:
+                    yield idx,dsc,req,rpy,sts,val
+                continue
+            index,count,elements,op = fragmented
+            if index == 0:
+                first,failed	= req,None
+                pieces		= []	# [(<data>,<elements>),...] from each fragment
+                short		= []	# [(<piece>,<op>),...] of any short read fragments
+            if failed is None:
+                if sts not in (0x00,0x06) or val is None:
+                    failed	= sts,rpy
+                elif 'write_frag' in req:
+                    pieces.append( (req.write_frag.data,elements) )
+                else:
+                    pieces.append( (list( val[:elements] ),elements) )
+                    if len( val ) < elements:
+                        short.append( (len( pieces ) - 1,op) )
+            if index + 1 < count:
+                continue
+            pending			= (idx,dsc,first,rpy,failed,pieces,short)
+            if held or ( short and not failed ):
+                held.append( (None,pending) )
+            else:
+                yield complete( *pending )
+
+        for record,pending in held:
+            yield record if pending is None else complete( *pending )
+
     # 
     # synchronous
     # pipeline
@@ -1757,11 +2116,16 @@ class connector( client ):
     # sequences, and simply returns the number of (<failures>,<transactions>), optionally printing a
     # summary of I/O performed.
     # 
-    def operate( self, operations, depth=0, printing=False, validating=False, **kwds ):
+    def operate( self, operations, depth=0, printing=False, validating=False, fragment_size=None, **kwds ):
         """Operate on a sequence of I/O operations, yielding the details.  If a non-zero 'depth' is
         specified, then pipeline the requests allowing 'depth' outstanding transactions to be
         in-flight; otherwise, we just issue the transactions synchronously.
 
+        If a non-zero 'fragment_size' is specified, any large Read/Write Tag operations of known
+        type and size are split into Read/Write Tag Fragmented requests of that size (see
+        fragment_operations), which are pipelined to 'depth', and reassembled in order.  The
+        'operations' may be a prepared poll set (see prepare); its own fragment_size applies.
+
         If 'printing' or 'validating' is requested, uses self.validate to log/print a summary of I/O
         operations (and also fills in the yielded value written for successful Write Tag
         [Fragmented] requests, instead of just signalling success using True).
@@ -1769,10 +2133,16 @@ class connector( client ):
         Raises Exception on catastrophic failure of the connection.
 
         """
+        if isinstance( operations, prepared ):
+            fragment_size	= operations.fragment_size # already fragmented when encoded
+        elif fragment_size:
+            operations		= fragment_operations( operations, fragment_size=fragment_size )
         if depth:
             harvested		= self.pipeline( operations=operations, depth=depth, **kwds )
         else:
             harvested		= self.synchronous( operations=operations, **kwds )
+        if fragment_size:
+            harvested		= self.reassemble( harvested, timeout=kwds.get( 'timeout' ))
         if printing or validating:
             harvested		= self.validate( harvested=harvested, printing=printing )
         for idx,dsc,req,rpy,sts,val in harvested:
@@ -2003,6 +2373,25 @@ class implicit( connector ):
         return super( implicit, self ).connected_send(
             request, connection=connection, sequence=sequence, **kwds )
 
+    def prepared_patch( self, frame, sender_context ):
+        """A prepared SendUnitData frame (see connected_send) must also carry the established Forward
+        Open O_T connection ID (which may differ, if re-connected), and the next sequence number for
+        that connection.  The 0x00a1 connection ID is at byte 36, and the 0x00b1 sequence at byte 44
+        of the frame (after the 24-byte EtherNet/IP header, and the CPF interface, timeout, item
+        count and item headers).
+
+        """
+        super( implicit, self ).prepared_patch( frame, sender_context )
+        command,		= struct.unpack_from( '<H', frame, 0 )
+        if command != 0x0070:
+            return # an arbitrarily routed SendRRData request (see req_send)
+        connection		= self.established.forward_open.O_T.connection_ID
+        sequence		= self.seqs.get( connection, -1 ) + 1
+        sequence	       %= 2**16
+        self.seqs[connection]	= sequence
+        struct.pack_into( '<I', frame, 36, connection )
+        struct.pack_into( '<H', frame, 44, sequence )
+
     def req_send( self, request, route_path=None, send_path=None, **kwds ):
         """Sending a request on a client connector/implicit connection requires the use of the appropriate
         encapsulation.  An implicit connection normally uses a connected_send "Send Unit Data".
@@ -2124,6 +2513,10 @@ which is required to carry this Send/Route Path data. """ )
     ap.add_argument( '-f', '--fragment', dest='fragment', action='store_true',
                      default=False,
                      help="Always use Read/Write Tag Fragmented requests (default: False)" )
+    ap.add_argument( '-F', '--fragment-size',
+                     default=None,
+                     help="Split large typed Read/Write Tag requests (eg. Tag[0-999](DINT)) into pipelined fragments of this size (default: None, eg. %d)" % (
+                         defaults.fragment_size ))
     ap.add_argument( '-s', '--list-services', action='store_true',
                      default=False,
                      help="Perform a CIP List Services request upon connection (default: False)" )
@@ -2171,6 +2564,7 @@ which is required to carry this Send/Route Path data. """ )
     depth			= int( args.depth )
     multiple			= 500 if args.multiple else 0
     fragment			= bool( args.fragment )
+    fragment_size		= int( args.fragment_size ) if args.fragment_size else None
     printing			= args.print
     # route_path may be None/0/False/'[]', send_path may be None/''/'@2/1'.  -S|--simple designates
     # '[]', '' respectively, appropriate for non-routing CIP devices, eg. MicroLogix, PowerFlex, ...
@@ -2255,7 +2649,7 @@ which is required to carry this Send/Route Path data. """ )
                 timeout_ticks=timeout_ticks, priority_time_tick=priority_time_tick )
             failed,transactions	= connection.process(
                 operations=operations, depth=depth, multiple=multiple,
-                fragment=fragment, printing=printing, timeout=timeout )
+                fragment=fragment, fragment_size=fragment_size, printing=printing, timeout=timeout )
             failures	       += failed
             elapsed		= misc.timer() - begun
             if transactions: # May be [], if from stdin, and no operations provided
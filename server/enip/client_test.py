@@ -408,3 +408,225 @@ def test_client_api_random():
             address_delay= 5.0,
         )
     assert failed == 0
+
+
+def test_client_fragment_operations():
+    """Large typed Read/Write Tag operations are split into Fragmented requests w/ precomputed offsets."""
+    ops				= list( enip.client.fragment_operations( [
+        { 'path': 'Big[0-299]', 'elements': 300, 'tag_type': enip.DINT.tag_type },
+        { 'path': 'Big[0-299]', 'elements': 300, 'offset': 400, 'tag_type': enip.DINT.tag_type },
+        { 'path': 'Big[0-9]', 'elements': 10, 'tag_type': enip.DINT.tag_type },
+        { 'path': 'Big[0-299]', 'elements': 300 },
+        { 'path': 'Big[0-299]', 'data': list( range( 300 )), 'elements': 300, 'tag_type': enip.INT.tag_type },
+    ], fragment_size=400 ))
+    # 300 DINTs @ 100/fragment
+    assert [ (o['offset'],o['fragmented'],o['data_size']) for o in ops[:3] ] \
+        == [ (0,(0,3,100),400), (400,(1,3,100),400), (800,(2,3,100),400) ]
+    # 200 remaining DINTs, after a 400 byte (100 element) offset
+    assert [ (o['offset'],o['fragmented']) for o in ops[3:5] ] \
+        == [ (400,(0,2,100)), (800,(1,2,100)) ]
+    # small, and untyped operations are passed thru
+    assert 'fragmented' not in ops[5] and 'fragmented' not in ops[6]
+    # 300 INTs @ 200/fragment
+    assert [ (o['offset'],o['elements'],o['data']) for o in ops[7:] ] \
+        == [ (0,300,list( range( 200 ))), (400,300,list( range( 200, 300 ))) ]
+
+    # A read's Tag type may be supplied as a trailing (TYPE), allowing it to be fragmented; it is also
+    # the default type of any write data
+    ops				= list( enip.client.fragment_operations( enip.client.parse_operations( [
+        'Big[0-299](DINT)', 'Big[0-2](REAL)=1,2,3', 'Big[0-299]',
+    ] ), fragment_size=400 ))
+    assert [ (o['offset'],o['fragmented'],o['data_size']) for o in ops[:3] ] \
+        == [ (0,(0,3,100),400), (400,(1,3,100),400), (800,(2,3,100),400) ]
+    assert ops[3]['tag_type'] == enip.REAL.tag_type and ops[3]['data'] == [1.0,2.0,3.0]
+    assert 'fragmented' not in ops[4] and 'tag_type' not in ops[4]
+
+
+def test_client_api_fragmented():
+    """Pipeline Read/Write Tag Fragmented requests for a large Tag, and reassemble the results."""
+    taglen			= 1000
+    server_addr		        = ('localhost', 12399)
+    server_kwds			= dotdict({
+        'argv': [
+            '-v',
+            '--address',	'%s:%d' % server_addr,
+            'Big=DINT[%d]' % ( taglen ),
+        ],
+        'server': {
+            'control':	apidict( enip.timeout, {
+                'done': False
+            }),
+        },
+    })
+    server_func			= enip_main
+    server			= threading.Thread( target=server_func, kwargs=server_kwds )
+    server.daemon		= True
+    server.start()
+
+    try:
+        connection		= None
+        while not connection:
+            time.sleep( .1 )
+            try:
+                connection	= enip.client.connector( *server_addr, timeout=5.0 )
+            except socket.error as exc:
+                if exc.errno != errno.ECONNREFUSED:
+                    raise
+
+        with connection:
+            data		= list( range( taglen ))
+            written		= list( connection.operate( [{
+                'path': 'Big[0-%d]' % ( taglen - 1 ), 'data': data, 'tag_type': enip.DINT.tag_type,
+            }], depth=10, fragment_size=400, timeout=5.0 ))
+            assert len( written ) == 1
+            idx,dsc,req,rpy,sts,val = written[0]
+            assert sts == 0 and val is True and req.write_frag.data == data
+            assert idx == 9 # 1000 DINTs / 100 per fragment
+
+            read		= list( connection.operate( [{
+                'path': 'Big[0-%d]' % ( taglen - 1 ), 'elements': taglen, 'tag_type': enip.DINT.tag_type,
+            }], depth=10, fragment_size=400, timeout=5.0 ))
+            assert len( read ) == 1
+            idx,dsc,req,rpy,sts,val = read[0]
+            assert sts == 0 and val == data
+
+            # The simulator replies with at most Logix.MAX_BYTES (488 bytes; 122 DINTs) per request,
+            # so 800 byte fragments (200 DINTs) are each short; the gaps are re-read.  Any following
+            # operations are held back 'til then, and are yielded in order.
+            read		= list( connection.operate( enip.client.parse_operations( [
+                'Big[0-%d](DINT)' % ( taglen - 1 ), 'Big[5]', 'Big[10-19](DINT)',
+            ] ), depth=10, fragment_size=800, timeout=5.0 ))
+            assert [ (sts,val) for idx,dsc,req,rpy,sts,val in read ] \
+                == [ (0,data), (0,[5]), (0,data[10:20]) ]
+    finally:
+        control			= server_kwds.get( 'server', {} ).get( 'control', {} ) if server_kwds else {}
+        if 'done' in control:
+            control['done']	= True
+        server.join( timeout=1.0 )
+
+
+def test_client_api_prepared():
+    """Precompile a poll set once, and re-issue it repeatedly over both explicit and implicit
+    (connected) sessions; the session, sender_context (and connection ID/sequence) are patched into
+    the cached frames for each cycle.  A prepared, fragmented Write must not accumulate data (or
+    corrupt its cached requests) across cycles.
+
+    """
+    server_addr		        = ('localhost', 12400)
+    server_kwds			= dotdict({
+        'argv': [
+            '-v',
+            '--address',	'%s:%d' % server_addr,
+            'PInt@0x9a/1/1=INT[100]',
+            'PReal@0x9a/1/2=REAL[10]',
+            'PBig=DINT[300]',
+        ],
+        'server': {
+            'control':	apidict( enip.timeout, {
+                'done': False
+            }),
+        },
+    })
+    server_func			= enip_main
+    server			= threading.Thread( target=server_func, kwargs=server_kwds )
+    server.daemon		= True
+    server.start()
+
+    try:
+        for cls,kwds in [
+                ( enip.client.connector, {} ),
+                ( enip.client.implicit, { 'connection_path': None } ),
+        ]:
+            connection		= None
+            while not connection:
+                time.sleep( .1 )
+                try:
+                    connection	= cls( *server_addr, timeout=5.0, **kwds )
+                except socket.error as exc:
+                    if exc.errno != errno.ECONNREFUSED:
+                        raise
+
+            with connection:
+                list( connection.operate(
+                    enip.client.parse_operations( [ 'PInt[0-3]=(INT)1,2,3,4', 'PReal[1]=(REAL)1.5' ] ),
+                    timeout=5.0 ))
+                prep		= connection.prepare(
+                    enip.client.parse_operations( [ 'PInt[0-3]', 'PInt[2]', 'PReal[1]' ] ), multiple=200 )
+                assert len( prep ) == 3 and len( prep.frames ) == 1 # all in one Multiple
+                for _ in range( 3 ):
+                    results	= list( connection.operate( prep, depth=2, timeout=5.0 ))
+                    assert [ val for idx,dsc,req,rpy,sts,val in results ] == [ [1,2,3,4], [3], [1.5] ]
+
+                data		= list( range( 300 ))
+                write		= connection.prepare( [{
+                    'path': 'PBig[0-299]', 'data': data, 'tag_type': enip.DINT.tag_type,
+                }], fragment_size=400 )
+                assert len( write.frames ) == 3 # 100 DINTs per fragment
+                for _ in range( 3 ):
+                    results	= list( connection.operate( write, depth=3, validating=True, timeout=5.0 ))
+                    assert len( results ) == 1
+                    idx,dsc,req,rpy,sts,val = results[0]
+                    assert sts == 0 and val == data and req.write_frag.data == data
+                    assert [ len( r.write_frag.data ) for _,reqs in write.frames for d,o,r in reqs ] \
+                        == [ 100, 100, 100 ]
+    finally:
+        control			= server_kwds.get( 'server', {} ).get( 'control', {} ) if server_kwds else {}
+        if 'done' in control:
+            control['done']	= True
+        server.join( timeout=1.0 )
+
+
+def test_client_api_lazy():
+    """A lazy client defers decoding each reply 'til its contents are accessed; transparently to
+    collect/harvest (and hence operate, etc.)
+
+    """
+    server_addr		        = ('localhost', 12402)
+    server_kwds			= dotdict({
+        'argv': [
+            '-v',
+            '--address',	'%s:%d' % server_addr,
+            'LInt=INT[10]',
+        ],
+        'server': {
+            'control':	apidict( enip.timeout, {
+                'done': False
+            }),
+        },
+    })
+    server_func			= enip_main
+    server			= threading.Thread( target=server_func, kwargs=server_kwds )
+    server.daemon		= True
+    server.start()
+
+    try:
+        connection		= None
+        while not connection:
+            time.sleep( .1 )
+            try:
+                connection	= enip.client.connector( *server_addr, timeout=5.0, lazy=True )
+            except socket.error as exc:
+                if exc.errno != errno.ECONNREFUSED:
+                    raise
+
+        with connection:
+            results		= list( connection.operate( enip.client.parse_operations(
+                [ 'LInt[0-2]=(INT)1,2,3', 'LInt[1-2]', 'LInt[9]' ] ), multiple=200, depth=2, timeout=5.0 ))
+            assert [ val for idx,dsc,req,rpy,sts,val in results ] == [ True, [2,3], [0] ]
+
+            # Only the raw reply is available 'til its contents are accessed
+            connection.read( path='LInt[0-1]' )
+            assert connection.readable( timeout=5.0 )
+            rpy			= None
+            while rpy is None:
+                rpy		= next( connection )
+            request		= rpy.enip.CIP.send_data.CPF.item[1].unconnected_send.request
+            assert isinstance( request, enip.client.lazy_reply ) and not request.decoded
+            assert len( request.input ) and not request.decoded
+            assert request.status == 0 and request.decoded
+            assert request.read_frag.data == [1,2]
+    finally:
+        control			= server_kwds.get( 'server', {} ).get( 'control', {} ) if server_kwds else {}
+        if 'done' in control:
+            control['done']	= True
+        server.join( timeout=1.0 )
@@ -27,7 +27,7 @@ enip.defaults -- System-wide default (global) values
 """
 __all__				= [ 'latency', 'timeout', 'address',
                                     'route_path_default', 'send_path_default',
-                                    'priority_time_tick', 'timeout_ticks',
+                                    'priority_time_tick', 'timeout_ticks', 'fragment_size', 'recv_size',
                                     'config_name', 'config_files', 'config_open', 'config_open_deduced', 'ConfigNotFoundError',
                                     'forward_open_default' ]
 
@@ -50,6 +50,12 @@ send_path_default		= '@6/1'	# Connection Manager
 priority_time_tick		= 5		#  2**5 == 32ms/tick See: Vol 3.15, 3-5.5.1.4 Connection Timing
 timeout_ticks			= 157		#  157 * 32 == 5.024s
 
+# Read/Write Tag Fragmented payload bytes per fragment; fits in a (small) Unconnected reply
+fragment_size			= 488
+
+# Size of each connection's reusable receive buffer; large replies arrive in few recv_into chunks
+recv_size			= 64*1024
+
 # Define the default paths used for configuration files, etc.
 config_name			= 'cpppo.cfg'	# Default Cpppo application configuration file
 
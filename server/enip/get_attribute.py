@@ -26,7 +26,8 @@ __email__                       = "perry@hardconsulting.com"
 __copyright__                   = "Copyright (c) 2013 Hard Consulting Corporation"
 __license__                     = "Dual License: GPLv3 (or later) and Commercial (see LICENSE)"
 
-__all__				= ['attribute_operations', 'proxy', 'proxy_simple', 'proxy_connected', 'main']
+__all__				= ['attribute_operations', 'proxy', 'proxy_simple', 'proxy_connected',
+				   'pooled', 'proxy_pooled', 'proxy_connected_pooled', 'main']
 
 
 """Get Attributes (Single/All) interface from a target EtherNet/IP CIP device.
@@ -255,7 +256,7 @@ class proxy( object ):
     def __init__( self, host, port=44818, timeout=None, depth=None, multiple=None,
                   gateway_class=None, route_path=None, send_path=None,
                   priority_time_tick=None, timeout_ticks=None,
-                  identity_default=None, dialect=None, operations_parser=None,
+                  identity_default=None, dialect=None, operations_parser=None, fragment_size=None,
                   **gateway_kwds ):
         """Capture the desired I/O parameters for the target CIP Device.
 
@@ -264,6 +265,10 @@ class proxy( object ):
         product_name == 'Some Product Name', to avoid this initial List Identity request
         (self.identity it will still be updated if .list_identity is invoked successfully).
 
+        If a 'fragment_size' is supplied, large Read/Write Tag operations of known type (eg. via an
+        operations_parser of client.parse_operations, and a specified CIP type) are split into
+        Read/Write Tag Fragmented requests, pipelined to 'depth' and reassembled.
+
         """
         self.host		= host
         self.port		= port
@@ -285,6 +290,7 @@ class proxy( object ):
         self.identity		= identity_default
         self.dialect		= dialect
         self.operations_parser	= operations_parser
+        self.fragment_size	= fragment_size
 
     def __str__( self ):
         return "%s at %s" % ( self.identity.product_name if self.identity else None, self.gateway )
@@ -414,6 +420,71 @@ class proxy( object ):
                         return True
         return False
 
+    def read_operations( self, attributes ):
+        """Generate sequence containing the enip.client operation, and the original attribute
+        specified, its type(s) (if any), and any description.  Augment produced operation with
+        data type (if known), to allow estimation of reply sizes (and hence, Multiple Service
+        Packet use); requires cpppo>=3.8.1.
+
+        Yields: (opp,(att,typ,dsc))
+
+        """
+        for a in attributes:
+            assert self.is_request( a ), \
+                "Not a valid read/write target: %r" % ( a, )
+            try:
+                # The attribute description is either a plain Tag, an (address, type), or an
+                # (address, type, description)
+                if is_listlike( a ):
+                    att,typ,uni = a if len( a ) == 3 else a+(None,)
+                else:
+                    att,typ,uni = a,None,None
+                # No conversion of data type if None; use a Read Tag [Fragmented]; works only
+                # for [S]STRING/SINT/INT/DINT/REAL/BOOL.  Otherwise, conversion of data type
+                # desired; get raw data using Get Attribute Single.
+                parser	= self.operations_parser or ( client.parse_operations if typ is None
+                                                          else attribute_operations )
+                opp,	= parser( ( att, ), route_path=device.parse_route_path( self.route_path ),
+                                      send_path=self.send_path, priority_time_tick=self.priority_time_tick,
+                                      timeout_ticks=self.timeout_ticks )
+            except Exception as exc:
+                log.warning( "Failed to parse attribute %r; %s", a, exc )
+                raise
+            # For read_tag.../get_attribute..., tag_type is never required; but, it is used (if
+            # provided) to estimate data sizes for Multiple Service Packets.  For
+            # write_tag.../set_attribute..., the data has specified its data type, if not the
+            # default (INT for write_tag, SINT for set_attribute).
+            if typ is not None and not is_listlike( typ ) and 'tag_type' not in opp:
+                t		= typ
+                if isinstance( typ, type_str_base ):
+                    td	= self.CIP_TYPES.get( t.strip().lower() )
+                    if td is not None:
+                        t,d	= td
+                if hasattr( t, 'tag_type' ):
+                    opp['tag_type'] = t.tag_type
+
+            log.detail( "Parsed attribute %r (type %r) into operation: %r", att, typ, opp )
+            yield opp,(att,typ,uni)
+
+    def prepare( self, attributes ):
+        """Parse the attributes (after any parameter_substitution) once, into a client.prepared poll
+        set which may be supplied to read/read_details (or poll.run's params) on every cycle.  The
+        EtherNet/IP request frames are encoded by the gateway the first time the poll set is read;
+        thereafter, only the session, sender_context (and for Implicit connections, the connection
+        ID and sequence) are patched before sending.  No I/O is performed here.  The supplied
+        attributes are retained as the poll set's 'params'.
+
+        """
+        if isinstance( attributes, type_str_base ):
+            attributes		= [ attributes ]
+        attributes		= list( attributes )
+        operations,details	= [],[]
+        for opp,det in self.read_operations( attributes ):
+            operations.append( opp )
+            details.append( det )
+        return client.prepared( operations, multiple=self.multiple, fragment_size=self.fragment_size,
+                                details=details, params=attributes )
+
     @maintain_gateway
     def read( self, attributes, printing=False, checking=False ):
         """Yields all values, raising Exception at end if any failed.  This is the main external API;
@@ -535,52 +606,6 @@ class proxy( object ):
         if isinstance( attributes, type_str_base ):
             attributes		= [ attributes ]
 
-        def opp__att_typ_uni( i ):
-            """Generate sequence containing the enip.client operation, and the original attribute
-            specified, its type(s) (if any), and any description.  Augment produced operation with
-            data type (if known), to allow estimation of reply sizes (and hence, Multiple Service
-            Packet use); requires cpppo>=3.8.1.
-
-            Yields: (opp,(att,typ,dsc))
-
-            """
-            for a in i:
-                assert self.is_request( a ), \
-                    "Not a valid read/write target: %r" % ( a, )
-                try:
-                    # The attribute description is either a plain Tag, an (address, type), or an
-                    # (address, type, description)
-                    if is_listlike( a ):
-                        att,typ,uni = a if len( a ) == 3 else a+(None,)
-                    else:
-                        att,typ,uni = a,None,None
-                    # No conversion of data type if None; use a Read Tag [Fragmented]; works only
-                    # for [S]STRING/SINT/INT/DINT/REAL/BOOL.  Otherwise, conversion of data type
-                    # desired; get raw data using Get Attribute Single.
-                    parser	= self.operations_parser or ( client.parse_operations if typ is None
-                                                              else attribute_operations )
-                    opp,	= parser( ( att, ), route_path=device.parse_route_path( self.route_path ),
-                                          send_path=self.send_path, priority_time_tick=self.priority_time_tick,
-                                          timeout_ticks=self.timeout_ticks )
-                except Exception as exc:
-                    log.warning( "Failed to parse attribute %r; %s", a, exc )
-                    raise
-                # For read_tag.../get_attribute..., tag_type is never required; but, it is used (if
-                # provided) to estimate data sizes for Multiple Service Packets.  For
-                # write_tag.../set_attribute..., the data has specified its data type, if not the
-                # default (INT for write_tag, SINT for set_attribute).
-                if typ is not None and not is_listlike( typ ) and 'tag_type' not in opp:
-                    t		= typ
-                    if isinstance( typ, type_str_base ):
-                        td	= self.CIP_TYPES.get( t.strip().lower() )
-                        if td is not None:
-                            t,d	= td
-                    if hasattr( t, 'tag_type' ):
-                        opp['tag_type'] = t.tag_type
-
-                log.detail( "Parsed attribute %r (type %r) into operation: %r", att, typ, opp )
-                yield opp,(att,typ,uni)
-
         def types_decode( types ):
             """Produce a sequence of type class,data-path, eg. (parser.REAL,"SSTRING.string").  If a
             user-supplied type (or None) is provided, data-path is None, and the type is passed.
@@ -604,8 +629,13 @@ class proxy( object ):
                 yield t,d
 
         # Get duplicate streams; one to feed the the enip.client's connector.operate, and one for
-        # post-processing based on the declared type(s).
-        operations,attrtypes	= itertools.tee( opp__att_typ_uni( attributes ))
+        # post-processing based on the declared type(s).  A prepared poll set already has both.
+        if isinstance( attributes, client.prepared ):
+            operations		= attributes
+            attrtypes		= zip( attributes.operations, attributes.details )
+        else:
+            operations,attrtypes= itertools.tee( self.read_operations( attributes ))
+            operations		= ( opr for opr,_ in operations )
 
         # Process all requests w/ the specified pipeline depth, Multiple Service Packet
         # configuration.  The 'idx' is the EtherNet/IP CIP request packet index; 'i' is the
@@ -625,16 +655,20 @@ class proxy( object ):
           try:
             log.info( "Operating gateway %r connection, after blocking %7.3fs", self.gateway, polling - blocked )
             for i,(idx,dsc,req,rpy,sts,val) in enumerate( connection.operate(
-                    ( opr for opr,_ in operations ),
-                    depth=self.depth, multiple=self.multiple, timeout=self.timeout )):
+                    operations,
+                    depth=self.depth, multiple=self.multiple, fragment_size=self.fragment_size,
+                    timeout=self.timeout )):
                 log.detail( "%3d (pkt %3d) %16s %-12s: %r %s", 
                                 i, idx, dsc, sts or "OK", val,
                             repr( rpy ) if log.isEnabledFor( logging.INFO ) else '' )
                 opr,(att,typ,uni) = next( attrtypes )
-                if typ is None or sts not in (0,6) or val in (True,None):
+                # Read Tag [Fragmented] replies of simple CIP types (and their reassembled fragments)
+                # are already decoded; a STRUCT's raw USINT data still needs parsing w/ the desired typ
+                typ_num		= rpy.get( 'read_tag.type' ) or rpy.get( 'read_frag.type' )
+                if ( typ is None or sts not in (0,6) or val in (True,None)
+                     or typ_num not in (None,parser.STRUCT.tag_type) ):
                     # No type conversion; just return whatever type produced by Read Tag
                     # [Fragmented] (always a single CIP type parser).
-                    typ_num	= rpy.get( 'read_tag.type' ) or rpy.get( 'read_frag.type' )
                     if typ_num:
                         try:
                             (typ_prs,_), = types_decode( typ_num )
@@ -736,6 +770,218 @@ class proxy_connected( proxy ):
         self.send_path		= ''
 
 
+class pooled( object ):
+    """A mixin for a proxy (or proxy_simple, proxy_connected), which maintains a pool of up to
+    'pool_size' gateways (registered EtherNet/IP sessions, or Forward Open "Connected" sessions via
+    a proxy_connected) to the target CIP device, shared by all the Threads using the proxy.
+
+    Each Thread using the proxy checks out its own gateway for the duration of each I/O transaction
+    (eg. via its context manager API, a .read, or for the duration of the .read_details generator);
+    self.gateway is the gateway checked out by the current Thread.  A Thread awaits an idle gateway
+    (for up to the proxy's 'timeout'), if 'pool_size' gateways are already in use by other Threads.
+
+    Gateways are opened lazily, as needed.  An Exception closes only the gateway checked out by that
+    Thread; it is transparently re-opened when next required.  Idle gateways unused for longer than
+    'idle_timeout' are closed upon the next checkout, as are any idle gateways found to have input
+    (or EOF) pending, eg. due to a delayed response or the device closing the session.
+
+    Pool statistics are available via the .pool_stats property.  Since a client.prepared poll set's
+    request frames are patched with each gateway's session before sending, a prepared poll set must
+    not be read concurrently by multiple Threads.
+
+        class pooled_sensor( pooled, proxy_simple ):
+            ...
+
+    """
+    def __init__( self, *args, **kwds ):
+        pool_size		= kwds.pop( 'pool_size', None )
+        idle_timeout		= kwds.pop( 'idle_timeout', None )
+        self.pool_size		= 4 if pool_size is None else pool_size
+        self.idle_timeout	= 60.0 if idle_timeout is None else idle_timeout
+        assert self.pool_size > 0, \
+            "A proxy's pool_size must be at least 1"
+        self.pool_local		= threading.local() # this Thread's checked-out gateway and depth
+        self.pool_ready		= threading.Condition()
+        self.pool_idle		= []		# [(<gateway>,<released>), ...], most recently used last
+        self.pool_count		= 0		# gateways open, idle or being opened
+        self.pool_counts	= dotdict(
+            created	= 0,
+            closed	= 0,
+            expired	= 0,
+            unhealthy	= 0,
+            checkouts	= 0,
+            waits	= 0,
+            waited	= 0.0,
+        )
+        super( pooled, self ).__init__( *args, **kwds )
+
+    @property
+    def gateway( self ):
+        """The gateway checked out by the current Thread (if any)."""
+        return getattr( self.pool_local, 'gateway', None )
+
+    @gateway.setter
+    def gateway( self, gateway ):
+        self.pool_local.gateway	= gateway
+
+    @property
+    def pool_stats( self ):
+        """A snapshot of the pool's current state and cumulative statistics."""
+        with self.pool_ready:
+            stats		= dotdict( self.pool_counts )
+            stats.size		= self.pool_size
+            stats.sessions	= self.pool_count
+            stats.idle		= len( self.pool_idle )
+            stats.busy		= self.pool_count - len( self.pool_idle )
+        return stats
+
+    def __enter__( self ):
+        """Checks out a gateway for this Thread (opening one, if necessary)."""
+        self.pool_checkout()
+        return self
+
+    def __exit__( self, typ, val, tbk ):
+        """Returns this Thread's gateway to the pool, or closes it if an Exception occurs.  A
+        GeneratorExit (eg. a .read_details generator closed after its last result) is not a failure."""
+        self.pool_release( exc=val if typ is not None and not issubclass( typ, GeneratorExit ) else None )
+        return False
+
+    def pool_healthy( self, gateway ):
+        """An idle gateway should have nothing to receive; any input (or EOF) indicates a delayed
+        response or a closed session, so the gateway is unusable."""
+        try:
+            return not gateway.readable( timeout=0 )
+        except Exception as exc:
+            log.info( "Idle EtherNet/IP CIP gateway %r failed health check: %s", gateway, exc )
+            return False
+
+    def pool_discard( self, gateway, reason ):
+        """Close an idle gateway; must hold self.pool_ready."""
+        try:
+            gateway.close()
+        except Exception as exc:
+            log.info( "Closing %s EtherNet/IP CIP gateway %r failed: %s", reason, gateway, exc )
+        self.pool_count	       -= 1
+        self.pool_counts.closed += 1
+        self.pool_counts[reason] += 1
+        log.normal( "Closed %s EtherNet/IP CIP gateway %r", reason, gateway )
+
+    def pool_acquire( self ):
+        """Return an idle healthy gateway, or None if this Thread has reserved a place in the pool to
+        open a new one.  Awaits a gateway released by another Thread, for up to self.timeout."""
+        blocked			= timer()
+        with self.pool_ready:
+            self.pool_counts.checkouts += 1
+            waiting		= False
+            while True:
+                now		= timer()
+                idle		= []
+                for gateway,released in self.pool_idle:
+                    if self.idle_timeout is not None and now - released > self.idle_timeout:
+                        self.pool_discard( gateway, 'expired' )
+                    else:
+                        idle.append( (gateway,released) )
+                self.pool_idle	= idle
+                while self.pool_idle:
+                    gateway,_	= self.pool_idle.pop()
+                    if self.pool_healthy( gateway ):
+                        return gateway
+                    self.pool_discard( gateway, 'unhealthy' )
+                if self.pool_count < self.pool_size:
+                    self.pool_count += 1
+                    return None
+                if not waiting:
+                    self.pool_counts.waits += 1
+                    waiting	= True
+                remains		= self.timeout - ( now - blocked )
+                assert remains > 0, \
+                    "Failed to acquire one of %d pooled EtherNet/IP CIP gateways within %r" % (
+                        self.pool_size, self.timeout )
+                try:
+                    self.pool_ready.wait( remains )
+                finally:
+                    self.pool_counts.waited += timer() - now
+
+    def pool_checkout( self ):
+        """Check out a gateway for this Thread, unless it already holds one.  Lazily opens a new
+        gateway, if no idle one is available and the pool isn't full."""
+        depth			= getattr( self.pool_local, 'depth', 0 )
+        self.pool_local.depth	= depth + 1
+        if depth:
+            return
+        self.pool_local.counted	= False
+        try:
+            self.gateway	= self.pool_acquire()
+            self.pool_local.counted = True
+            if self.gateway is None:
+                self.open_gateway()
+                with self.pool_ready:
+                    self.pool_counts.created += 1
+        except:
+            self.pool_local.depth = depth
+            if self.pool_local.counted:
+                # Failed to open (or close_gateway has already been invoked); release our place
+                self.pool_local.counted = False
+                with self.pool_ready:
+                    self.pool_count -= 1
+                    self.pool_ready.notify()
+            raise
+
+    def pool_release( self, exc=None ):
+        """Release this Thread's gateway back to the pool, or close it if an Exception occurred."""
+        self.pool_local.depth  -= 1
+        if self.pool_local.depth:
+            return
+        if exc is not None:
+            self.close_gateway( exc=exc )
+        gateway			= self.gateway
+        if gateway is not None:
+            self.gateway	= None
+            self.pool_local.counted = False
+            with self.pool_ready:
+                self.pool_idle.append( (gateway,timer()) )
+                self.pool_ready.notify()
+
+    def close_gateway( self, exc=None ):
+        """Close this Thread's gateway, releasing its place in the pool."""
+        if self.gateway is not None and getattr( self.pool_local, 'counted', False ):
+            self.pool_local.counted = False
+            with self.pool_ready:
+                self.pool_count -= 1
+                self.pool_counts.closed += 1
+                self.pool_ready.notify()
+        super( pooled, self ).close_gateway( exc=exc )
+
+    def close_pool( self ):
+        """Close all idle gateways.  Gateways checked out by other Threads are unaffected."""
+        with self.pool_ready:
+            while self.pool_idle:
+                gateway,_	= self.pool_idle.pop()
+                try:
+                    gateway.close()
+                except Exception as exc:
+                    log.info( "Closing EtherNet/IP CIP gateway %r failed: %s", gateway, exc )
+                self.pool_count -= 1
+                self.pool_counts.closed += 1
+
+    def read_details( self, attributes ):
+        """Retain this Thread's gateway for the full duration of the read_details generator, closing
+        it (only) if an Exception occurs."""
+        with self:
+            for res in super( pooled, self ).read_details( attributes ):
+                yield res
+
+
+class proxy_pooled( pooled, proxy ):
+    """A proxy to a routing CIP device (eg. a *Logix controller), via a pool of EtherNet/IP sessions."""
+    pass
+
+
+class proxy_connected_pooled( pooled, proxy_connected ):
+    """A proxy to a CIP device, via a pool of Forward Open "Connected" sessions."""
+    pass
+
+
 class proxy_pylogix( object ):
     """Serializes access to an underlying pylogix.PLC() communication channel, adequate
     for cpppo.server.enip.poll's run( via=... )"""
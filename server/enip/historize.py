@@ -79,10 +79,19 @@ class Attribute_historize( device.Attribute ):
     __getitem__ and __setitem__ invocations may (appear) to occur simultaneously; lock your mutex
     around any critical sections!
 
+    The history records are written by a logger_background Thread (flushing every 100ms), so that
+    disk I/O latency is not added to the EtherNet/IP CIP request processing.
+
     """
     
     __filename			= sys.argv.pop( 1 ) # Capture and remove first command-line argument
-    __logger			= history.logger( __filename, bufsize=history.logger.LINE_BUF )
+    __logger			= history.logger_background( __filename, flush=.1 )
+
+    @classmethod
+    def stop_history( cls ):
+        """Write any queued history records, and stop the history writer."""
+        cls.__logger.stop()
+        cls.__logger.close()
 
     def __init__( self, *args, **kwds ):
         super( Attribute_historize, self ).__init__( *args, **kwds )
@@ -145,4 +154,7 @@ class Attribute_historize( device.Attribute ):
             # ^^^^
             raise
 
-sys.exit( enip_main( attribute_class=Attribute_historize ))
+try:
+    sys.exit( enip_main( attribute_class=Attribute_historize ))
+finally:
+    Attribute_historize.stop_history()
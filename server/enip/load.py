@@ -0,0 +1,440 @@
+#! /usr/bin/env python3
+
+# 
+# Cpppo -- Communication Protocol Python Parser and Originator
+# 
+# Copyright (c) 2013, Hard Consulting Corporation.
+# 
+# Cpppo is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.  See the LICENSE file at the top of the source tree.
+# 
+# Cpppo is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+# 
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry@hardconsulting.com"
+__copyright__                   = "Copyright (c) 2013 Hard Consulting Corporation"
+__license__                     = "Dual License: GPLv3 (or later) and Commercial (see LICENSE)"
+
+__all__				= ['histogram', 'results', 'load_connection', 'load_process', 'load', 'main']
+
+
+"""Generate EtherNet/IP CIP Tag I/O load against a target (eg. a simulator), from many processes and
+connections, recording the latency of every request.
+
+    $ # 4 processes x 8 connections, each reading/writing a mix of Tags for 30s, at pipeline depth 2
+    $ python -m cpppo.server.enip.load -a controller -P 4 -C 8 -D 30 --depth 2 \\
+        'SCADA[0-9]' 'SCADA[0-99]' 'SCADA[10]=(INT)99'
+
+Each connection issues the Tag operations of the mix in random order, 'til the --duration elapses
+(or each connection has issued --count operations).  Connected (Implicit; Forward Open) sessions
+may be used instead of Unconnected (Explicit) requests.  The latency of each request (from its
+issue, 'til its reply) is recorded into an HDR-style histogram; the histograms of every connection
+and process are merged, and the latency percentiles, error rate and the throughput over time are
+reported, and optionally saved as JSON (including the mergeable histogram).
+
+"""
+
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import random
+import sys
+import threading
+import traceback
+
+from . import defaults, client
+from ...automata import log_cfg
+from ...dotdict import dotdict
+from ...misc import timer, parse_ip_port
+
+log				= logging.getLogger( "enip.load" )
+
+
+class histogram( object ):
+    """An HDR-style (High Dynamic Range) histogram of non-negative integer values (eg. latencies in
+    microseconds), maintaining 'significant' decimal digits of precision over any range of values.
+    Values are counted in buckets of exponentially increasing size; each power-of-2 range is divided
+    into a fixed number of linear sub-buckets.  Histograms with the same precision may be merged (eg.
+    from many connections and processes), and percentiles computed from the merged counts.
+
+    """
+    def __init__( self, significant=2 ):
+        assert 1 <= significant <= 5, "Significant digits must be 1-5"
+        self.significant	= significant
+        self.sub		= 1 << int( math.ceil( math.log( 2 * 10 ** significant, 2 )))
+        self.half		= self.sub // 2
+        self.shift		= self.sub.bit_length() - 1
+        self.counts		= {}		# { <index>: <count>, ... }
+        self.count		= 0
+        self.total		= 0
+        self.min		= None
+        self.max		= None
+
+    def index( self, value ):
+        """The bucket index of the non-negative integer value."""
+        if value < self.sub:
+            return value
+        shift			= value.bit_length() - self.shift
+        return self.sub + ( shift - 1 ) * self.half + ( value >> shift ) - self.half
+
+    def lowest( self, index ):
+        """The lowest value counted in the bucket at 'index'."""
+        if index < self.sub:
+            return index
+        shift,sub		= divmod( index - self.sub, self.half )
+        return ( sub + self.half ) << ( shift + 1 )
+
+    def highest( self, index ):
+        """The highest value counted in the bucket at 'index'."""
+        return self.lowest( index + 1 ) - 1
+
+    def record( self, value, count=1 ):
+        """Count the non-negative value (rounded to an integer)."""
+        value			= max( 0, int( round( value )))
+        index			= self.index( value )
+        self.counts[index]	= self.counts.get( index, 0 ) + count
+        self.count	       += count
+        self.total	       += value * count
+        if self.min is None or value < self.min:
+            self.min		= value
+        if self.max is None or value > self.max:
+            self.max		= value
+
+    def merge( self, other ):
+        """Add the counts of another histogram (of the same precision) to this one."""
+        assert other.significant == self.significant, \
+            "Cannot merge histograms of differing precision"
+        for i,n in other.counts.items():
+            self.counts[i]	= self.counts.get( i, 0 ) + n
+        self.count	       += other.count
+        self.total	       += other.total
+        for attr,better in ( ( 'min', min ), ( 'max', max )):
+            if getattr( other, attr ) is not None:
+                mine		= getattr( self, attr )
+                setattr( self, attr, getattr( other, attr ) if mine is None else better( mine, getattr( other, attr )))
+        return self
+
+    @property
+    def mean( self ):
+        return self.total / self.count if self.count else None
+
+    def percentile( self, percent ):
+        """The value at/below which 'percent' of the values were counted (the highest value equivalent
+        to that of the bucket containing the percentile, but not beyond the maximum), or None."""
+        if not self.count:
+            return None
+        target			= max( 1, int( math.ceil( round( percent * self.count / 100.0, 9 ))))
+        seen			= 0
+        for i in sorted( self.counts ):
+            seen	       += self.counts[i]
+            if seen >= target:
+                return min( self.highest( i ), self.max )
+        return self.max
+
+    def encode( self ):
+        """A JSON-compatible dict, from which an equivalent histogram may be decoded."""
+        return dict( significant=self.significant, count=self.count, total=self.total,
+                     min=self.min, max=self.max, counts=self.counts )
+
+    @classmethod
+    def decode( cls, encoded ):
+        hist			= cls( significant=encoded['significant'] )
+        hist.counts		= dict( ( int( i ), n ) for i,n in encoded['counts'].items() )
+        hist.count		= encoded['count']
+        hist.total		= encoded['total']
+        hist.min		= encoded['min']
+        hist.max		= encoded['max']
+        return hist
+
+
+class results( object ):
+    """Load results: the .latency histogram (in microseconds), the count of .requests (operations)
+    and .errors, and the { <interval>: [<requests>,<errors>], ... } in each interval."""
+    def __init__( self, significant=2 ):
+        self.latency		= histogram( significant=significant )
+        self.requests		= 0
+        self.errors		= 0
+        self.intervals		= {}
+        self.elapsed		= None
+
+    def tally( self, interval, error ):
+        self.requests	       += 1
+        self.errors	       += error
+        t			= self.intervals.setdefault( interval, [0,0] )
+        t[0]		       += 1
+        t[1]		       += error
+
+    def merge( self, other ):
+        """Add the 'other' load results to these."""
+        self.latency.merge( other.latency )
+        self.requests	       += other.requests
+        self.errors	       += other.errors
+        for i,(n,e) in other.intervals.items():
+            t			= self.intervals.setdefault( i, [0,0] )
+            t[0]	       += n
+            t[1]	       += e
+        return self
+
+
+def load_connection( address, operations, started, duration=None, count=None, depth=0, multiple=0,
+                     connected=False, interval=1.0, timeout=None, significant=2, seed=None ):
+    """Issue the (parsed) Tag 'operations' in random order on a connection to the EtherNet/IP CIP
+    device at 'address', from wall-clock time 'started' 'til 'duration' elapses and/or 'count'
+    operations have been issued.  If the connection fails, it is re-established (after a brief
+    delay) 'til done.  Returns the load results (see results).
+
+    """
+    if timeout is None:
+        timeout			= defaults.timeout
+    rnd				= random.Random( seed )
+    res				= results( significant=significant )
+    deadline			= None if duration is None else started + duration
+    issued			= 0
+
+    def done():
+        return ( count is not None and issued >= count ) or ( deadline is not None and timer() >= deadline )
+
+    def tally( when, error ):
+        res.tally( int(( when - started ) // interval ), error )
+
+    while not done():
+        begun			= {}		# { <index>: <issued>, ... }; awaiting replies
+        try:
+            cls			= client.implicit if connected else client.connector
+            with cls( host=address[0], port=address[1], timeout=timeout ) as conn:
+                def generate():
+                    """Yield operations 'til done, recording the issue time of each."""
+                    nonlocal issued
+                    for i in range( sys.maxsize ):
+                        if done():
+                            return
+                        begun[i]= timer()
+                        issued += 1
+                        yield dotdict( rnd.choice( operations ))
+                for idx,dsc,op,rpy,sts,val in conn.pipeline(
+                        operations=generate(), depth=depth, multiple=multiple, timeout=timeout ):
+                    now		= timer()
+                    res.latency.record(( now - begun.pop( idx )) * 1e6 )
+                    if val is None:
+                        log.info( "%s failed: %s", dsc, sts )
+                    tally( now, val is None )
+        except Exception as exc:
+            log.warning( "Load connection to %s:%s failed: %s", address[0], address[1], exc )
+            log.info( "%s", traceback.format_exc() )
+            # Any operations issued but not replied to are errors
+            now			= timer()
+            for _ in begun:
+                tally( now, True )
+            if not done():
+                threading.Event().wait( min( 1.0, timeout ))
+    return res
+
+
+def load_process( queue, address, tags, connections=1, route_path=None, send_path=None, **kwds ):
+    """Run 'connections' load_connection Threads (see load_connection for keywords), putting their merged
+    results (or the failure) on the queue."""
+    try:
+        operations		= list( client.parse_operations(
+            tags, route_path=route_path, send_path=send_path ))
+        outcome			= [ None ] * connections
+        seed			= kwds.pop( 'seed', None )
+
+        def connection( i ):
+            outcome[i]		= load_connection( address, operations,
+                                                   seed=None if seed is None else seed + i, **kwds )
+        threads			= [ threading.Thread( target=connection, args=( i, )) for i in range( connections ) ]
+        for t in threads:
+            t.daemon		= True
+            t.start()
+        for t in threads:
+            t.join()
+        res			= results( significant=kwds.get( 'significant', 2 ))
+        for o in outcome:
+            if o is not None:
+                res.merge( o )
+        queue.put( res )
+    except Exception:
+        queue.put( traceback.format_exc() )
+
+
+def load( address, tags, processes=1, connections=1, duration=None, count=None, **kwds ):
+    """Generate load from 'processes' x 'connections' against the EtherNet/IP CIP device at 'address',
+    each issuing Tag I/O 'tags' (eg. "SCADA[0-9]", "SCADA[1]=(INT)3") 'til the 'duration' elapses,
+    and/or 'count' operations are issued per connection (see load_connection for other keywords).
+    Returns the merged results (see results), and their .elapsed time.
+
+    """
+    assert duration is not None or count is not None, "Must supply a load duration and/or count"
+    queue			= multiprocessing.Queue()
+    started			= timer()
+    procs			= [ multiprocessing.Process(
+                                      target=load_process, args=( queue, address, tags ),
+                                      kwargs=dict( kwds, connections=connections, started=started,
+                                                   duration=duration, count=count,
+                                                   seed=None if kwds.get( 'seed' ) is None else kwds['seed'] + p * connections ))
+                                    for p in range( processes ) ]
+    for p in procs:
+        p.daemon		= True
+        p.start()
+    res				= results( significant=kwds.get( 'significant', 2 ))
+    failures			= []
+    for _ in procs:
+        outcome			= queue.get()
+        if isinstance( outcome, results ):
+            res.merge( outcome )
+        else:
+            failures.append( outcome )
+    for p in procs:
+        p.join()
+    res.elapsed			= timer() - started
+    if failures:
+        raise RuntimeError( "%d load processes failed: %s" % ( len( failures ), failures[0] ))
+    return res
+
+
+def main( argv=None ):
+    """Generate EtherNet/IP CIP Tag I/O load, and report the latency percentiles and throughput."""
+    ap				= argparse.ArgumentParser(
+        description = "An EtherNet/IP CIP Tag I/O load generator",
+        formatter_class = argparse.RawDescriptionHelpFormatter,
+        epilog = """\
+
+Each of --processes x --connections issues Tag I/O operations chosen at random
+from the supplied Tag mix (in the same format as cpppo.server.enip.client, eg.
+'SCADA[0-99]', 'SCADA[1]=(INT)3'; repeat a Tag to weight it), 'til the
+--duration elapses or --count operations are issued on each connection.
+
+The latency of each operation (microseconds, from its issue 'til its reply) is
+reported as percentiles, along with the error rate and the throughput in each
+--interval.  Use --output to save the results (including the merged latency
+histogram) as JSON. """ )
+    ap.add_argument( '-v', '--verbose', action="count",
+                     default=0,
+                     help="Display logging information." )
+    ap.add_argument( '-a', '--address',
+                     default=( "%s:%d" % defaults.address ),
+                     help="EtherNet/IP interface[:port] to connect to (default: %s:%d)" % (
+                         defaults.address[0] or 'localhost', defaults.address[1] ))
+    ap.add_argument( '-P', '--processes', type=int,
+                     default=1,
+                     help="Number of load generating processes (default: 1)" )
+    ap.add_argument( '-C', '--connections', type=int,
+                     default=1,
+                     help="Number of connections per process (default: 1)" )
+    ap.add_argument( '-D', '--duration', type=float,
+                     default=None,
+                     help="Seconds to generate load (default: 10s, unless --count)" )
+    ap.add_argument( '-n', '--count', type=int,
+                     default=None,
+                     help="Operations to issue per connection (default: unlimited)" )
+    ap.add_argument( '-d', '--depth', type=int,
+                     default=0,
+                     help="Pipeline requests to this depth (default: 0)" )
+    ap.add_argument( '-m', '--multiple', type=int,
+                     default=0,
+                     help="Multiple Service Packet request size limit (default: 0)" )
+    ap.add_argument( '-c', '--connected', action='store_true',
+                     default=False,
+                     help="Use Connected (Implicit) sessions (default: False)" )
+    ap.add_argument( '--route-path',
+                     default=None,
+                     help="Route Path, as <port>/<link> or JSON; 0/false to specify no/empty route_path" )
+    ap.add_argument( '--send-path',
+                     default=None,
+                     help="Send Path to UCMM (default: @6/1); Specify an empty string '' for no Send Path" )
+    ap.add_argument( '-S', '--simple', action='store_true',
+                     default=False,
+                     help="Access a simple (non-routing) EtherNet/IP CIP device (eg. MicroLogix)")
+    ap.add_argument( '-i', '--interval', type=float,
+                     default=1.0,
+                     help="Report throughput over intervals of this many seconds (default: 1s)" )
+    ap.add_argument( '-t', '--timeout', type=float,
+                     default=5.0,
+                     help="EtherNet/IP timeout (default: 5s)" )
+    ap.add_argument( '-o', '--output',
+                     default=None,
+                     help="Save the JSON results to the file ('-' for stdout)" )
+    ap.add_argument( 'tags', nargs="+",
+                     help="Tag mix to read/write, eg: SCADA[1], SCADA[2-10]=(INT)3,4,5,6,7,8,9,10,11" )
+    args			= ap.parse_args( argv )
+
+    levelmap 			= {
+        0: logging.WARNING,
+        1: logging.NORMAL,
+        2: logging.DETAIL,
+        3: logging.INFO,
+        4: logging.DEBUG,
+        }
+    log_cfg['level']		= ( levelmap[args.verbose]
+                                    if args.verbose in levelmap
+                                    else logging.DEBUG )
+    logging.basicConfig( **log_cfg )
+
+    address			= parse_ip_port( args.address, default=defaults.address )
+    address			= ( str( address[0] or 'localhost' ), address[1] or defaults.address[1] )
+    duration			= args.duration
+    if duration is None and args.count is None:
+        duration		= 10.0
+    route_path			= args.route_path if args.route_path \
+                                      else [] if args.simple else None
+    send_path			= args.send_path if args.send_path \
+                                      else '' if args.simple else None
+
+    res				= load(
+        address, args.tags, processes=args.processes, connections=args.connections,
+        duration=duration, count=args.count, depth=args.depth, multiple=args.multiple,
+        connected=args.connected, interval=args.interval, timeout=args.timeout,
+        route_path=route_path, send_path=send_path )
+
+    percentiles			= ( 50, 90, 99, 99.9 )
+    out				= sys.stderr if args.output == '-' else sys.stdout
+    print( "Load: %d processes x %d connections in %7.3fs; %d requests, %d errors (%.3f%%); %9.1f requests/s" % (
+        args.processes, args.connections, res.elapsed, res.requests, res.errors,
+        res.errors * 100.0 / max( res.requests, 1 ), res.requests / max( res.elapsed, 1e-9 )), file=out )
+    if res.latency.count:
+        print( "Latency (ms): min %.3f, mean %.3f, %s, max %.3f" % (
+            res.latency.min / 1000, res.latency.mean / 1000, ', '.join(
+                "p%g %.3f" % ( p, res.latency.percentile( p ) / 1000 ) for p in percentiles ),
+            res.latency.max / 1000 ), file=out )
+    for i,(n,e) in sorted( res.intervals.items() ):
+        print( "  %8.1fs: %9.1f requests/s, %6d errors" % (
+            i * args.interval, n / args.interval, e ), file=out )
+
+    if args.output:
+        encoded			= dict(
+            address	= list( address ),
+            processes	= args.processes,
+            connections	= args.connections,
+            tags	= args.tags,
+            depth	= args.depth,
+            multiple	= args.multiple,
+            connected	= args.connected,
+            elapsed	= res.elapsed,
+            requests	= res.requests,
+            errors	= res.errors,
+            interval	= args.interval,
+            intervals	= [ [ i * args.interval, n, e ] for i,(n,e) in sorted( res.intervals.items() ) ],
+            percentiles	= dict( ( "p%g" % p, res.latency.percentile( p )) for p in percentiles ),
+            latency	= res.latency.encode(),
+        )
+        f			= sys.stdout if args.output == '-' else open( args.output, 'w' )
+        try:
+            json.dump( encoded, f, indent=4, sort_keys=True )
+            f.write( '\n' )
+        finally:
+            if f is not sys.stdout:
+                f.close()
+    return 1 if res.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
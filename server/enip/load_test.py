@@ -0,0 +1,62 @@
+from __future__ import absolute_import, print_function, division
+
+import json
+import random
+import threading
+import time
+
+from ...dotdict import apidict
+from . import defaults, device, logix, load
+from .main import main as enip_main
+
+
+def test_load_histogram():
+    h				= load.histogram( significant=2 )
+    assert h.sub == 256 and h.percentile( 50 ) is None
+    for v in range( 100000 ):
+        i			= h.index( v )
+        assert h.lowest( i ) <= v <= h.highest( i )
+        assert h.highest( i ) - h.lowest( i ) <= max( 1, v // 100 )
+
+    rnd				= random.Random( 0 )
+    values			= sorted( int( rnd.expovariate( 1/1000.0 )) for _ in range( 10000 ))
+    a,b				= load.histogram(),load.histogram()
+    for i,v in enumerate( values ):
+        ( a if i % 2 else b ).record( v )
+    h				= a.merge( b )
+    assert h.count == len( values ) and h.min == values[0] and h.max == values[-1]
+    assert abs( h.mean - sum( values ) / len( values )) < 1e-6
+    for p in ( 50, 90, 99, 99.9 ):
+        exact			= values[int( len( values ) * p / 100 ) - 1]
+        assert exact <= h.percentile( p ) <= exact * 1.01 + 1, \
+            "p%s: %s vs. %s" % ( p, h.percentile( p ), exact )
+
+    # Histograms survive a JSON round trip
+    d				= load.histogram.decode( json.loads( json.dumps( h.encode() )))
+    assert d.counts == h.counts and d.percentile( 99 ) == h.percentile( 99 )
+
+
+def test_load_simulator():
+    """Generate load from 2 processes x 2 connections, Unconnected and Connected."""
+    device.lookup_reset()
+    logix.setup_reset()
+    control			= apidict( defaults.timeout, done=False )
+    server			= threading.Thread( target=enip_main, kwargs=dict(
+        argv	= [ '--address', 'localhost:0', 'SCADA=INT[1000]' ],
+        server	= dict( control=control )))
+    server.daemon		= True
+    server.start()
+    try:
+        while 'address' not in control:
+            assert server.is_alive()
+            time.sleep( .01 )
+        for connected in ( False, True ):
+            res			= load.load( control['address'], [ 'SCADA[0-9]', 'SCADA[10]=(INT)99' ],
+                                             processes=2, connections=2, count=10, depth=1,
+                                             connected=connected, seed=1 )
+            assert res.requests == 40 and res.errors == 0
+            assert res.latency.count == 40 and 0 < res.latency.percentile( 50 ) <= res.latency.max
+            assert sum( n for n,_ in res.intervals.values() ) == 40
+    finally:
+        control['done']		= True
+        server.join( timeout=defaults.timeout )
@@ -625,6 +625,7 @@ def enip_srv_udp( conn, name, enip_process, **kwds ):
     respect the setting of 'eof' in stats, and ignore requests from that client.
 
     """
+    receiver			= network.receiver( conn, size=defaults.recv_size ) # one datagram per request
     with parser.enip_machine( name=name, context='enip' ) as machine:
         while not kwds['server']['control']['done'] and not kwds['server']['control']['disable']:
             try:
@@ -650,7 +651,7 @@ def enip_srv_udp( conn, name, enip_process, **kwds ):
                             wait	= ( kwds['server']['control']['latency']
                                             if source.peek() is None else 0 )
                             brx		= misc.timer()
-                            msg,frm	= network.recvfrom( conn, timeout=wait )
+                            msg,frm	= receiver.recvfrom( timeout=wait )
                             now		= misc.timer()
                             if msg and log.isEnabledFor( logging.DETAIL ):
                                 log.detail( "Transaction receive after %7.3fs (%5s bytes in %7.3f/%7.3fs): %r",
@@ -667,11 +668,11 @@ def enip_srv_udp( conn, name, enip_process, **kwds ):
                         # However, we can respond to a manual eof (eg. from web interface) by
                         # ignoring the peer's packets.
                         assert stats and not stats.get( 'eof' ), \
-                            "Ignoring UDP request from client %r: %r" % ( addr, msg )
+                            "Ignoring UDP request from client %r: %r" % ( addr, bytes( msg ))
                         stats['received']+= len( msg )
                         if log.isEnabledFor( logging.DETAIL ):
                             log.detail( "%s recv: %5d: %s", machine.name_centered(),
-                                        len( msg ), repr( msg ) if log.isEnabledFor( logging.INFO ) else misc.reprlib.repr( msg ))
+                                        len( msg ), repr( bytes( msg )) if log.isEnabledFor( logging.INFO ) else misc.reprlib.repr( bytes( msg )))
                         source.chain( msg )
 
                 # Terminal state and EtherNet/IP header recognized; process and return response
@@ -716,6 +717,7 @@ def enip_srv_udp( conn, name, enip_process, **kwds ):
 
 def enip_srv_tcp( conn, addr, name, enip_process, delay=None, **kwds ):
     source			= rememberable()
+    receiver			= network.receiver( conn, size=defaults.recv_size )
     with parser.enip_machine( name=name, context='enip' ) as machine:
         # We can be provided a dotdict() to contain our stats.  If one has been passed in, then this
         # means that our stats for this connection will be available to the web API; it may set
@@ -750,7 +752,10 @@ def enip_srv_tcp( conn, addr, name, enip_process, delay=None, **kwds ):
                             wait=( kwds['server']['control']['latency']
                                    if source.peek() is None else 0 )
                             brx = misc.timer()
-                            msg	= network.recv( conn, timeout=wait )
+                            # Receive into the reusable buffer, unless some of its last input is
+                            # still unconsumed in source (it would be overwritten)
+                            msg	= ( receiver.recv( timeout=wait ) if source.peek() is None
+                                    else network.recv( conn, timeout=wait ))
                             now = misc.timer()
                             ( log.detail if msg else log.debug )(
                                 "Transaction receive after %7.3fs (%5s bytes in %7.3f/%7.3fs)",
@@ -771,7 +776,7 @@ def enip_srv_tcp( conn, addr, name, enip_process, delay=None, **kwds ):
                                 stats['eof']	= stats['eof'] or not len( msg )
                                 if log.isEnabledFor( logging.DETAIL ):
                                     log.detail( "%s recv: %5d: %s", machine.name_centered(),
-                                                len( msg ), repr( msg ) if log.isEnabledFor( logging.INFO ) else misc.reprlib.repr( msg ))
+                                                len( msg ), repr( bytes( msg )) if log.isEnabledFor( logging.INFO ) else misc.reprlib.repr( bytes( msg )))
                                 source.chain( msg )
                             else:
                                 # No input.  If we have symbols available, no problem; continue.
@@ -27,7 +27,7 @@ __copyright__                   = "Copyright (c) 2016 Hard Consulting Corporatio
 __license__                     = "Dual License: GPLv3 (or later) and Commercial (see LICENSE)"
 
 __all__				= [
-    'PARAMS', 'execute', 'loop', 'run', 'poll', 'main',
+    'PARAMS', 'prepare', 'execute', 'loop', 'schedule', 'deadband', 'run', 'poll', 'main',
 ]
 
 import argparse
@@ -39,9 +39,11 @@ import sys
 import time
 import traceback
 
-from ...automata import log_cfg
+from ...automata import log_cfg, is_listlike, type_str_base
+from ...dotdict import dotdict
 from ...misc import timer
 from . import defaults
+from .client import prepared
 
 log				= logging.getLogger( "enip.poll" )
 
@@ -51,20 +53,38 @@ PARAMS				= [
     'Motor Velocity',
 ]
 
+def prepare( via, params=None, pass_thru=None ):
+    """Substitute and parse the params once, into a poll set prepared by the supplied
+    enip.get_attribute 'proxy' instance, which may be supplied as the 'params' to execute, loop, run
+    or poll.  Each subsequent poll cycle then simply re-sends the precompiled EtherNet/IP requests.
+
+    """
+    prep			= via.prepare( via.parameter_substitution( params or PARAMS, pass_thru=pass_thru ))
+    prep.params			= list( params or PARAMS )
+    return prep
+
+
 def execute( via, params=None, pass_thru=None, details=False ):
     """Perform a single poll via the supplied enip.get_attribute 'proxy' instance, yielding the
     parameters and their polled values (or full result details, if True)
 
     By default, we'll look for the parameters in the module's PARAMS list, which must be recognized
     by the supplied via's parameter_substitutions method, if pass_thru is not Truthy (default:
-    True).
+    True).  The params may also be a poll set from prepare, which is used without substitution.
 
     Yields tuples of each of the supplied params, each with their polled values/details.
 
     """
-    with contextlib.closing( ( via.read_details if details else via.read )(
-            via.parameter_substitution( params or PARAMS, pass_thru=pass_thru ))) as reader:
-        for p,v in zip( params or PARAMS, reader ): # "lazy" zip
+    if isinstance( params, prepared ):
+        names			= params.params
+        if names is None:
+            names		= [ att for att,typ,uni in params.details ]
+        attributes		= params
+    else:
+        names			= params or PARAMS
+        attributes		= via.parameter_substitution( names, pass_thru=pass_thru )
+    with contextlib.closing( ( via.read_details if details else via.read )( attributes )) as reader:
+        for p,v in zip( names, reader ): # "lazy" zip
             yield p,v
 
 
@@ -125,8 +145,186 @@ def loop( via, cycle=None, last_poll=None, **kwds ):
     return last_poll,max( 0, last_poll+cycle-done_poll ),results
 
 
+class schedule( object ):
+    """Poll groups of parameters at differing cycle times, over the same proxy.  Each poll cycle
+    merges the parameters of every group that is due into a single read, so that they may share
+    Multiple Service Packet requests (and the pipeline).  Supply the groups as a dict, or as an
+    iterable of (<cycle>,<params>) pairs:
+
+        sched = poll.schedule( { .1: [ 'Output Current' ], 5.0: [ 'Elapsed KwH', 'Speed Units' ] } )
+        poll.run( via, process=process, schedule=sched )
+
+    Like loop, each group retains its cadence by advancing its last_poll by whole cycles, logging
+    missed polls.  Each group's 'slip' (how late the poll started, vs. its scheduled time) and
+    'jitter' (deviation of the interval since its prior poll, from its cycle; a moving average, and
+    maximum) are recorded; see .stats.  A parameter appearing in several due groups is only polled
+    once.  Any (single-cycle) 'params' and 'cycle' supplied via run or poll are ignored.
+
+    """
+    def __init__( self, groups, pass_thru=None ):
+        if hasattr( groups, 'items' ):
+            groups		= groups.items()
+        self.groups		= []
+        for cycle,params in sorted( groups, key=lambda cp: cp[0] ):
+            assert cycle > 0, "Invalid poll cycle: %r" % ( cycle, )
+            self.groups.append( dotdict(
+                cycle	= cycle,
+                params	= list( params ),
+                last_poll = 0,
+                polled	= 0,
+                polls	= 0,
+                missed	= 0,
+                slip	= 0.0,
+                slip_max = 0.0,
+                jitter	= 0.0,
+                jitter_max = 0.0,
+            ))
+        self.pass_thru		= pass_thru
+
+    def due( self, now=None ):
+        """Returns the groups due to be polled at (or before) 'now', and the time the next group is due."""
+        if now is None:
+            now			= timer()
+        due			= [ g for g in self.groups if now >= g.last_poll + g.cycle ]
+        return due,min( g.last_poll + g.cycle for g in self.groups )
+
+    def stats( self ):
+        """Report each group's poll statistics, by cycle."""
+        return dict( ( g.cycle, dotdict( ( k, g[k] ) for k in (
+            'polls', 'missed', 'slip', 'slip_max', 'jitter', 'jitter_max' ))) for g in self.groups )
+
+    def loop( self, via, last_poll=None, **kwds ):
+        """Perform a poll of all the due groups' parameters.  Returns, like loop: the start of the
+        poll, the number of seconds to delay 'til the next group is due, and the list of parameter,
+        value pairs polled.
+
+        """
+        kwds.pop( 'params', None )
+        kwds.pop( 'cycle', None )
+        init_poll		= timer()
+        due,_			= self.due( init_poll )
+        names			= []
+        for g in due:
+            dt			= init_poll - g.last_poll
+            missed		= dt // g.cycle
+            if g.last_poll:
+                if missed > 1:
+                    log.normal( "Missed %3d polls, %7.3fs past %7.3fs poll cycle",
+                                    missed, dt-g.cycle, g.cycle )
+                    g.missed   += int( missed ) - 1
+                g.last_poll    += g.cycle * missed
+                g.slip		= init_poll - g.last_poll
+                g.slip_max	= max( g.slip_max, g.slip )
+                jitter		= abs( init_poll - g.polled - g.cycle )
+                g.jitter	= jitter if g.polls == 1 else ( g.jitter * 7 + jitter ) / 8
+                g.jitter_max	= max( g.jitter_max, jitter )
+            else:
+                g.last_poll	= init_poll
+            g.polled		= init_poll
+            g.polls	       += 1
+            for p in g.params:
+                if p not in names:
+                    names.append( p )
+
+        results			= []
+        if names:
+            log.detail( "Polling %d of %d groups: %d params", len( due ), len( self.groups ), len( names ))
+            if kwds.get( 'pass_thru' ) is None:
+                kwds['pass_thru'] = self.pass_thru
+            with via: # ensure via.close_gateway invoked on any Exception
+                with contextlib.closing( execute( via, params=names, **kwds )) as executor:
+                    results	= list( executor )
+        done_poll		= timer()
+        _,upcoming		= self.due( done_poll )
+        return init_poll,max( 0, upcoming - done_poll ),results
+
+
+class deadband( object ):
+    """Report-by-exception; a poll.run 'process' stage, which forwards (<param>,<value>) to the
+    supplied 'process' only if the value has changed.  Each of 'absolute', 'percent' (of the last
+    reported value's magnitude) and 'heartbeat' may be a number applying to all parameters, or a
+    dict of values for specific parameters:
+
+        changes = poll.deadband( process, absolute={ 'Output Current': .1 }, percent=1, heartbeat=60 )
+        poll.run( via, process=changes, ... )
+
+    A numeric value is changed if it differs from the last reported value by more than the
+    absolute and/or percent deadband; any other value (and any change between None, ie. a failed
+    poll, and a value) if it is unequal.  Array values are compared element-wise; if 'elements' is
+    True, only the changed elements are forwarded, as a { <index>: <value>, ... } dict.  If the
+    param hasn't been reported for 'heartbeat' seconds, the value is forwarded regardless.
+
+    The last-known value of every param polled (whether forwarded or not) is retained in .values;
+    see .snapshot.  The forwarded and suppressed counts are retained in .forwarded and .suppressed.
+    The 'process' callable's .done (if any) is reflected in this instance's .done.
+
+    """
+    def __init__( self, process, absolute=None, percent=None, heartbeat=None, elements=False ):
+        self.process		= process
+        self.absolute		= absolute
+        self.percent		= percent
+        self.heartbeat		= heartbeat
+        self.elements		= elements
+        self.values		= {}		# { <param>: <value>, ... } last-known values
+        self.reported		= {}		# { <param>: (<value>,<timer>), ... } last reported
+        self.forwarded		= 0
+        self.suppressed		= 0
+
+    @property
+    def done( self ):
+        return getattr( self.process, 'done', False )
+
+    @staticmethod
+    def setting( setting, param ):
+        if hasattr( setting, 'get' ):
+            return setting.get( param )
+        return setting
+
+    def changed( self, param, value, last ):
+        """Returns True iff the (scalar) value has changed from the last reported value."""
+        if value is None or last is None or isinstance( value, (bool,type_str_base) ) \
+           or not isinstance( value, (int,float) ) or not isinstance( last, (int,float) ):
+            return value != last
+        absolute		= self.setting( self.absolute, param )
+        percent			= self.setting( self.percent, param )
+        if absolute is None and percent is None:
+            return value != last
+        delta			= abs( value - last )
+        return ( ( absolute is None or delta > absolute )
+                 and ( percent is None or delta > abs( last ) * percent / 100 ))
+
+    def snapshot( self ):
+        """A copy of the last-known value of every polled param."""
+        return dict( self.values )
+
+    def __call__( self, param, value ):
+        now			= timer()
+        self.values[param]	= value
+        last,when		= self.reported.get( param, (None,None) )
+        heartbeat		= self.setting( self.heartbeat, param )
+        forward			= value
+        if when is None or ( heartbeat is not None and now - when >= heartbeat ):
+            pass # never reported, or silent for too long; forward the entire value
+        elif is_listlike( value ) and is_listlike( last ) and len( value ) == len( last ):
+            changes		= dict( ( i, v ) for i,(v,l) in enumerate( zip( value, last ))
+                                        if self.changed( param, v, l ))
+            if not changes:
+                self.suppressed	       += 1
+                return
+            if self.elements:
+                # Only the changed elements are forwarded (and updated in the reported value)
+                forward		= changes
+                value		= [ changes.get( i, l ) for i,l in enumerate( last ) ]
+        elif not self.changed( param, value, last ):
+            self.suppressed	       += 1
+            return
+        self.reported[param]	= (value,now)
+        self.forwarded	       += 1
+        self.process( param, forward )
+
+
 def run( via, process, failure=None, backoff_min=None, backoff_multiplier=None, backoff_max=None,
-         latency=None, **kwds ):
+         latency=None, schedule=None, **kwds ):
     """Perform polling loop 'til process.done (or forever), and process each poll result.
 
     On Exception, invoke the supplied poll failure method (if any), and apply exponential back-off
@@ -138,9 +336,12 @@ def run( via, process, failure=None, backoff_min=None, backoff_multiplier=None,
     it is assumed that Thread blocking behaviour is performed within the I/O processing code to
     ensure that only one Thread is performing I/O.
 
+    If a poll 'schedule' is supplied, its groups of parameters are polled at their various cycles
+    (instead of polling the 'params' every 'cycle'); the default backoff starts at its fastest cycle.
+
     """
     if backoff_min is None:
-        backoff_min		= kwds.get( 'cycle' )
+        backoff_min		= kwds.get( 'cycle' ) if schedule is None else schedule.groups[0].cycle
         if backoff_min is None:
             backoff_min		= 1.0
     if backoff_max is None:
@@ -161,7 +362,7 @@ def run( via, process, failure=None, backoff_min=None, backoff_multiplier=None,
             continue
         # Perform a poll.loop and/or increase exponential back-off.
         try:
-            lst,dly,res		= loop( via, last_poll=lst, **kwds )
+            lst,dly,res		= ( loop if schedule is None else schedule.loop )( via, last_poll=lst, **kwds )
             for p,v in res:
                 process( p, v )
             backoff		= None # Signal a successfully completed poll!
@@ -184,7 +385,7 @@ def run( via, process, failure=None, backoff_min=None, backoff_multiplier=None,
 def poll( proxy_class=None, address=None, depth=None, multiple=None, timeout=None,
           route_path=None, send_path=None, via=None,
           params=None, pass_thru=None, cycle=None, process=None, failure=None,
-          backoff_min=None, backoff_multiplier=None, backoff_max=None, latency=None ):
+          backoff_min=None, backoff_multiplier=None, backoff_max=None, latency=None, schedule=None ):
     """Connect to the Device (eg. CompactLogix, MicroLogix, PowerFlex) using the supplied 'via', or an
     instance of the provided proxy_class (something derived from enip.get_attribute.proxy,
     probably), at the specified address (the default enip.address, if None), and run polls, process
@@ -197,7 +398,8 @@ def poll( proxy_class=None, address=None, depth=None, multiple=None, timeout=Non
     proxy instance yourself, and invoke run manually; see poll_example*.py.  For example, you can
     run multiple poll.run methods in separate Threads, all sharing the same proxy instance, to
     achieve polling of various CIP Attributes at differing rates, over the same EtherNet/IP CIP
-    session.
+    session.  Alternatively, supply a poll 'schedule' to poll groups of parameters at differing
+    cycles, merging all those due into each read.
 
     """
     if proxy_class is not None:
@@ -212,7 +414,7 @@ def poll( proxy_class=None, address=None, depth=None, multiple=None, timeout=Non
             send_path=send_path, route_path=route_path )
     run( via=via, process=process, failure=failure, backoff_min=backoff_min,
          backoff_multiplier=backoff_multiplier, backoff_max=backoff_max, latency=latency,
-         cycle=cycle, params=params, pass_thru=pass_thru )
+         cycle=cycle, params=params, pass_thru=pass_thru, schedule=schedule )
 
 
 def main( argv=None ):
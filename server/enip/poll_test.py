@@ -36,7 +36,7 @@ from cpppo.server import enip, network
 from cpppo.server.enip import poll, ucmm
 from cpppo.server.enip.main import main as enip_main
 from cpppo.server.enip.ab import powerflex, powerflex_750_series
-from cpppo.server.enip.get_attribute import proxy
+from cpppo.server.enip.get_attribute import proxy, proxy_pooled
 
     
 def start_powerflex_simulator( *options ):
@@ -289,6 +289,289 @@ def test_powerflex_poll_failure():
 
 
 
+def test_poll_prepared():
+    """Prepare a poll set once via a get_attribute.proxy (and via poll.prepare), and use it for
+    proxy.read/read_details, poll.execute and poll.run cycles.
+
+    """
+    server_addr			= ('localhost', 12401)
+    server_kwds			= dotdict({
+        'argv': [
+            '-v',
+            '--address',	'%s:%d' % server_addr,
+            'QInt@0x9b/1/1=INT[10]',
+            'QReal=REAL[5]',
+        ],
+        'server': {
+            'control':	apidict( enip.timeout, {
+                'done': False
+            }),
+        },
+    })
+    server			= threading.Thread( target=enip_main, kwargs=server_kwds )
+    server.daemon		= True
+    server.start()
+
+    class prepared_proxy( proxy ):
+        PARAMETERS		= dict( proxy.PARAMETERS,
+            qint	= proxy.parameter( '@0x9b/1/1', 'INT', 'Nm' ),
+        )
+
+    try:
+        time.sleep( .5 )
+        via			= prepared_proxy( host=server_addr[0], port=server_addr[1], timeout=5.0 )
+
+        with via:
+            # A proxy.prepare'd poll set retains the attributes as its params
+            prep		= via.prepare( [ 'QReal[1-2]', ( '@0x9b/1/1', 'INT' ) ] )
+            assert prep.params == [ 'QReal[1-2]', ( '@0x9b/1/1', 'INT' ) ] and prep.frames is None
+            for _ in range( 3 ):
+                assert list( via.read( prep )) == [ [0.0, 0.0], [0]*10 ]
+            assert len( prep.frames ) == 2 # no Multiple Service Packets, by default
+            details		= list( via.read_details( prep ))
+            assert [ ( sts, att ) for val,(sts,(att,typ,uni)) in details ] \
+                == [ ( 0, 'QReal[1-2]' ), ( 0, '@0x9b/1/1' ) ]
+
+            # ... and may be supplied directly as poll.execute's params; if no params, use details
+            assert list( poll.execute( via, params=prep )) \
+                == [ ( 'QReal[1-2]', [0.0, 0.0] ), ( ( '@0x9b/1/1', 'INT' ), [0]*10 ) ]
+            prep.params		= None
+            assert list( poll.execute( via, params=prep )) \
+                == [ ( 'QReal[1-2]', [0.0, 0.0] ), ( '@0x9b/1/1', [0]*10 ) ]
+
+        # A poll.prepare'd poll set performs parameter_substitution once, and retains the names
+        prep			= poll.prepare( via, params=[ 'QInt', 'QReal[0]' ], pass_thru=True )
+        assert prep.params == [ 'QInt', 'QReal[0]' ]
+        values			= {}
+        def process( p, v ):
+            values[p]		= v
+            process.done	= len( values ) >= 2
+        process.done		= False
+        failures		= []
+        def failure( exc ):
+            failures.append( exc )
+            process.done	= True
+        poll.run( via, process=process, failure=failure, cycle=.1, params=prep )
+        assert not failures
+        assert values == { 'QInt': [0]*10, 'QReal[0]': [0.0] }
+    finally:
+        server_kwds.server.control['done'] = True
+        server.join( timeout=1.0 )
+
+
+def test_poll_schedule():
+    """Poll groups of parameters at differing rates, merging the due groups into each read."""
+    server_addr			= ('localhost', 12404)
+    server_kwds			= dotdict({
+        'argv': [
+            '-v',
+            '--address',	'%s:%d' % server_addr,
+            'SInt=INT[10]',
+            'SReal=REAL[5]',
+        ],
+        'server': {
+            'control':	apidict( enip.timeout, {
+                'done': False
+            }),
+        },
+    })
+    server			= threading.Thread( target=enip_main, kwargs=server_kwds )
+    server.daemon		= True
+    server.start()
+
+    try:
+        time.sleep( .5 )
+        via			= proxy( host=server_addr[0], port=server_addr[1], timeout=5.0 )
+        sched			= poll.schedule( [ ( .5, [ 'SReal[1]', 'SInt[0]' ] ), ( .1, [ 'SInt[0]' ] ) ],
+                                                 pass_thru=True )
+        assert [ g.cycle for g in sched.groups ] == [ .1, .5 ]
+
+        # The first poll merges all groups (reading each param once); the next is due in ~.1s
+        beg,dly,res		= sched.loop( via, last_poll=0, params=[ 'ignored' ], cycle=99 )
+        assert res == [ ( 'SInt[0]', [0] ), ( 'SReal[1]', [0.0] ) ]
+        assert 0 <= dly <= .1
+        due,upcoming		= sched.due( beg )
+        assert due == [] and near( upcoming, beg + .1 )
+
+        polls			= []
+        def process( p, v ):
+            polls.append( p )
+            process.done	= timer() - start > 1.0
+        process.done		= False
+        start			= timer()
+        poll.run( via, process=process, schedule=sched, latency=.01 )
+        fast,slow		= polls.count( 'SInt[0]' ),polls.count( 'SReal[1]' )
+        assert 6 <= fast <= 12 and 1 <= slow <= 3, \
+            "Expected ~10 fast and ~2 slow polls; got %d and %d" % ( fast, slow )
+        stats			= sched.stats()
+        assert stats[.1].polls == fast + 1 and stats[.5].polls == slow + 1
+        assert 0 <= stats[.1].slip_max < .1 and stats[.1].jitter_max < .1
+    finally:
+        server_kwds.server.control['done'] = True
+        server.join( timeout=1.0 )
+
+
+def test_poll_deadband():
+    """Only changed values are forwarded, subject to deadbands and heartbeats."""
+    forwarded			= []
+    def process( p, v ):
+        forwarded.append( (p,v) )
+    process.done		= False
+    changes			= poll.deadband( process, absolute={ 'a': 1.0 }, percent={ 'b': 10 },
+                                         heartbeat={ 'c': .1 } )
+    assert changes.done is False
+    for p,v in [
+            ( 'a', [1.0] ), ( 'a', [1.5] ), ( 'a', [2.1] ), ( 'a', [2.5] ), ( 'a', None ), ( 'a', None ),
+            ( 'b', [100.0, 50.0] ), ( 'b', [109.0, 54.0] ), ( 'b', [109.0, 56.0] ),
+            ( 'c', [True] ), ( 'c', [True] ), ( 's', 'abc' ), ( 's', 'abc' ), ( 's', 'abd' ),
+    ]:
+        changes( p, v )
+    assert forwarded == [
+        ( 'a', [1.0] ), ( 'a', [2.1] ), ( 'a', None ),
+        ( 'b', [100.0, 50.0] ), ( 'b', [109.0, 56.0] ),
+        ( 'c', [True] ), ( 's', 'abc' ), ( 's', 'abd' ),
+    ]
+    assert changes.forwarded == 8 and changes.suppressed == 6
+    assert changes.snapshot() == { 'a': None, 'b': [109.0, 56.0], 'c': [True], 's': 'abd' }
+
+    # A heartbeat forwards the value, even if unchanged
+    time.sleep( .15 )
+    changes( 'c', [True] )
+    assert forwarded[-1] == ( 'c', [True] )
+    process.done		= True
+    assert changes.done is True
+
+    # Only changed array elements are forwarded, as a dict
+    del forwarded[:]
+    changes			= poll.deadband( process, absolute=.5, elements=True )
+    for v in ( [0, 0, 0], [0, 1, 0], [0.4, 1, 0.4], [0.8, 1, 0.4] ):
+        changes( 'e', v )
+    assert forwarded == [ ( 'e', [0, 0, 0] ), ( 'e', { 1: 1 } ), ( 'e', { 0: 0.8 } ) ]
+    assert changes.reported['e'][0] == [0.8, 1, 0]
+
+
+class struct_gateway( object ):
+    """A stand-in gateway replying to Read Tag of 'Struct' with a C*Logix STRUCT's raw USINT data (an
+    SSTRING "abc"), and of any other Tag with already decoded DINTs."""
+    class frame( object ):
+        lock			= threading.Lock()
+
+    def __init__( self, **kwds ):
+        pass
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, typ, val, tbk ):
+        return False
+
+    def close( self ):
+        pass
+
+    def operate( self, operations, **kwds ):
+        for i,op in enumerate( operations ):
+            rpy			= dotdict()
+            if op['path'][0].get( 'symbolic' ) == 'Struct':
+                rpy['read_tag.type']	= enip.STRUCT.tag_type
+                rpy['read_tag.structure_handle'] = 0x1234
+                rpy['read_tag.data']	= list( bytearray( b'\x03abc' ))
+            else:
+                rpy['read_tag.type']	= enip.DINT.tag_type
+                rpy['read_tag.data']	= [ 1000, 2 ]
+            yield i,"Read Tag",op,rpy,0,rpy['read_tag.data']
+
+
+def test_proxy_read_struct():
+    """Read Tag replies of simple CIP types are already decoded, but a STRUCT's raw data must still be
+    parsed w/ the supplied type."""
+    via				= proxy( host='localhost', gateway_class=struct_gateway, identity_default="Stub",
+                                         operations_parser=enip.client.parse_operations )
+    with via:
+        results			= list( via.read_details( [ ('Struct','SSTRING'), ('Num[0-1]','DINT'), 'Struct' ] ))
+    assert [ val for val,_ in results ] == [ [ 'abc' ], [ 1000, 2 ], [ 3, 97, 98, 99 ] ]
+    assert results[0][1][1][1] is enip.SSTRING and results[1][1][1][1] is enip.DINT
+
+
+def test_proxy_pooled():
+    """Several Threads polling at different rates share a pool of EtherNet/IP sessions via a
+    proxy_pooled; a failure closes only the failing Thread's session, and idle sessions expire.
+
+    """
+    server_addr			= ('localhost', 12403)
+    server_kwds			= dotdict({
+        'argv': [
+            '-v',
+            '--address',	'%s:%d' % server_addr,
+            'OInt=INT[10]',
+            'OReal=REAL[5]',
+        ],
+        'server': {
+            'control':	apidict( enip.timeout, {
+                'done': False
+            }),
+        },
+    })
+    server			= threading.Thread( target=enip_main, kwargs=server_kwds )
+    server.daemon		= True
+    server.start()
+
+    try:
+        time.sleep( .5 )
+        via			= proxy_pooled( host=server_addr[0], port=server_addr[1], timeout=5.0,
+                                                pool_size=2 )
+        results,failures	= [],[]
+        def poller( params, count, cycle ):
+            try:
+                for _ in range( count ):
+                    results.append( list( via.read( params )))
+                    time.sleep( cycle )
+            except Exception as exc:
+                failures.append( exc )
+        pollers			= [
+            threading.Thread( target=poller, args=( [ 'OInt[0-3]', 'OReal' ], 10, .01 )),
+            threading.Thread( target=poller, args=( [ 'OReal[1]' ], 5, .03 )),
+            threading.Thread( target=poller, args=( [ 'OInt' ], 20, .0 )),
+            threading.Thread( target=poller, args=( [ 'OInt[9]' ], 20, .0 )),
+        ]
+        for p in pollers:
+            p.start()
+        for p in pollers:
+            p.join( timeout=10.0 )
+        assert not failures
+        assert len( results ) == 10 + 5 + 20 + 20
+        stats			= via.pool_stats
+        assert stats.size == 2 and stats.busy == 0 and 1 <= stats.sessions == stats.idle <= 2
+        assert stats.created == stats.sessions and stats.closed == 0
+        assert stats.checkouts >= 2 * len( results )
+
+        # An Exception closes only this Thread's session; the next checkout lazily re-opens one
+        sessions		= stats.sessions
+        try:
+            with via:
+                raise Exception( "Failure" )
+        except Exception:
+            pass
+        assert via.pool_stats.sessions == sessions - 1 and via.pool_stats.closed == 1
+        assert list( via.read( [ 'OInt[0]' ] )) == [ [0] ]
+
+        # Idle sessions with pending input are unhealthy, and idle sessions expire
+        gateway,_		= via.pool_idle[-1]
+        gateway.list_identity()
+        time.sleep( .5 )
+        assert list( via.read( [ 'OInt[1]' ] )) == [ [0] ]
+        assert via.pool_stats.unhealthy == 1
+        via.idle_timeout	= 0.0
+        time.sleep( .1 )
+        assert list( via.read( [ 'OInt[2]' ] )) == [ [0] ]
+        stats			= via.pool_stats
+        assert stats.expired >= 1 and stats.sessions == stats.idle == 1
+        via.close_pool()
+        assert via.pool_stats.sessions == 0
+    finally:
+        server_kwds.server.control['done'] = True
+        server.join( timeout=1.0 )
+
+
 class powerflex_routed( proxy ):
     PARAMETERS			= powerflex_750_series.PARAMETERS
 
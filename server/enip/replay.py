@@ -0,0 +1,472 @@
+#! /usr/bin/env python3
+
+# 
+# Cpppo -- Communication Protocol Python Parser and Originator
+# 
+# Copyright (c) 2013, Hard Consulting Corporation.
+# 
+# Cpppo is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.  See the LICENSE file at the top of the source tree.
+# 
+# Cpppo is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+# 
+
+from __future__ import absolute_import, print_function, division
+
+__author__                      = "Perry Kundert"
+__email__                       = "perry@hardconsulting.com"
+__copyright__                   = "Copyright (c) 2013 Hard Consulting Corporation"
+__license__                     = "Dual License: GPLv3 (or later) and Commercial (see LICENSE)"
+
+__all__				= ['packets', 'segments', 'streams', 'frames', 'status', 'parse', 'replay',
+				   'main']
+
+
+"""Replay EtherNet/IP traffic from pcap/pcapng captures (eg. server/enip/captures/...), to measure
+the parser's frames per second, or to drive a (simulated) EtherNet/IP CIP device with realistic
+request workloads.
+
+    $ # Parse all the EtherNet/IP frames in the capture with enip_machine, 100 times
+    $ python -m cpppo.server.enip.replay --repeat 100 controllogix-SCADA-read-write.pcapng
+    $ # Replay the captured requests against a simulator, at 10x the recorded timing
+    $ python -m cpppo.server.enip SCADA=INT[1000] &
+    $ python -m cpppo.server.enip.replay -a localhost --factor 10 controllogix-SCADA-read-write.pcapng
+
+The capture files are read in pure Python (no libpcap or external tools are required).  Captured
+Ethernet, 802.1Q VLAN, Linux "cooked" and raw/loopback IPv4/IPv6 frames are supported; the TCP
+segments to/from the EtherNet/IP port are reassembled into streams, and split into EtherNet/IP
+encapsulation frames.
+
+When replaying requests, each captured TCP connection is replayed on its own connection to the
+target, awaiting each request's reply before sending the next.  The session handle returned by the
+target's Register Session reply is substituted into each subsequent request.
+
+"""
+
+import argparse
+import contextlib
+import logging
+import socket
+import struct
+import sys
+import threading
+import traceback
+
+from . import defaults, parser
+from .. import network
+from ...automata import chainable, log_cfg
+from ...dotdict import dotdict
+from ...misc import timer, parse_ip_port
+
+log				= logging.getLogger( "enip.rply" )
+
+LINKTYPE_NULL			= 0		# BSD loopback; host byte order address family
+LINKTYPE_ETHERNET		= 1
+LINKTYPE_RAW			= 101		# Raw IPv4/IPv6
+LINKTYPE_LOOP			= 108		# OpenBSD loopback; network byte order address family
+LINKTYPE_LINUX_SLL		= 113		# Linux "cooked" capture
+LINKTYPE_IPV4			= 228
+LINKTYPE_IPV6			= 229
+
+PCAP_MAGIC			= {
+    b'\xd4\xc3\xb2\xa1':	( '<', 1e-6 ),
+    b'\xa1\xb2\xc3\xd4':	( '>', 1e-6 ),
+    b'\x4d\x3c\xb2\xa1':	( '<', 1e-9 ),	# nanosecond resolution
+    b'\xa1\xb2\x3c\x4d':	( '>', 1e-9 ),
+}
+PCAPNG_SHB			= b'\x0a\x0d\x0d\x0a'	# Section Header Block (a palindrome)
+
+ENCAPSULATION			= 24		# EtherNet/IP encapsulation header size
+REGISTER_SESSION		= 0x0065
+UNREGISTER_SESSION		= 0x0066
+NO_REPLY			= ( 0x0000, UNREGISTER_SESSION ) # NOP and Unregister Session have no reply
+
+
+def packets( source ):
+    """Yield (<timestamp>,<linktype>,<data>) for each packet in the pcap or pcapng 'source' (a
+    filename, or a binary file object).  Packets of a pcapng Simple Packet Block have no recorded
+    timestamp; they are given that of the preceding packet.
+
+    """
+    if not hasattr( source, 'read' ):
+        with open( source, 'rb' ) as f:
+            for pkt in packets( f ):
+                yield pkt
+        return
+
+    magic			= source.read( 4 )
+    if magic in PCAP_MAGIC:
+        order,resolution	= PCAP_MAGIC[magic]
+        _,_,_,_,_,linktype	= struct.unpack( order + 'HHiIII', source.read( 20 ))
+        record			= struct.Struct( order + 'IIII' )
+        while True:
+            hdr			= source.read( record.size )
+            if len( hdr ) < record.size:
+                return
+            sec,frac,incl,_	= record.unpack( hdr )
+            yield sec + frac * resolution, linktype, source.read( incl )
+    if magic != PCAPNG_SHB:
+        raise ValueError( "Not a pcap or pcapng capture; magic %r" % magic )
+
+    # pcapng; a series of Blocks.  Each Section Header Block establishes the byte order (and
+    # resets the Interfaces) for the Blocks that follow it.
+    order			= '<'
+    interfaces			= []		# [(<linktype>,<resolution>), ...]
+    when			= 0.0
+    while magic:
+        if magic == PCAPNG_SHB:
+            length,bom		= source.read( 4 ), source.read( 4 )
+            order		= '<' if bom == b'\x4d\x3c\x2b\x1a' else '>'
+            length,		= struct.unpack( order + 'I', length )
+            body		= source.read( length - 16 )
+            interfaces		= []
+        else:
+            btype,length	= struct.unpack( order + 'II', magic + source.read( 4 ))
+            body		= source.read( length - 12 )
+            if btype == 1:			# Interface Description Block
+                linktype,_,_	= struct.unpack( order + 'HHI', body[:8] )
+                resolution	= 1e-6
+                for code,value in options( body[8:], order ):
+                    if code == 9:		# if_tsresol
+                        exp	= bytearray( value )[0]
+                        resolution = 2.0 ** -( exp & 0x7F ) if exp & 0x80 else 10.0 ** -exp
+                interfaces.append( (linktype,resolution) )
+            elif btype in ( 2, 6 ):		# (obsolete) Packet Block, Enhanced Packet Block
+                if btype == 6:
+                    ifc,hi,lo,incl,_ = struct.unpack( order + 'IIIII', body[:20] )
+                else:
+                    ifc,_,hi,lo,incl,_ = struct.unpack( order + 'HHIIII', body[:20] )
+                linktype,resolution = interfaces[ifc]
+                when		= ( hi << 32 | lo ) * resolution
+                yield when, linktype, body[20:20+incl]
+            elif btype == 3:			# Simple Packet Block
+                orig,		= struct.unpack( order + 'I', body[:4] )
+                linktype,_	= interfaces[0]
+                yield when, linktype, body[4:4+min( orig, len( body ) - 4 )]
+        source.read( 4 )			# trailing Block Total Length
+        magic			= source.read( 4 )
+
+
+def options( data, order ):
+    """Yield the (<code>,<value>) pcapng options in 'data', 'til opt_endofopt."""
+    offset			= 0
+    while offset + 4 <= len( data ):
+        code,length		= struct.unpack( order + 'HH', data[offset:offset+4] )
+        if code == 0:
+            return
+        yield code, data[offset+4:offset+4+length]
+        offset		       += 4 + ( length + 3 ) // 4 * 4
+
+
+def segments( pkts ):
+    """Decode the link, IPv4/IPv6 and TCP layers of each (<timestamp>,<linktype>,<data>) packet,
+    yielding (<timestamp>,<source>,<destination>,<sequence>,<flags>,<payload>) for each TCP segment,
+    where <source>/<destination> are (<ip>,<port>) addresses.  Packets that are not (unfragmented)
+    TCP are ignored.
+
+    """
+    for when,linktype,data in pkts:
+        data			= memoryview( data )
+        if linktype == LINKTYPE_ETHERNET:
+            ethertype,		= struct.unpack( '>H', data[12:14] )
+            data		= data[14:]
+            while ethertype in ( 0x8100, 0x88A8 ):	# 802.1Q/802.1ad VLAN tag(s)
+                ethertype,	= struct.unpack( '>H', data[2:4] )
+                data		= data[4:]
+        elif linktype == LINKTYPE_LINUX_SLL:
+            ethertype,		= struct.unpack( '>H', data[14:16] )
+            data		= data[16:]
+        elif linktype in ( LINKTYPE_NULL, LINKTYPE_LOOP, LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6 ):
+            if linktype in ( LINKTYPE_NULL, LINKTYPE_LOOP ):
+                data		= data[4:]	# address family; deduce IPv4/6 from the version
+            ethertype		= { 4: 0x0800, 6: 0x86DD }.get( data[0] >> 4 if len( data ) else None )
+        else:
+            continue
+
+        if ethertype == 0x0800 and len( data ) >= 20:
+            ihl			= ( data[0] & 0x0F ) * 4
+            total,frag,proto	= struct.unpack( '>H2xHxB', data[2:10] )
+            if proto != 6 or frag & 0x3FFF:	# Not TCP, or a fragment (MF, or non-zero offset)
+                continue
+            src,dst		= ( socket.inet_ntop( socket.AF_INET, data[o:o+4].tobytes() ) for o in ( 12, 16 ))
+            data		= data[ihl:total]	# exclude any link-layer padding
+        elif ethertype == 0x86DD and len( data ) >= 40:
+            length,proto	= struct.unpack( '>HB', data[4:7] )
+            if proto != 6:			# Not TCP (or has extension headers)
+                continue
+            src,dst		= ( socket.inet_ntop( socket.AF_INET6, data[o:o+16].tobytes() ) for o in ( 8, 24 ))
+            data		= data[40:40+length]
+        else:
+            continue
+
+        if len( data ) < 20:
+            continue
+        sport,dport,seq,off,flags = struct.unpack( '>HHI4xBB', data[:14] )
+        yield when, (src,sport), (dst,dport), seq, flags, data[( off >> 4 ) * 4:].tobytes()
+
+
+def streams( segs ):
+    """Reassemble each direction of the TCP connections in the segments, discarding retransmitted
+    data, and yield (<timestamp>,<source>,<destination>,<data>) as each in-order run of data becomes
+    available.  Out-of-order segments are held 'til the missing data arrives.
+
+    """
+    expect			= {}		# { (<source>,<destination>): <sequence>, ... }
+    pending			= {}		# { (<source>,<destination>): { <sequence>: <payload>, ... }, ... }
+    for when,src,dst,seq,flags,payload in segs:
+        flow			= (src,dst)
+        if flags & 0x02:			# SYN; data begins at the next sequence number
+            expect[flow]	= ( seq + 1 ) & 0xFFFFFFFF
+            pending[flow]	= {}
+            continue
+        if not payload:
+            continue
+        if flow not in expect:			# Capture began mid-connection
+            expect[flow]	= seq
+            pending[flow]	= {}
+        held			= pending[flow]
+        held[seq]		= max( payload, held.get( seq, b'' ), key=len )
+        data			= b''
+        nxt			= expect[flow]
+        while held:
+            # Find a held segment containing the next expected sequence number
+            for beg in list( held ):
+                skip		= ( nxt - beg ) & 0xFFFFFFFF
+                if skip < 0x80000000:		# segment begins at/before nxt
+                    seg		= held.pop( beg )
+                    if skip < len( seg ):
+                        data   += seg[skip:]
+                        nxt	= ( beg + len( seg )) & 0xFFFFFFFF
+                    break
+            else:
+                break
+        expect[flow]		= nxt
+        if data:
+            yield when, src, dst, data
+
+
+def frames( source, port=None ):
+    """Yield (<timestamp>,<request>,<connection>,<frame>) for each EtherNet/IP encapsulation frame
+    sent to/from the EtherNet/IP 'port' (default: 44818) in the pcap/pcapng 'source'.  A <request> is
+    True for a frame sent to the port (ie. from the client); the <connection> is the client's
+    (<source>,<destination>) addresses, for both requests and replies.
+
+    """
+    if port is None:
+        port			= defaults.address[1]
+    buffers			= {}
+    for when,src,dst,data in streams(
+            seg for seg in segments( packets( source ))
+            if port in ( seg[1][1], seg[2][1] )):
+        request			= dst[1] == port
+        conn			= (src,dst) if request else (dst,src)
+        buf			= buffers.setdefault( (src,dst), bytearray() )
+        buf		       += data
+        while len( buf ) >= ENCAPSULATION:
+            length,		= struct.unpack( '<H', buf[2:4] )
+            if len( buf ) < ENCAPSULATION + length:
+                break
+            yield when, request, conn, bytes( buf[:ENCAPSULATION + length] )
+            del buf[:ENCAPSULATION + length]
+
+
+def status( frame ):
+    """Return the (<encapsulation>,<CIP>) status of an EtherNet/IP reply frame.  The CIP general
+    status is None, if the reply doesn't carry a CIP Message Router reply in its (last) CPF item."""
+    command,length,_,encap	= struct.unpack( '<HHII', frame[:12] )
+    cip				= None
+    if command in ( 0x006F, 0x0070 ) and len( frame ) >= ENCAPSULATION + 8:
+        # SendRRData/SendUnitData: interface handle, timeout, CPF item count and items
+        offset			= ENCAPSULATION + 6
+        items,			= struct.unpack( '<H', frame[offset:offset+2] )
+        offset		       += 2
+        typ,size		= None,0
+        for _ in range( items ):
+            typ,size		= struct.unpack( '<HH', frame[offset:offset+4] )
+            offset	       += 4 + size
+        if typ in ( 0x00B1, 0x00B2 ):
+            beg			= offset - size + ( 2 if typ == 0x00B1 else 0 ) # connected data has a sequence no.
+            if beg + 3 <= offset:
+                cip		= bytearray( frame[beg+2:beg+3] )[0]
+    return encap, cip
+
+
+def parse( frms, repeat=1 ):
+    """Parse the EtherNet/IP frames (eg. from frames(...)) 'repeat' times with an enip_machine, as
+    fast as possible, returning the number of frames parsed."""
+    stream			= b''.join( frm for _,_,_,frm in frms ) if not isinstance( frms, bytes ) else frms
+    parsed			= 0
+    with parser.enip_machine( context='enip' ) as machine:
+        for _ in range( repeat ):
+            source		= chainable( stream )
+            while source.peek() is not None:
+                data		= dotdict()
+                with contextlib.closing( machine.run( source=source, data=data )) as engine:
+                    for m,s in engine:
+                        pass
+                assert 'enip.command' in data, \
+                    "Failed to parse EtherNet/IP frame at offset %d" % ( source.sent )
+                parsed	       += 1
+    return parsed
+
+
+def replay( frms, address, factor=None, timeout=None ):
+    """Replay the request side of the EtherNet/IP frames (eg. from frames(...)) against the target
+    'address', returning a dotdict of the number of .requests sent and .replies received, the number
+    of .failures (replies with a non-zero encapsulation or CIP status, or requests that failed to
+    get a reply), the .latency (the total request/reply round-trip time) and .elapsed time.
+
+    If a 'factor' is supplied, each request is sent no earlier than its recorded time (relative to
+    the first request), sped up by 'factor' (eg. 1.0 for the recorded timing, 10.0 for 10x);
+    otherwise, as soon as the prior request's reply is received.  Each captured connection is
+    replayed on its own connection to 'address' (in its own Thread).
+
+    """
+    if timeout is None:
+        timeout			= defaults.timeout
+    connections			= {}
+    for when,request,conn,frm in frms:
+        if request:
+            connections.setdefault( conn, [] ).append( (when,frm) )
+    epoch			= min( [ reqs[0][0] for reqs in connections.values() ] or [ 0.0 ] )
+    stats			= dotdict( requests=0, replies=0, failures=0, latency=0.0 )
+    lock			= threading.Lock()
+
+    def connection( requests, started ):
+        sent,rcvd,fail,lat	= 0,0,0,0.0
+        try:
+            with contextlib.closing( socket.create_connection( address, timeout=timeout )) as conn:
+                conn.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+                receiver	= network.receiver( conn )
+                buf		= bytearray()
+                session		= None
+                for when,frm in requests:
+                    if factor:
+                        delay	= started + ( when - epoch ) / factor - timer()
+                        if delay > 0:
+                            threading.Event().wait( delay )
+                    command,	= struct.unpack( '<H', frm[:2] )
+                    if session is not None and command != REGISTER_SESSION:
+                        frm	= frm[:4] + session + frm[8:]
+                    begun	= timer()
+                    conn.sendall( frm )
+                    sent       += 1
+                    if command in NO_REPLY:
+                        continue
+                    # Receive the (complete) reply frame
+                    while len( buf ) < ENCAPSULATION or len( buf ) < ENCAPSULATION + struct.unpack( '<H', buf[2:4] )[0]:
+                        data	= receiver.recv( timeout=max( 0, begun + timeout - timer() ))
+                        if not data:
+                            raise IOError( "No reply to request %d: %s" % (
+                                sent, "EOF" if data is not None else "Timeout" ))
+                        buf    += data
+                    length	= ENCAPSULATION + struct.unpack( '<H', buf[2:4] )[0]
+                    rpy		= bytes( buf[:length] )
+                    del buf[:length]
+                    lat	       += timer() - begun
+                    rcvd       += 1
+                    if command == REGISTER_SESSION:
+                        session	= rpy[4:8]
+                    encap,cip	= status( rpy )
+                    if encap or cip:
+                        log.info( "Request %d failed: encapsulation status %d, CIP status %s",
+                                  sent, encap, cip )
+                        fail   += 1
+        except Exception as exc:
+            log.warning( "Replay to %s:%s failed: %s", address[0], address[1], exc )
+            log.info( "%s", traceback.format_exc() )
+            fail	       += 1
+        with lock:
+            stats.requests     += sent
+            stats.replies      += rcvd
+            stats.failures     += fail
+            stats.latency      += lat
+
+    started			= timer()
+    threads			= [ threading.Thread( target=connection, args=( requests, started ))
+                                    for requests in connections.values() ]
+    for t in threads:
+        t.daemon		= True
+        t.start()
+    for t in threads:
+        t.join()
+    stats.elapsed		= timer() - started
+    return stats
+
+
+def main( argv=None ):
+    """Parse (or replay the requests of) the EtherNet/IP frames in the pcap/pcapng capture(s)."""
+    ap				= argparse.ArgumentParser(
+        description = "Replay EtherNet/IP frames from pcap/pcapng captures",
+        epilog = """\
+
+Without an --address, parses all the EtherNet/IP frames in the capture(s) with
+an enip_machine as fast as possible, reporting the frames per second.  With an
+--address, replays the captured requests against the EtherNet/IP CIP device
+(eg. a simulator), as fast as possible or at the recorded timing sped up by
+--factor. """ )
+    ap.add_argument( '-v', '--verbose', action="count",
+                     default=0,
+                     help="Display logging information." )
+    ap.add_argument( '-p', '--port', type=int,
+                     default=defaults.address[1],
+                     help="EtherNet/IP port of the captured traffic (default: %d)" % defaults.address[1] )
+    ap.add_argument( '-a', '--address',
+                     default=None,
+                     help="EtherNet/IP interface[:port] to replay the requests to (default: None)" )
+    ap.add_argument( '-f', '--factor', type=float,
+                     default=None,
+                     help="Replay at the recorded timing sped up by factor (default: as fast as possible)" )
+    ap.add_argument( '-r', '--repeat', type=int,
+                     default=1,
+                     help="Parse/replay the capture(s) this many times (default: 1)" )
+    ap.add_argument( '-t', '--timeout', type=float,
+                     default=defaults.timeout,
+                     help="EtherNet/IP timeout (default: %ss)" % defaults.timeout )
+    ap.add_argument( 'capture', nargs="+",
+                     help="pcap/pcapng capture file(s)" )
+    args			= ap.parse_args( argv )
+
+    levelmap 			= {
+        0: logging.WARNING,
+        1: logging.NORMAL,
+        2: logging.DETAIL,
+        3: logging.INFO,
+        4: logging.DEBUG,
+        }
+    log_cfg['level']		= ( levelmap[args.verbose]
+                                    if args.verbose in levelmap
+                                    else logging.DEBUG )
+    logging.basicConfig( **log_cfg )
+
+    failures			= 0
+    for capture in args.capture:
+        frms			= list( frames( capture, port=args.port ))
+        print( "%s: %d EtherNet/IP frames (%d requests) in %d connections" % (
+            capture, len( frms ), sum( 1 for _,r,_,_ in frms if r ),
+            len( set( c for _,_,c,_ in frms ))))
+        if not args.address:
+            begun		= timer()
+            parsed		= parse( frms, repeat=args.repeat )
+            elapsed		= timer() - begun
+            print( "%s: %d frames parsed in %7.3fs; %9.1f frames/s" % (
+                capture, parsed, elapsed, parsed / max( elapsed, 1e-9 )))
+            continue
+        address			= parse_ip_port( args.address, default=defaults.address )
+        address			= ( str( address[0] ), address[1] or defaults.address[1] )
+        for _ in range( args.repeat ):
+            stats		= replay( frms, address, factor=args.factor, timeout=args.timeout )
+            print( "%s: %d requests, %d replies, %d failures in %7.3fs; %9.1f requests/s, %7.3fms avg. latency" % (
+                capture, stats.requests, stats.replies, stats.failures, stats.elapsed,
+                stats.requests / max( stats.elapsed, 1e-9 ),
+                stats.latency * 1000 / max( stats.replies, 1 )))
+            failures	       += stats.failures
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
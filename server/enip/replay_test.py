@@ -0,0 +1,79 @@
+from __future__ import absolute_import, print_function, division
+
+import os
+import struct
+import threading
+import time
+
+from ...dotdict import apidict
+from . import defaults, device, logix, replay
+from .main import main as enip_main
+
+capture				= os.path.join( os.path.dirname( __file__ ), 'captures', 'controllogix-SCADA-read-write.pcapng' )
+
+
+def test_replay_frames( tmp_path ):
+    frms			= list( replay.frames( capture ))
+    assert len( frms ) == 14
+    # Alternating request/reply, all on the one captured connection, beginning w/ Register Session
+    assert [ req for _,req,_,_ in frms ] == [ True, False ] * 7
+    assert len( set( conn for _,_,conn,_ in frms )) == 1
+    assert frms[0][3][:2] == b'\x65\x00' and len( frms[0][3] ) == 28
+    assert all( replay.status( frm ) == ( 0, 0 ) for _,req,_,frm in frms[3::2] )
+    assert all( b <= a for (b,_,_,_),(a,_,_,_) in zip( frms, frms[1:] ))
+
+    # The same packets, in a classic (microsecond) pcap capture
+    pcap			= str( tmp_path / "capture.pcap" )
+    with open( pcap, 'wb' ) as f:
+        f.write( struct.pack( '<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, replay.LINKTYPE_ETHERNET ))
+        for when,linktype,data in replay.packets( capture ):
+            f.write( struct.pack( '<IIII', int( when ), int( round( when % 1 * 1e6 )), len( data ), len( data )))
+            f.write( data )
+    assert [ frm for _,_,_,frm in replay.frames( pcap ) ] == [ frm for _,_,_,frm in frms ]
+
+
+def test_replay_streams():
+    """Retransmitted, overlapping and out-of-order segments are reassembled in order."""
+    src,dst			= ('10.0.0.1', 1234), ('10.0.0.2', 44818)
+    segs			= [
+        ( 1.0, src, dst, 999, 0x02, b'' ),		# SYN; data begins at 1000
+        ( 1.1, src, dst, 1000, 0x18, b'abc' ),
+        ( 1.2, src, dst, 1006, 0x18, b'ghi' ),		# out of order
+        ( 1.3, src, dst, 1000, 0x18, b'abc' ),		# retransmitted
+        ( 1.4, src, dst, 1002, 0x18, b'cdef' ),		# overlapping
+        ( 1.5, src, dst, 1009, 0x18, b'j' ),
+    ]
+    assert [ (when,data) for when,_,_,data in replay.streams( segs ) ] == [
+        ( 1.1, b'abc' ), ( 1.4, b'defghi' ), ( 1.5, b'j' ) ]
+
+
+def test_replay_parse():
+    frms			= list( replay.frames( capture ))
+    assert replay.parse( frms, repeat=3 ) == 3 * len( frms )
+
+
+def test_replay_simulator():
+    """Replay the captured requests against a simulated Logix Controller w/ the captured SCADA tag."""
+    device.lookup_reset()
+    logix.setup_reset()
+    control			= apidict( defaults.timeout, done=False )
+    server			= threading.Thread( target=enip_main, kwargs=dict(
+        argv	= [ '--address', 'localhost:0', 'SCADA=INT[1000]' ],
+        server	= dict( control=control )))
+    server.daemon		= True
+    server.start()
+    try:
+        while 'address' not in control:
+            assert server.is_alive()
+            time.sleep( .01 )
+        frms			= list( replay.frames( capture ))
+        stats			= replay.replay( frms, control['address'] )
+        assert stats.requests == stats.replies == 7 and stats.failures == 0
+
+        # The requests span ~.6s; at 4x the recorded timing, the replay should take ~.15s
+        stats			= replay.replay( frms, control['address'], factor=4.0 )
+        assert stats.failures == 0
+        assert .14 < stats.elapsed < 1.0, "Replay at 4x took %.3fs" % stats.elapsed
+    finally:
+        control['done']		= True
+        server.join( timeout=defaults.timeout )
@@ -296,7 +296,8 @@ class UCMM( device.Object ):
                             if target not in self.route_conn:
                                 log.normal( "UCMM: port/link %s --> %r; creating route w/ timeout %fms", portlink, target, timeoutms )
                                 self.route_conn[target] \
-                                        = client.connector( host=target[0], port=target[1], timeout=timeout )
+                                        = client.connector( host=target[0], port=target[1], timeout=timeout,
+                                                            lazy=True ) # replies are forwarded undecoded
                             with self.route_conn[target] as conn:
                                 # Trim route_path; if empty, send with no route_path (Simple; no routing
                                 # encapsulation).  Otherwise, send with remaining route_path.
@@ -108,6 +108,46 @@ def recvfrom( conn, maxlen=4*1024 ):
     return msg,frm
 
 
+class receiver( object ):
+    """Receive from a socket via recv_into a large, reusable per-connection buffer (default: 64KB), avoiding
+    the allocation of a new bytes object (and the chaining of many small chunks into the parser
+    source) for each block of input received.  Each recv/recvfrom accepts the same optional
+    timeout= keyword parameter as the recv/recvfrom functions, and returns None if no data is
+    received within timeout, or otherwise a memoryview slice of the buffer; zero length data (or
+    socket error) implies EOF.
+
+    The memoryview returned is only valid 'til the next recv/recvfrom; it must be consumed (eg. by
+    a parser, from the chainable source it was supplied to) or copied before receiving again.
+
+    """
+    def __init__( self, conn, size=None ):
+        self.conn		= conn
+        self.size		= size or 64*1024
+        self.buffer		= bytearray( self.size )
+        self.view		= memoryview( self.buffer )
+
+    def fileno( self ):
+        return self.conn.fileno()
+
+    @readable( default=None )
+    def recv( self ):
+        try:
+            siz			= self.conn.recv_into( self.buffer ) # 0 (EOF) or size of data
+        except socket.error as exc: # No connection; same as EOF
+            log.debug( "recv %s: %r", self.conn, exc )
+            siz			= 0
+        return self.view[:siz]
+
+    @readable( default=(None,None) )
+    def recvfrom( self ):
+        try:
+            siz,frm		= self.conn.recvfrom_into( self.buffer ) # 0 (EOF) or size of data
+        except socket.error as exc: # No connection; same as EOF
+            log.debug( "recv %s: %r", self.conn, exc )
+            siz,frm		= 0,None
+        return self.view[:siz],frm
+
+
 @readable()
 def accept( conn ):
     return conn.accept()
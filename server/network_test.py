@@ -10,7 +10,7 @@ import multiprocessing
 import socket
 import time
 
-from .network import soak, bench
+from .network import soak, bench, receiver
 from ..dotdict import dotdict, apidict
 
 log				= logging.getLogger( "soak" )
@@ -30,6 +30,30 @@ def test_soak_basic():
     assert rf.read() == 'abc\n'
 
 
+
+def test_receiver():
+    """A receiver recv_into's its reusable buffer, returning memoryview slices (None on timeout, empty
+    on EOF); large payloads arrive in few chunks.
+
+    """
+    r,w				= socket.socketpair()
+    rcv				= receiver( r, size=64*1024 )
+    assert rcv.recv( timeout=0 ) is None
+
+    payload			= bytes( bytearray( i % 251 for i in range( 40000 )))
+    w.sendall( payload )
+    received			= b''
+    while len( received ) < len( payload ):
+        msg			= rcv.recv( timeout=1.0 )
+        assert isinstance( msg, memoryview ) and len( msg )
+        assert msg.obj is rcv.buffer
+        received	       += bytes( msg ) # must consume before the next recv
+    assert received == payload
+
+    w.close()
+    msg				= rcv.recv( timeout=1.0 )
+    assert msg is not None and len( msg ) == 0 # EOF
+
 soak_address			= ("127.0.0.1", 12345)
 
 def bench_cli( n, address=None ):
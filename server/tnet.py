@@ -64,6 +64,10 @@ TYPE     A character indicating what type the DATA is.  Each TYPE is used to
    }    Dictionary which you recurse into to fill with key=value pairs inside the payload contents.
    ]    List which you recurse into to fill with values of any type.
 
+    The DFA frames each tnetstring; the payloads of the nested '}' and ']' types (and '^', '!') are
+    decoded by tnetraw.payload.  See tnetraw for a server that frames tnetstrings directly from
+    its receive buffer, without running the DFA over each byte.
+
 """
 
 import argparse
@@ -72,7 +76,7 @@ import logging
 import sys
 
 import cpppo
-from   cpppo.server import network
+from   cpppo.server import network, tnetraw
 
 address				= ('', 8008)
 
@@ -127,7 +131,10 @@ def tnet_machine( name="TNET", context="tnet" ):
                 assert 0 == len( src )
                 data[ours]	= None
             else:
-                assert False, "Invalid tnetstring type: %s" % tntype
+                # '}', ']', '!', '^'; decode the (nested) payload directly
+                data[ours]	= tnetraw.payload( src, tntype )
+                log.info("%5d %-6s data: %s == %s", len( src ), chr( tntype ), cpppo.reprlib.repr( src ),
+                         cpppo.reprlib.repr( data[ours] ))
                 
     bytes_conf 			= {
         "alphabet":	cpppo.type_bytes_iter,
@@ -170,6 +177,7 @@ def tnet_from( conn, addr,
     """
     if source is None:
         source			= cpppo.chainable()
+    receiver			= network.receiver( conn ) # only receives when source is exhausted
     with tnet_machine( "tnet_%s" % addr[1] ) as engine:
         eof			= False
         while not ( eof or ( control and control.get( 'done' ))):
@@ -191,7 +199,7 @@ def tnet_from( conn, addr,
                     log.info( "%s: After %7.3fs, awaiting symbols (after %d processed) w/ %s recv timeout",
                               engine.name_centered(), duration, source.sent,
                               remains if remains is None else ( "%7.3fs" % remains ))
-                    msg		= network.recv( conn, timeout=remains )
+                    msg		= receiver.recv( timeout=remains )
                     duration	= cpppo.timer() - started
                     if msg is None and timeout is not None and duration >= timeout:
                         # No data w/in given timeout expiry!  Inform the consumer, and then try again w/ fresh timeout.
@@ -207,7 +215,7 @@ def tnet_from( conn, addr,
                 eof		= len( msg ) == 0
                 log.info( "%s: After %7.3fs, recv: %5d: %s",
                           engine.name_centered(), duration, len( msg ),
-                          'EOF' if eof else cpppo.reprlib.repr( msg ))
+                          'EOF' if eof else cpppo.reprlib.repr( bytes( msg )))
                 if eof:
                     break
                 source.chain( msg )
@@ -18,8 +18,7 @@ import traceback
 
 import cpppo
 from   cpppo        import misc
-from   cpppo.server import network, tnet, tnetstrings
-#from   cpppo.server import network, tnetraw as tnet, tnetstrings # test tnetraw.py instead
+from   cpppo.server import network, tnet, tnetraw, tnetstrings
 
 #logging.basicConfig( **cpppo.log_cfg )
 log				= logging.getLogger( "tnet.cli")
@@ -87,6 +86,48 @@ def test_tnet_string():
     assert successes == len( testvec )
 
 
+tnet_nested			= [
+    None, True, False, 0, -12, 3.25, 1e300, b'', b'abc', "The π character",
+    { "a": [ 1, 2.5, { "x": None } ], "b": b'\x00' },
+    [], {}, [[[]]],
+]
+
+@pytest.mark.skipif( not hasattr( tnet, 'tnet_machine' ), reason="tnet missing cpppo automata 'tnet_machine'" )
+def test_tnet_nested():
+    """The DFA recognizes every tnetstring type, including the nested types."""
+    for t in tnet_nested:
+        with tnet.tnet_machine() as tnsmach:
+            data		= cpppo.dotdict()
+            source		= cpppo.peekable( tnetstrings.dump( t ))
+            for mch, sta in tnsmach.run( source=source, data=data, path="test_tnet" ):
+                pass
+            assert sta is not None and sta.terminal and source.peek() is None
+            assert data.test_tnet.tnet.type.input == t
+
+
+def test_tnetraw_codec():
+    """The buffer-based encoder/decoder agrees with the reference tnetstrings implementation."""
+    for t in tnet_nested + [ ( 1, 2 ) ]:
+        enc			= tnetraw.encode( t )
+        assert enc == tnetstrings.dump( t )
+        assert tnetraw.decode( enc ) == ( tnetstrings.parse( enc )[0], len( enc ))
+        assert tnetraw.decode( enc[:-1] ) is None			# incomplete
+    assert tnetraw.decode( b'junk5:hello,', offset=4 ) == ( b'hello', 12 )
+    assert tnetraw.payload( b'1:1#2:ab,', b']' ) == [ 1, b'ab' ]
+    for bad in ( b'x:a,', b'1234567890:', b'3:abc?', b'4:trux!', b'1:a}' ):
+        with pytest.raises( AssertionError ):
+            tnetraw.decode( bad )
+
+    # Framing across arbitrary receive boundaries
+    dec				= tnetraw.decoder( ignore=b'\n' )
+    blob			= b''.join( tnetraw.encode( t ) + b'\n' for t in tnet_nested )
+    msgs			= []
+    for i in range( 0, len( blob ), 3 ):
+        dec.feed( blob[i:i+3] )
+        msgs.extend( dec )
+    assert msgs == tnet_nested and len( dec ) == 0
+
+
 client_count			= 15
 charrange, chardelay		= (2,10), .01	# split/delay outgoing msgs
 draindelay			= 2.0  		# long in case server slow, but immediately upon EOF
@@ -98,6 +139,8 @@ tnet_cli_kwds			= {
         str("a"),
         9999999,
         None,
+        3.25,
+        True,
     ],
 }
 
@@ -167,7 +210,7 @@ def tnet_cli( number, tests=None, address=None ):
     return failed
 
 
-def tnet_bench():
+def tnet_bench( server=tnet ):
     with multiprocessing.Manager() as m:
         tnet_svr_kwds		= dict(
             argv	= [
@@ -182,7 +225,7 @@ def tnet_bench():
         )
 
         failed			= cpppo.server.network.bench(
-            server_func	= tnet.main,
+            server_func	= server.main,
             server_kwds	= tnet_svr_kwds,
             client_func	= tnet_cli,
             client_kwds	= tnet_cli_kwds,
@@ -200,3 +243,7 @@ def tnet_bench():
 
 def test_tnet_bench():
     assert not tnet_bench(), "One or more tnet_banch clients reported failure"
+
+
+def test_tnetraw_bench():
+    assert not tnet_bench( server=tnetraw ), "One or more tnetraw bench clients reported failure"
@@ -26,6 +26,22 @@ __email__                       = "perry@dominionrnd.com"
 __copyright__                   = "Copyright (c) 2020 Dominion R&D Corp."
 __license__                     = "Dual License: GPLv3 (or later) and Commercial (see LICENSE)"
 
+"""
+tnetraw		-- A server accepting tnetstrings, parsed directly from a buffer
+
+USAGE
+    python -m cpppo.server.tnetraw
+
+    Received data is accumulated in a bytearray; each tnetstring's SIZE prefix is found with
+    bytearray.find, and its payload is decoded in place via memoryview slices -- recursively, for
+    the nested '}' (dict) and ']' (list) types.  The same encode/decode are usable directly:
+
+        data			= encode( { "pi": 3.14, "ok": True, "l": [ 1, None, b'raw' ] } )
+        value,end		= decode( data )
+
+"""
+__all__				= [ 'encode', 'decode', 'payload', 'decoder', 'tnet_from', 'tnet_server_json' ]
+
 import argparse
 import json
 import logging
@@ -38,14 +54,180 @@ address			= ('', 8008)
 
 log			= logging.getLogger( 'tnetraw' )
 
+SIZE_MAX		= 9		# The maximum digits in a tnetstring SIZE
+
+
+def _encode( data, out, encoding ):
+    """Append the bytes encoding data to the list out; returns the total length appended."""
+    if data is None:
+        out.append( b'0:~' )
+        return 3
+    if data is True or data is False:
+        raw,typ			= ( b'true' if data else b'false' ),b'!'
+    elif isinstance( data, int ):
+        raw,typ			= str( data ).encode( 'ascii' ),b'#'
+    elif isinstance( data, float ):
+        raw,typ			= repr( data ).encode( 'ascii' ),b'^'
+    elif isinstance( data, (bytes,bytearray,memoryview) ):
+        raw,typ			= data,b','
+    elif isinstance( data, cpppo.type_str_base ):
+        raw,typ			= data.encode( encoding ),b'$'
+    elif isinstance( data, (dict,list,tuple) ):
+        # Encode the contents first (without joining them), to learn the payload SIZE
+        parts			= []
+        if isinstance( data, dict ):
+            size		= sum( _encode( str( k ).encode( 'ascii' ), parts, encoding )
+                                       + _encode( v, parts, encoding ) for k,v in data.items() )
+            typ			= b'}'
+        else:
+            size		= sum( _encode( v, parts, encoding ) for v in data )
+            typ			= b']'
+        pre			= ( '%d:' % size ).encode( 'ascii' )
+        out.append( pre )
+        out.extend( parts )
+        out.append( typ )
+        return len( pre ) + size + 1
+    else:
+        raise TypeError( "Cannot encode a %s as a tnetstring" % type( data ).__name__ )
+    pre				= ( '%d:' % len( raw )).encode( 'ascii' )
+    out.extend( ( pre, raw, typ ))
+    return len( pre ) + len( raw ) + 1
+
+
+def encode( data, encoding='utf-8' ):
+    """Encode data (None, bool, int, float, bytes, str, and dicts/lists/tuples thereof) as a
+    tnetstring.  Each part is encoded once, and all are joined (copied) exactly once."""
+    out				= []
+    _encode( data, out, encoding )
+    return b''.join( out )
+
+
+def _frame( buf, offset, limit ):
+    """Find the tnetstring in buf[offset:limit], returning (<beg>,<end>,<type>) of its payload
+    buf[beg:end], or None if it is not yet complete."""
+    colon			= buf.find( b':', offset, min( limit, offset + SIZE_MAX + 1 ))
+    if colon < 0:
+        assert limit - offset <= SIZE_MAX, \
+            "Expected TNET <size> separator ':', not %r" % ( bytes( buf[offset:offset + SIZE_MAX + 1] ))
+        return None
+    size			= buf[offset:colon]
+    assert size.isdigit(), "Expected TNET size digits, not %r" % ( bytes( size ))
+    end				= colon + 1 + int( size )
+    if end >= limit:
+        return None
+    return colon + 1, end, buf[end]
+
+
+def _decode( buf, view, offset, limit, encoding ):
+    """Decode the (complete) tnetstring at buf[offset:limit], returning value,end."""
+    found			= _frame( buf, offset, limit )
+    assert found, "Incomplete TNET payload at offset %d" % ( offset )
+    beg,end,typ			= found
+    return _value( buf, view, beg, end, typ, encoding ),end + 1
+
+
+def _value( buf, view, beg, end, typ, encoding ):
+    """Decode the tnetstring payload buf[beg:end] of type typ (an int symbol)."""
+    if typ == 0x2C:	# ','
+        return view[beg:end].tobytes()
+    if typ == 0x24:	# '$'
+        return str( view[beg:end], encoding )
+    if typ == 0x23:	# '#'
+        return int( view[beg:end] )
+    if typ == 0x5E:	# '^'
+        return float( view[beg:end] )
+    if typ == 0x21:	# '!'
+        assert view[beg:end] in ( b'true', b'false' ), "Invalid TNET boolean %r" % ( view[beg:end].tobytes() )
+        return view[beg:end] == b'true'
+    if typ == 0x7E:	# '~'
+        assert beg == end, "Payload must be 0 length for null"
+        return None
+    if typ == 0x5D:	# ']'
+        result			= []
+        while beg < end:
+            value,beg		= _decode( buf, view, beg, end, encoding )
+            result.append( value )
+        return result
+    if typ == 0x7D:	# '}'
+        result			= {}
+        while beg < end:
+            key,beg		= _decode( buf, view, beg, end, encoding )
+            assert beg < end, "Unbalanced TNET dictionary"
+            assert isinstance( key, (bytes,cpppo.type_str_base) ), \
+                "TNET dictionary keys must be string data, not %r" % ( key, )
+            result[key.decode( 'ascii' ) if isinstance( key, bytes ) else key],beg \
+				= _decode( buf, view, beg, end, encoding )
+        return result
+    raise AssertionError( "Invalid TNET payload type: %r" % ( bytes( bytearray( [ typ ] ))))
+
+
+def decode( buf, offset=0, encoding='utf-8' ):
+    """Decode the tnetstring at buf[offset:] (bytes or bytearray), returning value,end; the value,
+    and the offset just past the tnetstring.  Returns None if the tnetstring is not yet complete."""
+    found			= _frame( buf, offset, len( buf ))
+    if found is None:
+        return None
+    beg,end,typ			= found
+    with memoryview( buf ) as view:
+        return _value( buf, view, beg, end, typ, encoding ),end + 1
+
+
+def payload( data, typ, encoding='utf-8' ):
+    """Decode the complete tnetstring payload data (bytes), of type typ (a bytes symbol or int)."""
+    if not isinstance( typ, int ):
+        typ			= bytearray( typ )[0]
+    with memoryview( data ) as view:
+        return _value( data, view, 0, len( data ), typ, encoding )
+
+
+class decoder( object ):
+    """Frame tnetstrings received in arbitrary chunks.  Each chunk received is appended to a buffer
+    (after discarding any already decoded tnetstrings); iterating yields each complete tnetstring
+    decoded, skipping any 'ignore' symbols (eg. b'\n') between them.
+
+        dec			= decoder()
+        dec.feed( b'5:hel' )
+        list( dec )		# []
+        dec.feed( b'lo,' )
+        list( dec )		# [ b'hello' ]
+
+    """
+    def __init__( self, encoding='utf-8', ignore=None ):
+        self.encoding		= encoding
+        self.ignore		= ignore
+        self.buf		= bytearray()
+        self.pos		= 0		# offset of the next undecoded tnetstring
+
+    def __len__( self ):
+        """Bytes received but not yet decoded."""
+        return len( self.buf ) - self.pos
+
+    def feed( self, data ):
+        if self.pos:
+            del self.buf[:self.pos]
+            self.pos		= 0
+        self.buf	       += data
+
+    def __iter__( self ):
+        while True:
+            if self.ignore:
+                while self.pos < len( self.buf ) and self.buf[self.pos] in self.ignore:
+                    self.pos   += 1
+            found		= decode( self.buf, self.pos, encoding=self.encoding )
+            if found is None:
+                break
+            value,self.pos	= found
+            yield value
+
+
 def tnet_from( conn, addr,
                timeout	= None,
                latency	= None,		# Optionally check server.done regularly
                ignore	= None,		# Optional symbols (bytes) to ignore
                source	= None,		# Provide a cpppo.chainable, if desire, to receive into and parse from
                control	= None ): 	# eg. cpppo.dotdict( done = False ),
-    """Simplest possible TNET string parser generator, from a recv-able socket connection.  Currently
-    only receives TNET strings of the form <int>: ... UTF-8 encoded str ...$
+    """TNET string parser generator, from a recv-able socket connection.  Receives in large blocks,
+    and decodes every complete tnetstring received (of any type; see decode).
 
     Does not support a symbol source other than conn.
 
@@ -56,72 +238,29 @@ def tnet_from( conn, addr,
     """
     assert source is None, \
         "Unsupported source: {source!r}".format( source=source )
+    receiver			= network.receiver( conn )
+    dec				= decoder( ignore=ignore )
+    started			= cpppo.timer()
     while not ( control and control.get( 'done' )):
-        started			= cpppo.timer()
-
-        def recv( maxlen ):
-            now			= cpppo.timer()
-            duration		= now - started
-            remains		= latency if timeout is None else min(	# If no timeout, wait for latency (or forever, if None)
-                timeout if latency is None else latency,	# Or, we know timeout is numeric; get min of any latency
-                max( timeout - duration, 0 ))			#  ... and remaining unused timeout
-            data		= network.recv( conn, maxlen=maxlen, timeout=remains ) # None (timeout) / b'' (EOF) / b'...'
-            #log.warning( "recv: (after {dur:7.3f}/{rem:7.3f}s): {data!r}".format( dur=cpppo.timer() - now, rem=remains, data=data ))
-            return data
-
-        length,c		= b'',b'0' # remember: b'' is trivially considered as "in" b'...'
-        while not ( control and control.get( 'done' )) and c and ( c in b'01234567889' or ( ignore and c in ignore )):
-            if not ignore or c not in ignore:
-                assert c in b'0123456789', "Expected TNET size symbol, not {c!r}".format( c=c ) # EOF/timeout
-                length         += c
-            c			= None
-            while not ( control and control.get( 'done' )) and c is None:
-                c		= recv( 1 )
-                if c is None and timeout is not None and cpppo.timer() - started > timeout:
-                    # No data w/in given timeout expiry!  Inform the consumer, and then try again w/ fresh timeout.
-                    yield None
-                    started = cpppo.timer()
-        if ( control and control.get( 'done' )) or not c: return # None/b'' ==> done/EOF
-        assert c == b':', "Expected TNET <size> separator ':', not {c!r}".format( c=c )
-        length			= int( length )
-
-        # Harvest the desired payload length, 'til timeout or completion.
-        payload,c		= b'',None
-        while not ( control and control.get( 'done' )) and c is None and len( payload ) < length:
-            c			= recv( length - len( payload ))
-            if c is None and timeout is not None and cpppo.timer() - started > timeout:
-                yield None
-                started		= cpppo.timer()
-                continue
-            payload            += c
-            c			= None
-        if ( control and control.get( 'done' )) or c == b'': return # done/EOF
-        assert len( payload ) == length, \
-            "Expected TNET {length}-byte payload; got {actual_length}-byte {actual}".format(
-                length=length, actual_length=len( payload ), actual=cpppo.reprlib.repr( payload ))
-
-        c			= None
-        while not ( control and control.get( 'done' )) and c is None:
-            c			= recv( 1 )
-            if c is None and timeout is not None and cpppo.timer() - started > timeout:
+        for msg in dec:
+            yield msg
+            started		= cpppo.timer()
+            if control and control.get( 'done' ):
+                return
+        duration		= cpppo.timer() - started
+        remains			= latency if timeout is None else min(	# If no timeout, wait for latency (or forever, if None)
+            timeout if latency is None else latency,		# Or, we know timeout is numeric; get min of any latency
+            max( timeout - duration, 0 ))			#  ... and remaining unused timeout
+        data			= receiver.recv( timeout=remains )	# None (timeout) / b'' (EOF) / memoryview
+        if data is None:
+            if timeout is not None and cpppo.timer() - started >= timeout:
+                # No data w/in given timeout expiry!  Inform the consumer, and then try again w/ fresh timeout.
                 yield None
                 started		= cpppo.timer()
-        if ( control and control.get( 'done' )) or c == b'': return # done/EOF
-        if c == b'$':
-            yield payload.decode( 'utf-8' )
             continue
-        elif c == b',':
-            yield payload
-            continue
-        elif c == b'#':
-            yield int( payload )
-            continue
-        elif c == b'~':
-            assert 0 == len( payload )
-            yield None # TODO: Indistinguishable from timeout?
-            continue
-
-        raise "Expected TNET payload type, not {c}".format( c=c )
+        if not len( data ):
+            return # EOF
+        dec.feed( data )
 
 
 def tnet_server_json( conn, addr, timeout=None, latency=None, ignore=None, server=None ):
@@ -18,6 +18,7 @@ console_scripts			= [
     'enip_server	= cpppo.server.enip.main:main',
     'enip_client	= cpppo.server.enip.client:main',
     'enip_get_attribute	= cpppo.server.enip.get_attribute:main',
+    'history_convert	= cpppo.bin.history_convert:main',
 ]
 if sys.version_info[0:2] < (3,0):
     console_scripts	       += [
@@ -44,6 +45,7 @@ options_require			= [
     'serial',
     'dev',
     'timestamp',
+    'zstd',		# History .zst compression via zstandard
 ]
 extras_require			= {
     option: list(
@@ -68,6 +70,7 @@ package_dir			= {
     "cpppo/remote":		"./remote",
     "cpppo/history":		"./history",
     "cpppo/tools":		"./tools",
+    "cpppo/bench":		"./bench",
     "cpppo/bin":		"./bin",
 }
 